@@ -8,6 +8,7 @@ const { URL } = require('url');
 const fs = require('fs/promises');
 const fsSync = require('fs');
 const path = require('path');
+const crypto = require('crypto');
 
 const { registerCommands } = require('./commands/registerCommands');
 const {  handleGate, handleEval } = require('./commands/slashBot');
@@ -283,9 +284,14 @@ async function callHarper(cmd, payload, headers, opts = {}) {
       ? opts.timeoutMs
       : HARPER_REQUEST_TIMEOUT_MS;
 
+  // W3C trace context: orchestrator e gateway annidano i loro span sotto questo trace
+  const traceId = crypto.randomBytes(16).toString('hex');
+  const traceparent = `00-${traceId}-${crypto.randomBytes(8).toString('hex')}-01`;
+  headers = { ...(headers || {}), traceparent, 'x-request-id': traceparent };
+
   try {
     log(
-      `[harper] calling ${url} cmd=${cmd} timeout=${timeoutMs}ms (long http)`
+      `[harper] calling ${url} cmd=${cmd} timeout=${timeoutMs}ms trace_id=${traceId} (long http)`
     );
     logCurrentTimeStandard("[harper] calling");
 
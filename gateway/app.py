@@ -1,19 +1,32 @@
 import logging
 import os
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from starlette.middleware.base import BaseHTTPMiddleware
 from starlette.responses import JSONResponse
 
+from routes.blobs import router as blobs_router
 from routes.chat import router as chat_router
 from routes.embeddings import router as embed_router
 from routes.health import router as health_router
+from routes.metrics import router as metrics_router
 from routes.models import router as models_router
 from routes.harper import router as harper_router
 from routes.telemetry_api import router as telemetry_api_router
 from routes.telemetry_ui import router as telemetry_ui_router
+from routes.tokenize import router as tokenize_router
 
 from middleware_security import SecureHeaders
+from access_log import AccessLogMiddleware
+from utils.tracing import TracingMiddleware
+from config import load_models_cfg
+import http_pool
+import metrics
+import remote_catalog
+import routing_stats
+import telemetry_writer
+import prompt_registry
+from utils import blob_store, extraction, tokenizer, tracing
 
 from pathlib import Path
 from fastapi.staticfiles import StaticFiles
@@ -23,7 +36,41 @@ LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
 logging.basicConfig(level=LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s %(message)s")
 logger = logging.getLogger("gateway")
 
-app = FastAPI(title="Clike Gateway (AI Pipilines for enabling Vibe Code for StartUp & Entprise Solutions)", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Connection pool condivisi per i provider (limiti da models.yaml → http:)
+    try:
+        cfg, _ = load_models_cfg()
+    except Exception as e:
+        logger.warning("models.yaml not loaded for http pool config: %s", e)
+        cfg = {}
+    http_pool.startup(cfg.get("http") or {})
+    # prompt/template Harper in memoria prima della prima richiesta
+    prompt_registry.registry().preload()
+    # encoder tiktoken per il budgeting (I/O dei BPE in un thread)
+    await tokenizer.startup()
+    await telemetry_writer.startup()
+    # prefetch + refresh periodico delle liste modelli dei provider remoti
+    await remote_catalog.startup()
+    # stats misurate per il routing (telemetria) calcolate in un thread
+    await routing_stats.startup()
+    # retention del blob store allegati (sweep periodico in un thread)
+    await blob_store.startup()
+    # event-loop lag per /metrics
+    await metrics.startup()
+    try:
+        yield
+    finally:
+        await metrics.shutdown()
+        await remote_catalog.shutdown()
+        await routing_stats.shutdown()
+        await blob_store.shutdown()
+        extraction.shutdown()
+        await telemetry_writer.shutdown()
+        await http_pool.shutdown()
+        tracing.shutdown()
+
+app = FastAPI(title="Clike Gateway (AI Pipilines for enabling Vibe Code for StartUp & Entprise Solutions)", version="1.0.0", lifespan=lifespan)
 
 # app.add_middleware(
 #     CORSMiddleware,
@@ -38,7 +85,8 @@ app.add_middleware(
     allow_origins=["http://localhost:5173", "vscode-web://*"],
     allow_credentials=True,
     allow_methods=["GET","POST","OPTIONS"],
-    allow_headers=["authorization","content-type","x-request-id"],
+    allow_headers=["authorization","content-type","x-request-id","traceparent"],
+    expose_headers=["traceparent","x-trace-id"],
 )
 app.add_middleware(SecureHeaders)
 # Mount /static  (metti il logo in gateway/static/clike_64x64.png)
@@ -46,18 +94,10 @@ STATIC_DIR = Path(__file__).resolve().parent / "static"
 STATIC_DIR.mkdir(parents=True, exist_ok=True)
 app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 
-class LogMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        try:
-            body = await request.body()
-            logger.info(f"[REQ] {request.method} {request.url} ct={request.headers.get('content-type')} len={len(body)}")
-        except Exception:
-            logger.warning("[REQ] failed to read body for logging")
-        resp = await call_next(request)
-        logger.info(f"[RES] {request.method} {request.url} -> {resp.status_code}")
-        return resp
-
-app.add_middleware(LogMiddleware)
+# access log ASGI puro: misura size/durata senza leggere il body (niente doppio buffer dei payload)
+app.add_middleware(AccessLogMiddleware)
+# trace context W3C (traceparent / x-request-id): esterno all'access log, che così logga il trace_id
+app.add_middleware(TracingMiddleware)
 
 @app.exception_handler(Exception)
 async def unhandled_ex_handler(request: Request, exc: Exception):
@@ -78,3 +118,6 @@ app.include_router(models_router)
 app.include_router(harper_router)
 app.include_router(telemetry_api_router)
 app.include_router(telemetry_ui_router)
+app.include_router(tokenize_router)
+app.include_router(blobs_router)
+app.include_router(metrics_router)
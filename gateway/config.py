@@ -1,10 +1,9 @@
 import os
-import yaml
 from typing import Any, Dict, List, Tuple
 
+from model_catalog import get_catalog
+
 def load_models_cfg(path: str | None = None) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
-    cfg_path = path or os.getenv("MODELS_CONFIG", "/workspace/configs/models.yaml")
-    with open(cfg_path, "r", encoding="utf-8") as f:
-        data = yaml.safe_load(f) or {}
-    models = data.get("models") or []
-    return data, models
+    # servito dal catalogo in memoria (parse una volta, hot reload su mtime): sola lettura
+    cat = get_catalog(path or os.getenv("MODELS_CONFIG", "/workspace/configs/models.yaml"))
+    return cat.cfg, cat.models
@@ -0,0 +1,257 @@
+# gateway/http_pool.py
+"""
+Registry gateway-wide di httpx.AsyncClient condivisi.
+
+- Un client (= un connection pool) per origin (scheme://host:port) dei provider.
+- Creato allo startup FastAPI (lifespan) e chiuso allo shutdown; se usato prima
+  dello startup (script/test) si inizializza in modo lazy con i default.
+- Limiti keep-alive configurabili in models.yaml:
+
+    http:
+      pool:
+        max_connections: 100
+        max_keepalive_connections: 20
+        keepalive_expiry: 30
+        connect_timeout: 10
+        http2: true
+      hosts:
+        api.anthropic.com: {max_connections: 50}
+
+- HTTP/2 viene abilitato solo se il pacchetto 'h2' è installato (httpx[http2])
+  e solo per origin https.
+- Statistiche di saturazione per pool (in_flight, peak, saturated) via pool_stats().
+- Ogni richiesta alimenta provider_health (latenza/errori per origin) e, con il
+  breaker aperto, fallisce subito con httpx.ConnectError.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import provider_health
+from utils import tracing
+
+try:  # HTTP/2 opzionale
+    import h2  # noqa: F401
+    _H2_AVAILABLE = True
+except Exception:
+    _H2_AVAILABLE = False
+
+log = logging.getLogger("gateway.http_pool")
+
+DEFAULT_POOL_CFG: Dict[str, Any] = {
+    "max_connections": 100,
+    "max_keepalive_connections": 20,
+    "keepalive_expiry": 30.0,
+    "connect_timeout": 10.0,
+    "http2": True,
+}
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url or "")
+    scheme = (parts.scheme or "http").lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port or (443 if scheme == "https" else 80)
+    return f"{scheme}://{host}:{port}"
+
+
+class _PoolStats:
+    __slots__ = ("origin", "max_connections", "http2", "in_flight", "peak_in_flight",
+                 "requests_total", "errors_total", "saturated_total", "created_at")
+
+    def __init__(self, origin: str, max_connections: int, http2: bool):
+        self.origin = origin
+        self.max_connections = max_connections
+        self.http2 = http2
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests_total = 0
+        self.errors_total = 0
+        self.saturated_total = 0
+        self.created_at = time.time()
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "origin": self.origin,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "utilization": round(self.in_flight / self.max_connections, 4) if self.max_connections else 0.0,
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "saturated_total": self.saturated_total,
+        }
+
+
+class _TrackedStream(httpx.AsyncByteStream):
+    """Rilascia lo slot 'in_flight' quando il body della risposta viene chiuso."""
+
+    def __init__(self, inner: httpx.AsyncByteStream, stats: _PoolStats, span: Optional[tracing.Span] = None):
+        self._inner = inner
+        self._stats = stats
+        self._span = span
+        self._released = False
+
+    async def __aiter__(self):
+        async for chunk in self._inner:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._inner.aclose()
+        finally:
+            if not self._released:
+                self._released = True
+                self._stats.in_flight -= 1
+                if self._span is not None:
+                    self._span.end()  # lo span provider copre anche il body (stream SSE incluso)
+
+
+class _TrackedTransport(httpx.AsyncBaseTransport):
+    """Wrapper del transport httpx che conta le richieste in volo per pool."""
+
+    def __init__(self, inner: httpx.AsyncBaseTransport, stats: _PoolStats):
+        self._inner = inner
+        self._stats = stats
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        st = self._stats
+        st.requests_total += 1
+        if st.in_flight >= st.max_connections:
+            st.saturated_total += 1
+            log.debug("http_pool saturated origin=%s in_flight=%d max=%d",
+                      st.origin, st.in_flight, st.max_connections)
+        health = provider_health.tracker()
+        if provider_health.FAST_FAIL and not health.allow(st.origin):
+            # breaker aperto: fallisci subito invece di attendere timeout da centinaia di secondi
+            st.errors_total += 1
+            raise httpx.ConnectError(f"circuit open for {st.origin}", request=request)
+        st.in_flight += 1
+        st.peak_in_flight = max(st.peak_in_flight, st.in_flight)
+        # span solo dentro un trace (richiesta servita); niente traceparent verso i provider esterni
+        sp = None
+        if tracing.current() is not None:
+            sp = tracing.start_span("provider.http", kind="client", origin=st.origin,
+                                    method=request.method, path=request.url.path)
+        t0 = time.monotonic()
+        try:
+            resp = await self._inner.handle_async_request(request)
+        except asyncio.CancelledError:
+            st.in_flight -= 1
+            health.release(st.origin)
+            if sp is not None:
+                sp.fail("cancelled").end()
+            raise
+        except BaseException as e:
+            st.in_flight -= 1
+            st.errors_total += 1
+            health.record(st.origin, False, error=f"{type(e).__name__}: {e}")
+            if sp is not None:
+                sp.fail(e).end()
+            raise
+        if resp.status_code == 429 or resp.status_code >= 500:
+            health.record(st.origin, False, error=f"HTTP {resp.status_code}")
+        else:
+            health.record(st.origin, True, latency_s=time.monotonic() - t0)
+        if sp is not None:
+            sp.set(status_code=resp.status_code, ttfb_ms=round((time.monotonic() - t0) * 1000, 1))
+            if resp.status_code == 429 or resp.status_code >= 500:
+                sp.fail(f"HTTP {resp.status_code}")
+        resp.stream = _TrackedStream(resp.stream, st, sp)  # type: ignore[arg-type]
+        return resp
+
+    async def aclose(self) -> None:
+        await self._inner.aclose()
+
+
+class ClientRegistry:
+    def __init__(self, cfg: Optional[Dict[str, Any]] = None):
+        cfg = cfg or {}
+        self._defaults = {**DEFAULT_POOL_CFG, **(cfg.get("pool") or {})}
+        self._hosts: Dict[str, Dict[str, Any]] = {
+            str(k).lower(): (v or {}) for k, v in (cfg.get("hosts") or {}).items()
+        }
+        self._clients: Dict[str, httpx.AsyncClient] = {}
+        self._stats: Dict[str, _PoolStats] = {}
+
+    def _pool_cfg(self, origin: str) -> Dict[str, Any]:
+        host = (urlsplit(origin).hostname or "").lower()
+        return {**self._defaults, **self._hosts.get(host, {})}
+
+    def get(self, url: str) -> httpx.AsyncClient:
+        origin = _origin(url)
+        client = self._clients.get(origin)
+        if client is not None and not client.is_closed:
+            return client
+
+        pc = self._pool_cfg(origin)
+        max_conn = int(pc.get("max_connections") or DEFAULT_POOL_CFG["max_connections"])
+        limits = httpx.Limits(
+            max_connections=max_conn,
+            max_keepalive_connections=int(pc.get("max_keepalive_connections") or 0),
+            keepalive_expiry=float(pc.get("keepalive_expiry") or 0) or None,
+        )
+        http2 = bool(pc.get("http2")) and _H2_AVAILABLE and origin.startswith("https://")
+        stats = _PoolStats(origin, max_conn, http2)
+        transport = _TrackedTransport(httpx.AsyncHTTPTransport(limits=limits, http2=http2), stats)
+        # timeout di default: connect limitato, read/write lasciati al chiamante (per-request)
+        timeout = httpx.Timeout(None, connect=float(pc.get("connect_timeout") or 10.0))
+        client = httpx.AsyncClient(transport=transport, timeout=timeout)
+        self._clients[origin] = client
+        self._stats[origin] = stats
+        log.info("http_pool created origin=%s max_connections=%d keepalive=%s http2=%s",
+                 origin, max_conn, limits.max_keepalive_connections, http2)
+        return client
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "http2_available": _H2_AVAILABLE,
+            "pools": [s.as_dict() for s in self._stats.values()],
+        }
+
+    async def aclose(self) -> None:
+        for origin, client in list(self._clients.items()):
+            try:
+                await client.aclose()
+            except Exception as e:
+                log.warning("http_pool close failed origin=%s: %s", origin, e)
+        self._clients.clear()
+
+
+_REGISTRY: Optional[ClientRegistry] = None
+
+
+def startup(cfg: Optional[Dict[str, Any]] = None) -> ClientRegistry:
+    """Inizializza il registry (chiamato dal lifespan FastAPI)."""
+    global _REGISTRY
+    _REGISTRY = ClientRegistry(cfg)
+    log.info("http_pool ready defaults=%s http2_available=%s", _REGISTRY._defaults, _H2_AVAILABLE)
+    return _REGISTRY
+
+
+async def shutdown() -> None:
+    global _REGISTRY
+    if _REGISTRY is not None:
+        await _REGISTRY.aclose()
+        _REGISTRY = None
+
+
+def get_client(url: str) -> httpx.AsyncClient:
+    """Client condiviso per l'origin di 'url' (lazy init se lo startup non è avvenuto)."""
+    global _REGISTRY
+    if _REGISTRY is None:
+        _REGISTRY = ClientRegistry()
+    return _REGISTRY.get(url)
+
+
+def pool_stats() -> Dict[str, Any]:
+    if _REGISTRY is None:
+        return {"http2_available": _H2_AVAILABLE, "pools": []}
+    return _REGISTRY.stats()
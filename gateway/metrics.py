@@ -0,0 +1,283 @@
+# gateway/metrics.py
+"""
+Registry di metriche in formato Prometheus (text exposition 0.0.4) servito da GET /metrics.
+
+- Counter / Gauge / Histogram con label, thread-safe, senza dipendenze esterne.
+- Collector a scrape-time per lo stato già tenuto altrove (pool HTTP, breaker, access log, code):
+  nessun doppio conteggio sul percorso caldo, i valori si leggono solo quando Prometheus chiede.
+- LLM: durata per provider/model/outcome, time-to-first-token (stream), token in/out, token letti
+  e scritti dalla prompt cache del provider, esiti della response cache.
+- Event-loop lag: un task dorme LOOP_LAG_INTERVAL_S e misura il ritardo del risveglio.
+"""
+from __future__ import annotations
+
+import asyncio
+import bisect
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from utils.prompt_cache import cache_usage
+
+log = logging.getLogger("gateway.metrics")
+
+LOOP_LAG_INTERVAL_S = float(os.getenv("LOOP_LAG_INTERVAL_S", "0.5"))
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+LLM_BUCKETS: Tuple[float, ...] = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 20.0, 30.0, 60.0, 120.0, 300.0, 600.0)
+
+# campione: (suffisso del nome, label, valore)
+Sample = Tuple[str, Dict[str, Any], float]
+
+
+def _esc(v: Any) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(v: float) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    if v == float("-inf"):
+        return "-Inf"
+    return repr(float(v))
+
+
+def histogram_samples(buckets: Sequence[float], counts: Sequence[int], total: float, count: int,
+                      labels: Dict[str, Any]) -> List[Sample]:
+    """counts per bucket (non cumulativi, ultimo = +Inf) → campioni _bucket/_sum/_count."""
+    out: List[Sample] = []
+    acc = 0
+    for i, c in enumerate(counts):
+        acc += c
+        le = buckets[i] if i < len(buckets) else float("inf")
+        out.append(("_bucket", {**labels, "le": _fmt(le)}, acc))
+    out.append(("_sum", labels, total))
+    out.append(("_count", labels, count))
+    return out
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.doc = doc
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(n, "")) for n in self.labelnames)
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            return [("", dict(zip(self.labelnames, k)), v) for k, v in self._values.items()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            self._values[k] = self._values.get(k, 0.0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = float(value)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, doc: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, doc, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value: float, **labels) -> None:
+        k = self._key(labels)
+        with self._lock:
+            h = self._values.get(k)
+            if h is None:
+                h = self._values[k] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            h[0][bisect.bisect_left(self.buckets, value)] += 1
+            h[1] += value
+            h[2] += 1
+
+    def samples(self) -> List[Sample]:
+        with self._lock:
+            items = [(k, list(h[0]), h[1], h[2]) for k, h in self._values.items()]
+        out: List[Sample] = []
+        for k, counts, total, count in items:
+            out.extend(histogram_samples(self.buckets, counts, total, count, dict(zip(self.labelnames, k))))
+        return out
+
+
+class Family:
+    """Metrica prodotta da un collector a scrape-time."""
+
+    def __init__(self, name: str, kind: str, doc: str, samples: Optional[List[Sample]] = None):
+        self.name = name
+        self.kind = kind
+        self.doc = doc
+        self._samples = samples or []
+
+    def add(self, labels: Dict[str, Any], value: float, suffix: str = "") -> "Family":
+        self._samples.append((suffix, labels, value))
+        return self
+
+    def samples(self) -> List[Sample]:
+        return self._samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+        self._collectors: List[Callable[[], Iterable[Family]]] = []
+
+    def _add(self, m):
+        self._metrics.append(m)
+        return m
+
+    def counter(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, doc, labelnames))
+
+    def gauge(self, name: str, doc: str, labelnames: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(name, doc, labelnames))
+
+    def histogram(self, name: str, doc: str, labelnames: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, doc, labelnames, buckets))
+
+    def collector(self, fn: Callable[[], Iterable[Family]]) -> Callable[[], Iterable[Family]]:
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        families: List[Any] = list(self._metrics)
+        for fn in self._collectors:
+            try:
+                families.extend(fn())
+            except Exception as e:
+                log.warning("metrics collector %s failed: %s", getattr(fn, "__name__", fn), e)
+        lines: List[str] = []
+        for f in families:
+            samples = f.samples()
+            lines.append(f"# HELP {f.name} {_esc(f.doc)}")
+            lines.append(f"# TYPE {f.name} {f.kind}")
+            for suffix, labels, value in samples:
+                lbl = ",".join(f'{k}="{_esc(v)}"' for k, v in labels.items())
+                lines.append(f"{f.name}{suffix}{{{lbl}}} {_fmt(value)}" if lbl else f"{f.name}{suffix} {_fmt(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def registry() -> Registry:
+    return REGISTRY
+
+
+# --- event loop lag -------------------------------------------------------------
+LOOP_LAG = REGISTRY.gauge("clike_event_loop_lag_seconds", "Ritardo dell'ultimo risveglio del task di misura")
+LOOP_LAG_HIST = REGISTRY.histogram("clike_event_loop_lag_distribution_seconds", "Distribuzione del ritardo dell'event loop",
+                                   buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+
+
+class LoopLagMonitor:
+    def __init__(self, interval_s: float = LOOP_LAG_INTERVAL_S):
+        self.interval_s = max(0.05, float(interval_s))
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            t0 = loop.time()
+            await asyncio.sleep(self.interval_s)
+            lag = max(0.0, loop.time() - t0 - self.interval_s)
+            LOOP_LAG.set(lag)
+            LOOP_LAG_HIST.observe(lag)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="loop-lag-monitor")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_MONITOR: Optional[LoopLagMonitor] = None
+
+
+async def startup() -> None:
+    global _MONITOR
+    _MONITOR = LoopLagMonitor()
+    _MONITOR.start()
+
+
+async def shutdown() -> None:
+    global _MONITOR
+    if _MONITOR is not None:
+        await _MONITOR.stop()
+        _MONITOR = None
+
+
+# --- LLM --------------------------------------------------------------------------
+LLM_LATENCY = REGISTRY.histogram("clike_llm_request_seconds", "Durata delle chiamate LLM (cache hit inclusi)",
+                                 ("provider", "model", "outcome"), buckets=LLM_BUCKETS)
+LLM_TTFT = REGISTRY.histogram("clike_llm_ttft_seconds", "Time-to-first-token delle chiamate in streaming",
+                              ("provider", "model"), buckets=LLM_BUCKETS)
+LLM_TOKENS = REGISTRY.counter("clike_llm_tokens_total", "Token consumati dai provider (cache hit esclusi)",
+                              ("provider", "model", "direction"))
+PROMPT_CACHE_TOKENS = REGISTRY.counter("clike_prompt_cache_tokens_total",
+                                       "Token di input letti/scritti dalla prompt cache del provider",
+                                       ("provider", "model", "kind"))
+RESPONSE_CACHE = REGISTRY.counter("clike_llm_response_cache_total", "Esiti della response cache exact-match",
+                                  ("result",))
+
+
+def usage_tokens(usage: Optional[Dict[str, Any]]) -> Tuple[int, int]:
+    # envelope (input/output_tokens) o usage OpenAI-like (prompt/completion_tokens)
+    u = usage or {}
+    try:
+        tin = int(u.get("input_tokens") or u.get("prompt_tokens") or 0)
+        tout = int(u.get("output_tokens") or u.get("completion_tokens") or 0)
+    except (TypeError, ValueError):
+        return 0, 0
+    return tin, tout
+
+
+def observe_llm(provider: str, model: str, seconds: float, *, usage: Optional[Dict[str, Any]] = None,
+                ok: bool = True, cache: Optional[str] = None, ttft_s: Optional[float] = None) -> None:
+    provider = (provider or "").lower() or "unknown"
+    model = model or "unknown"
+    outcome = "error" if not ok else ("cache_hit" if cache == "hit" else "ok")
+    LLM_LATENCY.observe(seconds, provider=provider, model=model, outcome=outcome)
+    if cache:
+        RESPONSE_CACHE.inc(result=cache)
+    if ttft_s is not None:
+        LLM_TTFT.observe(ttft_s, provider=provider, model=model)
+    if not ok or cache == "hit" or not usage:
+        return
+    tin, tout = usage_tokens(usage)
+    if tin:
+        LLM_TOKENS.inc(tin, provider=provider, model=model, direction="in")
+    if tout:
+        LLM_TOKENS.inc(tout, provider=provider, model=model, direction="out")
+    pc = cache_usage(usage)
+    if pc["read_tokens"]:
+        PROMPT_CACHE_TOKENS.inc(pc["read_tokens"], provider=provider, model=model, kind="read")
+    if pc["creation_tokens"]:
+        PROMPT_CACHE_TOKENS.inc(pc["creation_tokens"], provider=provider, model=model, kind="write")
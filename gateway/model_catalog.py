@@ -0,0 +1,221 @@
+# gateway/model_catalog.py
+"""
+Catalogo modelli: models.yaml parsato una volta e indicizzato.
+
+- Indici: per id, name, alias (id/name/remote_name/aliases, case-insensitive),
+  modality (embedding|embeddings normalizzati), provider; profili e routing già estratti.
+- Hot reload: ad ogni get_catalog() (al più ogni MODELS_CONFIG_CHECK_S secondi) si confronta
+  mtime/size/inode del file; se cambiato si ri-parsa. Niente dipendenza da inotify: un os.stat
+  ogni pochi secondi costa meno del watcher e funziona anche su bind-mount Docker.
+- Validazione: errori strutturali (top-level non mapping, models non lista, modello senza id/name,
+  id duplicati) → il nuovo file viene scartato e resta in uso la versione precedente;
+  riferimenti rotti (routing/profili verso modelli o profili inesistenti) → solo warning.
+- Gli oggetti restituiti sono condivisi tra le richieste: trattarli in sola lettura.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+log = logging.getLogger("gateway.model_catalog")
+
+DEFAULT_PATH = "/workspace/configs/models.yaml"
+CHECK_S = float(os.getenv("MODELS_CONFIG_CHECK_S", "2"))
+
+MODALITIES = {"chat", "embedding", "embeddings", "completion", "vision", "audio", "image", "rerank"}
+
+
+class CatalogError(ValueError):
+    pass
+
+
+def _norm_modality(m: Dict[str, Any]) -> str:
+    md = str(m.get("modality") or "chat").lower()
+    return "embeddings" if md in ("embedding", "embeddings") else md
+
+
+def validate(data: Any) -> Tuple[List[str], List[str]]:
+    """Ritorna (errors, warnings) per il contenuto di models.yaml."""
+    errors: List[str] = []
+    warnings: List[str] = []
+    if not isinstance(data, dict):
+        return ["top-level must be a mapping"], warnings
+    models = data.get("models") or []
+    if not isinstance(models, list):
+        return ["'models' must be a list"], warnings
+    seen: Dict[str, int] = {}
+    for i, m in enumerate(models):
+        if not isinstance(m, dict):
+            errors.append(f"models[{i}] must be a mapping")
+            continue
+        mid = m.get("id") or m.get("name")
+        if not mid:
+            errors.append(f"models[{i}] has neither 'id' nor 'name'")
+            continue
+        if m.get("id"):
+            if m["id"] in seen:
+                errors.append(f"duplicate model id '{m['id']}' (models[{seen[m['id']]}] and models[{i}])")
+            seen.setdefault(m["id"], i)
+        md = str(m.get("modality") or "chat").lower()
+        if md not in MODALITIES:
+            warnings.append(f"model '{mid}': unknown modality '{md}'")
+    profiles = data.get("profiles") or {}
+    routing = data.get("routing") or {}
+    if not isinstance(profiles, dict):
+        errors.append("'profiles' must be a mapping")
+        profiles = {}
+    if not isinstance(routing, dict):
+        errors.append("'routing' must be a mapping")
+        routing = {}
+    known = set(seen) | {m.get("name") for m in models if isinstance(m, dict) and m.get("name")}
+    for pname, p in profiles.items():
+        p = p or {}
+        sel = p.get("select") or {}
+        refs = [p.get("model") or sel.get("model")] + list(p.get("fallback") or sel.get("fallback") or [])
+        for ref in refs:
+            for r in (ref if isinstance(ref, list) else [ref]):
+                if r and r not in known:
+                    warnings.append(f"profile '{pname}' references unknown model '{r}'")
+    for task, pname in routing.items():
+        if pname and pname not in profiles:
+            warnings.append(f"routing '{task}' references unknown profile '{pname}'")
+    return errors, warnings
+
+
+class ModelCatalog:
+    """Snapshot immutabile di models.yaml con indici precalcolati."""
+
+    def __init__(self, data: Dict[str, Any], *, path: str = "", version: int = 0):
+        self.path = path
+        self.version = version
+        self.loaded_at = time.time()
+        self.cfg: Dict[str, Any] = data
+        self.models: List[Dict[str, Any]] = list(data.get("models") or [])
+        self.profiles: Dict[str, Any] = dict(data.get("profiles") or {})
+        self.routing: Dict[str, Any] = dict(data.get("routing") or {})
+        self.by_id: Dict[str, Dict[str, Any]] = {}
+        self.by_name: Dict[str, Dict[str, Any]] = {}
+        self.by_alias: Dict[str, List[Dict[str, Any]]] = {}
+        self.by_modality: Dict[str, List[Dict[str, Any]]] = {}
+        self.by_provider: Dict[str, List[Dict[str, Any]]] = {}
+        for m in self.models:
+            if m.get("id"):
+                self.by_id.setdefault(m["id"], m)
+            if m.get("name"):
+                self.by_name.setdefault(m["name"], m)
+            keys = {str(m.get(k)).lower() for k in ("id", "name", "remote_name") if m.get(k)}
+            keys |= {str(a).lower() for a in (m.get("aliases") or [])}
+            for k in keys:
+                self.by_alias.setdefault(k, []).append(m)
+            self.by_modality.setdefault(_norm_modality(m), []).append(m)
+            self.by_provider.setdefault(str(m.get("provider") or "").lower(), []).append(m)
+        # routing precalcolato: task → profilo (normalizzato: model/fallback fuori da select)
+        self.route_profiles: Dict[str, Dict[str, Any]] = {}
+        for task, pname in self.routing.items():
+            p = dict(self.profiles.get(pname) or {})
+            sel = dict(p.get("select") or {})
+            p.setdefault("model", sel.pop("model", None))
+            p.setdefault("fallback", sel.pop("fallback", None) or [])
+            p["select"] = sel
+            p["name"] = pname
+            self.route_profiles[task] = p
+
+    def find(self, key: str, *, enabled_default: bool = True) -> Optional[Dict[str, Any]]:
+        """Primo modello abilitato con id/name/remote_name/alias == key (case-insensitive)."""
+        for m in self.by_alias.get((key or "").strip().lower(), ()):
+            if m.get("enabled", enabled_default):
+                return m
+        return None
+
+    def enabled(self, *, enabled_default: bool = True) -> List[Dict[str, Any]]:
+        return [m for m in self.models if m.get("enabled", enabled_default)]
+
+    def modality(self, modality: str) -> List[Dict[str, Any]]:
+        return list(self.by_modality.get(_norm_modality({"modality": modality}), ()))
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "version": self.version,
+            "loaded_at": self.loaded_at,
+            "models": len(self.models),
+            "profiles": len(self.profiles),
+            "routing": dict(self.routing),
+        }
+
+
+class _CatalogHolder:
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._catalog: Optional[ModelCatalog] = None
+        self._sig: Optional[Tuple[int, int, int]] = None
+        self._checked = 0.0
+        self._version = 0
+        self.last_error: Optional[str] = None
+
+    def _signature(self) -> Tuple[int, int, int]:
+        st = os.stat(self.path)
+        return (st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def _load(self, sig: Tuple[int, int, int]) -> None:
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+        errors, warnings = validate(data)
+        for w in warnings:
+            log.warning("models.yaml %s: %s", self.path, w)
+        if errors:
+            raise CatalogError("; ".join(errors))
+        self._version += 1
+        self._catalog = ModelCatalog(data, path=self.path, version=self._version)
+        self._sig = sig
+        self.last_error = None
+        log.info("models catalog loaded path=%s version=%d models=%d",
+                 self.path, self._version, len(self._catalog.models))
+
+    def get(self) -> ModelCatalog:
+        now = time.monotonic()
+        if self._catalog is not None and now - self._checked < CHECK_S:
+            return self._catalog
+        with self._lock:
+            if self._catalog is not None and now - self._checked < CHECK_S:
+                return self._catalog
+            self._checked = now
+            try:
+                sig = self._signature()
+                if sig != self._sig:
+                    self._load(sig)
+            except Exception as e:
+                self.last_error = f"{type(e).__name__}: {e}"
+                if self._catalog is None:
+                    raise
+                # file rotto o assente durante il rollout: resta sulla versione buona
+                log.error("models.yaml reload failed, keeping version %d: %s", self._version, e)
+            return self._catalog
+
+
+_HOLDERS: Dict[str, _CatalogHolder] = {}
+_HOLDERS_LOCK = threading.Lock()
+
+
+def get_catalog(path: Optional[str] = None) -> ModelCatalog:
+    p = os.path.abspath(path or os.getenv("MODELS_CONFIG", DEFAULT_PATH))
+    h = _HOLDERS.get(p)
+    if h is None:
+        with _HOLDERS_LOCK:
+            h = _HOLDERS.setdefault(p, _CatalogHolder(p))
+    return h.get()
+
+
+def catalog_status() -> List[Dict[str, Any]]:
+    out = []
+    for h in list(_HOLDERS.values()):
+        d = h._catalog.info() if h._catalog else {"path": h.path}
+        d["last_error"] = h.last_error
+        out.append(d)
+    return out
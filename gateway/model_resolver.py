@@ -1,7 +1,13 @@
 # gateway/model_resolver.py
+import logging
 from typing import List, Dict, Optional, Tuple
 
-def _score_by_weights(m: Dict, weights: Dict[str, float]) -> float:
+from provider_health import model_available, model_penalty
+from routing_stats import routing_stats, score_mode
+
+log = logging.getLogger("gateway.model_resolver")
+
+def _score_by_weights(m: Dict, weights: Dict[str, float], measured: Optional[Dict] = None) -> float:
     # capacità: frontier>large>medium>small>tiny → punteggio minore = migliore
     cap = (m.get("capability") or "medium").lower()
     cap_rank = {"frontier": 0, "large": 0.5, "high": 0.75, "medium": 1.0, "small": 1.25, "tiny": 1.5}.get(cap, 1.0)
@@ -14,6 +20,16 @@ def _score_by_weights(m: Dict, weights: Dict[str, float]) -> float:
     cost = (m.get("cost") or "medium").lower()
     cost_rank = {"ultra-low": 0, "low": 0.5, "medium": 1.0, "high": 1.5}.get(cost, 1.0)
 
+    # modalità measured: latenza/costo dalla telemetria (norm 0.5 = mediana di fase → "medium")
+    fail = 0.0
+    if measured:
+        norm = measured.get("norm") or {}
+        if norm.get("latency") is not None:
+            lat_rank = 2.0 * norm["latency"]
+        if norm.get("cost") is not None:
+            cost_rank = 2.0 * norm["cost"]
+        fail = norm.get("failure") or 0.0
+
     # quality tag
     tags = set(m.get("tags") or [])
     q = 0.0
@@ -25,8 +41,28 @@ def _score_by_weights(m: Dict, weights: Dict[str, float]) -> float:
         + weights.get("latency", 0.2) * lat_rank
         + weights.get("cost", 0.2) * cost_rank
         + weights.get("quality", 0.1) * q
+        + weights.get("reliability", 0.3) * 2.0 * fail
     )
 
+def _healthy(models: List[Dict]) -> List[Dict]:
+    # scarta i modelli con breaker aperto; se nessuno è sano meglio provare comunque che fallire
+    ok = [m for m in models if model_available(m)]
+    if len(ok) < len(models):
+        log.info("resolve_model: skipped unhealthy %s",
+                 [m.get("id") or m.get("name") for m in models if m not in ok])
+    return ok or models
+
+def _rank(models: List[Dict], weights: Dict[str, float], *, mode: str = "static",
+          phase: Optional[str] = None) -> List[Dict]:
+    # punteggio (statico o misurato) + penalità di salute (latenza/error-rate EWMA) → minore = migliore
+    hw = weights.get("health", 0.5)
+    stats = routing_stats() if mode == "measured" else None
+
+    def key(m):
+        measured = stats.lookup(m, phase) if stats else None
+        return _score_by_weights(m, weights, measured) + hw * model_penalty(m)
+    return sorted(_healthy(models), key=key)
+
 def _filter_candidates(models: List[Dict], *, want_modality: Optional[str], select: Dict) -> List[Dict]:
     out = [m for m in models if m.get("enabled", True)]
     if want_modality:
@@ -58,12 +94,15 @@ def resolve_model(
     name_or_auto: str,
     *,
     profile: Optional[str] = None,
-    want_modality: Optional[str] = None
+    want_modality: Optional[str] = None,
+    phase: Optional[str] = None
 ) -> Dict:
     """
     - Se name_or_auto è un nome modello → prende quello (compat attuale).
     - Se profile è valorizzato o name_or_auto coincide con un profilo → usa 'profiles' di cfg.
     - Altrimenti 'auto' con preferenza locale e tie-break tramite 'scoring' di cfg.
+    - scoring.mode (o ROUTING_SCORE_MODE) = measured → latenza/costo/failure misurati
+      dalla telemetria per 'phase' al posto delle etichette statiche (routing_stats).
     """
     name_or_auto = (name_or_auto or "auto").strip()
 
@@ -82,15 +121,26 @@ def resolve_model(
         # se c’è un pin 'model', risolviamo quello direttamente
         pinned = (p.get("model") or "").strip()
         if pinned:
-            return _resolve_by_name(models, pinned, want_modality=want_modality)
+            m = _resolve_by_name(models, pinned, want_modality=want_modality)
+            if model_available(m):
+                return m
+            # pin non sano: primo fallback sano del profilo, altrimenti il pin stesso
+            for fb in (p.get("fallback") or []):
+                try:
+                    alt = _resolve_by_name(models, fb, want_modality=want_modality)
+                except RuntimeError:
+                    continue
+                if model_available(alt):
+                    log.info("resolve_model: pinned '%s' unhealthy, using fallback '%s'", pinned, fb)
+                    return alt
+            return m
         # altrimenti selettore + scoring
         select = p.get("select") or {}
         cands = _filter_candidates(models, want_modality=want_modality, select=select)
         if not cands:
             raise RuntimeError(f"profile '{prof_key}': no candidates after filters")
         weights = ((cfg.get("scoring") or {}).get("weights") or {})
-        cands.sort(key=lambda m: _score_by_weights(m, weights))
-        return cands[0]
+        return _rank(cands, weights, mode=score_mode(cfg), phase=phase)[0]
 
     # 3) AUTO: prefer locali (ollama/vllm), poi scoring
     def is_local(m): return (m.get("provider") or "").lower() in {"ollama", "vllm"}
@@ -99,7 +149,7 @@ def resolve_model(
         cands = [m for m in cands if (m.get("modality") == want_modality)]
     if not cands:
         raise RuntimeError("no enabled models matching filters")
+    cands = _healthy(cands)
     locals_first = [m for m in cands if is_local(m)] or cands
     weights = ((cfg.get("scoring") or {}).get("weights") or {})
-    locals_first.sort(key=lambda m: _score_by_weights(m, weights))
-    return locals_first[0]
+    return _rank(locals_first, weights, mode=score_mode(cfg), phase=phase)[0]
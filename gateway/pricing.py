@@ -46,6 +46,11 @@ class PricingManager:
         path = path or os.getenv("MODELS_CONFIG", "../config/models.yaml")
         data = cls._read_models_yaml(path)
         log.info("Found %d models in %s", len(data.get("models") or []), path)
+        return cls.from_cfg(data)
+
+    @classmethod
+    def from_cfg(cls, data: Dict[str, Any]) -> "PricingManager":
+        """Tabella prezzi da un models.yaml già parsato (es. model_catalog)."""
         table: Dict[str, Pricing] = {}
 
         for m in (data.get("models") or []):
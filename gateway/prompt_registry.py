@@ -0,0 +1,146 @@
+# gateway/prompt_registry.py
+"""
+Registry in memoria dei prompt/template Harper.
+
+- All'avvio (preload) legge tutti i system prompt di fase e i template (path da env
+  PROMPT_*_SYSTEM_PATH / SPEC_TEMPLATE_PATH): il path della richiesta non apre più file.
+- Invalidazione per mtime/size: al più ogni PROMPTS_CHECK_S secondi un os.stat per file;
+  se cambiato il file viene riletto (editing dei prompt senza restart).
+- Ogni entry espone lo sha256 del contenuto: usato come versione del prompt in telemetria
+  e nella chiave di prompt caching OpenAI (cambio prompt → nuova cache).
+- Path non registrati passano comunque dal registry (cache con la stessa invalidazione).
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+log = logging.getLogger("gateway.prompt_registry")
+
+CHECK_S = float(os.getenv("PROMPTS_CHECK_S", "2"))
+
+# nome logico → path (stessi env di routes/harper.py)
+PROMPT_PATHS: Dict[str, str] = {
+    "system:idea": os.getenv("PROMPT_IDEA_SYSTEM_PATH", "/app/prompts/harper/idea_system.md"),
+    "system:spec": os.getenv("PROMPT_SPEC_SYSTEM_PATH", "/app/prompts/harper/spec_system.md"),
+    "system:plan": os.getenv("PROMPT_PLAN_SYSTEM_PATH", "/app/prompts/harper/plan_system.md"),
+    "system:kit": os.getenv("PROMPT_KIT_SYSTEM_PATH", "/app/prompts/harper/kit_system.md"),
+    "system:build": os.getenv("PROMPT_BIULD_SYSTEM_PATH", "/app/prompts/harper/build_system.md"),
+    "system:finalize": os.getenv("PROMPT_FINALIZE_SYSTEM_PATH", "/app/prompts/harper/finalize_system.md"),
+    "template:spec": os.getenv("SPEC_TEMPLATE_PATH", "/app/templates/SPEC_TEMPLATE.md"),
+}
+
+_GONE = (0, 0, 0)  # firma di un file non (più) presente
+
+
+class PromptEntry:
+    __slots__ = ("path", "text", "sha256", "sig", "checked", "loaded_at", "missing")
+
+    def __init__(self, path: str):
+        self.path = path
+        self.text = ""
+        self.sha256 = hashlib.sha256(b"").hexdigest()
+        self.sig: Optional[Tuple[int, int, int]] = None
+        self.checked = 0.0
+        self.loaded_at = 0.0
+        self.missing = True
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "sha256": self.sha256,
+            "chars": len(self.text),
+            "missing": self.missing,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class PromptRegistry:
+    def __init__(self, paths: Dict[str, str] = PROMPT_PATHS, check_s: float = CHECK_S):
+        self.names = dict(paths)
+        self.check_s = check_s
+        self._entries: Dict[str, PromptEntry] = {}
+        self._lock = threading.Lock()
+
+    def _refresh(self, e: PromptEntry) -> None:
+        try:
+            st = os.stat(e.path)
+        except OSError:
+            if e.sig is None:
+                log.error("Error reading %s", e.path)
+            elif e.sig != _GONE:
+                log.error("prompt file disappeared: %s (keeping last content)", e.path)
+            e.sig = _GONE
+            return
+        sig = (st.st_ino, st.st_size, st.st_mtime_ns)
+        if sig == e.sig:
+            return
+        try:
+            with open(e.path, "r", encoding="utf-8", errors="replace") as f:
+                text = f.read()
+        except OSError as ex:
+            log.error("Error reading %s: %s", e.path, ex)
+            return
+        e.text = text
+        e.sha256 = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        e.sig = sig
+        e.missing = False
+        e.loaded_at = time.time()
+        log.info("Loading %s (sha256=%s)", e.path, e.sha256[:12])
+
+    def entry(self, name_or_path: str) -> PromptEntry:
+        path = self.names.get(name_or_path, name_or_path)
+        now = time.monotonic()
+        e = self._entries.get(path)
+        if e is not None and now - e.checked < self.check_s:
+            return e
+        with self._lock:
+            e = self._entries.get(path)
+            if e is None:
+                e = self._entries[path] = PromptEntry(path)
+            if now - e.checked >= self.check_s:
+                e.checked = now
+                self._refresh(e)
+            return e
+
+    def text(self, name_or_path: str) -> str:
+        return self.entry(name_or_path).text
+
+    def rendered(self, name_or_path: str, default: str = "") -> str:
+        """Testo pronto per il prompt: strip + default se il file manca o è vuoto."""
+        return self.entry(name_or_path).text.strip() or default
+
+    def sha256(self, name_or_path: str) -> str:
+        return self.entry(name_or_path).sha256
+
+    def preload(self) -> None:
+        for name in self.names:
+            self.entry(name)
+        loaded = sum(1 for n in self.names if not self.entry(n).missing)
+        log.info("prompt registry preloaded %d/%d files", loaded, len(self.names))
+
+    def snapshot(self) -> Dict[str, Any]:
+        by_path = {p: n for n, p in self.names.items()}
+        out = {}
+        for path, e in list(self._entries.items()):
+            out[by_path.get(path, path)] = e.as_dict()
+        return {"check_s": self.check_s, "prompts": out}
+
+
+_REGISTRY = PromptRegistry()
+
+
+def registry() -> PromptRegistry:
+    return _REGISTRY
+
+
+def read_text(name_or_path: str) -> str:
+    return _REGISTRY.text(name_or_path)
+
+
+def prompt_hash(name_or_path: str) -> str:
+    return _REGISTRY.sha256(name_or_path)
@@ -0,0 +1,205 @@
+# gateway/provider_health.py
+"""
+Salute dei provider per origin (scheme://host:port del base_url) + circuit breaker.
+
+- Alimentato da http_pool (_TrackedTransport): ogni richiesta verso un provider registra
+  esito e latenza (tempo fino agli header). Contano come errori eccezioni di rete/timeout
+  e risposte 429/5xx; i 4xx sono "provider vivo".
+- Per origin: EWMA della latenza, EWMA del tasso d'errore, errori consecutivi.
+- Breaker: closed → open dopo BREAKER_FAILURES errori consecutivi (o error-rate EWMA
+  ≥ BREAKER_ERROR_RATE con almeno BREAKER_MIN_SAMPLES campioni); dopo il cooldown passa
+  a half_open e lascia passare una sola richiesta di prova: successo → closed,
+  fallimento → open con cooldown raddoppiato (max BREAKER_COOLDOWN_MAX_S).
+- model_resolver usa is_available()/penalty() per saltare i modelli non sani;
+  l'orchestrator legge lo stato da GET /health/providers.
+"""
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+log = logging.getLogger("gateway.provider_health")
+
+EWMA_ALPHA = float(os.getenv("PROVIDER_HEALTH_ALPHA", "0.2"))
+BREAKER_FAILURES = int(os.getenv("PROVIDER_BREAKER_FAILURES", "5"))
+BREAKER_ERROR_RATE = float(os.getenv("PROVIDER_BREAKER_ERROR_RATE", "0.5"))
+BREAKER_MIN_SAMPLES = int(os.getenv("PROVIDER_BREAKER_MIN_SAMPLES", "10"))
+BREAKER_COOLDOWN_S = float(os.getenv("PROVIDER_BREAKER_COOLDOWN_S", "30"))
+BREAKER_COOLDOWN_MAX_S = float(os.getenv("PROVIDER_BREAKER_COOLDOWN_MAX_S", "300"))
+FAST_FAIL = os.getenv("PROVIDER_BREAKER_FAST_FAIL", "1").strip() not in ("0", "false", "False", "no")
+
+# base_url di default per i modelli senza base_url in models.yaml (stessi env di routes/chat.py)
+DEFAULT_BASES = {
+    "openai": os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+    "anthropic": os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com/v1"),
+    "deepseek": os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1"),
+    "vllm": os.getenv("VLLM_BASE_URL", "http://vllm:8000/v1"),
+    "ollama": os.getenv("OLLAMA_BASE_URL", "http://ollama:11434"),
+}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+
+class _OriginHealth:
+    __slots__ = ("origin", "state", "latency_ewma", "error_ewma", "samples", "consecutive_failures",
+                 "opened_at", "cooldown", "probe_in_flight", "successes", "failures", "last_error",
+                 "trips", "rejected")
+
+    def __init__(self, origin: str):
+        self.origin = origin
+        self.state = CLOSED
+        self.latency_ewma: Optional[float] = None
+        self.error_ewma = 0.0
+        self.samples = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.cooldown = BREAKER_COOLDOWN_S
+        self.probe_in_flight = False
+        self.successes = 0
+        self.failures = 0
+        self.last_error: Optional[str] = None
+        self.trips = 0
+        self.rejected = 0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "origin": self.origin,
+            "state": self.state,
+            "available": self.state != OPEN or time.monotonic() - self.opened_at >= self.cooldown,
+            "latency_ewma_s": round(self.latency_ewma, 4) if self.latency_ewma is not None else None,
+            "error_rate": round(self.error_ewma, 4),
+            "samples": self.samples,
+            "consecutive_failures": self.consecutive_failures,
+            "successes": self.successes,
+            "failures": self.failures,
+            "trips": self.trips,
+            "rejected": self.rejected,
+            "cooldown_s": self.cooldown,
+            "last_error": self.last_error,
+        }
+
+
+class HealthTracker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._origins: Dict[str, _OriginHealth] = {}
+
+    def _get(self, origin: str) -> _OriginHealth:
+        h = self._origins.get(origin)
+        if h is None:
+            h = self._origins[origin] = _OriginHealth(origin)
+        return h
+
+    def allow(self, origin: str) -> bool:
+        """Chiamato prima di ogni richiesta: False = breaker aperto (fast-fail)."""
+        with self._lock:
+            h = self._get(origin)
+            if h.state == CLOSED:
+                return True
+            if h.state == OPEN and time.monotonic() - h.opened_at >= h.cooldown:
+                h.state = HALF_OPEN
+                h.probe_in_flight = False
+                log.info("provider breaker half-open origin=%s", origin)
+            if h.state == HALF_OPEN and not h.probe_in_flight:
+                h.probe_in_flight = True
+                return True
+            h.rejected += 1
+            return False
+
+    def record(self, origin: str, ok: bool, latency_s: Optional[float] = None, error: Optional[str] = None) -> None:
+        with self._lock:
+            h = self._get(origin)
+            h.samples += 1
+            h.error_ewma = (1 - EWMA_ALPHA) * h.error_ewma + EWMA_ALPHA * (0.0 if ok else 1.0)
+            if ok:
+                h.successes += 1
+                h.consecutive_failures = 0
+                if latency_s is not None:
+                    h.latency_ewma = latency_s if h.latency_ewma is None else \
+                        (1 - EWMA_ALPHA) * h.latency_ewma + EWMA_ALPHA * latency_s
+                if h.state != CLOSED:
+                    log.info("provider breaker closed origin=%s", origin)
+                h.state = CLOSED
+                h.cooldown = BREAKER_COOLDOWN_S
+                h.probe_in_flight = False
+                return
+            h.failures += 1
+            h.consecutive_failures += 1
+            h.last_error = (error or "")[:300] or None
+            if h.state == HALF_OPEN:
+                # prova fallita: riapri con cooldown raddoppiato
+                self._trip(h, min(BREAKER_COOLDOWN_MAX_S, h.cooldown * 2))
+            elif h.state == CLOSED and (
+                h.consecutive_failures >= BREAKER_FAILURES
+                or (h.samples >= BREAKER_MIN_SAMPLES and h.error_ewma >= BREAKER_ERROR_RATE)
+            ):
+                self._trip(h, BREAKER_COOLDOWN_S)
+
+    def release(self, origin: str) -> None:
+        # richiesta annullata dal chiamante: nessun esito, libera lo slot di prova
+        with self._lock:
+            h = self._origins.get(origin)
+            if h is not None:
+                h.probe_in_flight = False
+
+    @staticmethod
+    def _trip(h: _OriginHealth, cooldown: float) -> None:
+        h.state = OPEN
+        h.opened_at = time.monotonic()
+        h.cooldown = cooldown
+        h.probe_in_flight = False
+        h.trips += 1
+        log.warning("provider breaker OPEN origin=%s cooldown=%.0fs error_rate=%.2f last_error=%s",
+                    h.origin, cooldown, h.error_ewma, h.last_error)
+
+    def is_available(self, origin: str) -> bool:
+        """Vista per il routing (non consuma la prova half-open)."""
+        with self._lock:
+            h = self._origins.get(origin)
+            if h is None or h.state != OPEN:
+                return True
+            return time.monotonic() - h.opened_at >= h.cooldown
+
+    def penalty(self, origin: str) -> float:
+        """0 = sano; cresce con error-rate e latenza EWMA (saturata a 60s)."""
+        with self._lock:
+            h = self._origins.get(origin)
+            if h is None:
+                return 0.0
+            lat = min(1.0, (h.latency_ewma or 0.0) / 60.0)
+            return 2.0 * h.error_ewma + lat
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"providers": [h.as_dict() for h in self._origins.values()]}
+
+
+_TRACKER = HealthTracker()
+
+
+def tracker() -> HealthTracker:
+    return _TRACKER
+
+
+def origin_of(url: str) -> str:
+    # stessa normalizzazione degli origin di http_pool
+    from http_pool import _origin
+    return _origin(url)
+
+
+def model_origin(m: Dict[str, Any]) -> str:
+    base = m.get("base_url") or DEFAULT_BASES.get((m.get("provider") or "").lower()) or ""
+    return origin_of(base) if base else ""
+
+
+def model_available(m: Dict[str, Any]) -> bool:
+    o = model_origin(m)
+    return _TRACKER.is_available(o) if o else True
+
+
+def model_penalty(m: Dict[str, Any]) -> float:
+    o = model_origin(m)
+    return _TRACKER.penalty(o) if o else 0.0
@@ -16,12 +16,15 @@ Obiettivi:
 from __future__ import annotations
 
 import logging
-from typing import Any, Dict, List, Optional, Sequence
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence
 import json
-import httpx
 import re
 import unicodedata
-from functools import lru_cache
+
+import remote_catalog
+from http_pool import get_client
+from utils.prompt_cache import system_blocks
+from .openai_compat import iter_sse_data
 
 log = logging.getLogger("gateway.anthropic")
 
@@ -224,18 +227,9 @@ def _ensure_version_suffix(model: str, default_date: str) -> str:
         return model
     return f"{model}-{default_date}"
 
-@lru_cache(maxsize=1)
-def _cached_model_list(base_url: str, api_key: str, timeout: float = 20.0) -> list[str]:
-    base = (base_url or "").rstrip("/")
-    if base.endswith("/v1"):
-        base = base[:-3]
-    headers = {"x-api-key": api_key, "anthropic-version": ANTHROPIC_VERSION}
-    with httpx.Client(base_url=base, headers=headers, timeout=timeout) as cli:
-        r = cli.get("/v1/models")
-        r.raise_for_status()
-        data = r.json() or {}
-        ids = [x.get("id") for x in (data.get("data") or []) if isinstance(x, dict)]
-        return [i for i in ids if isinstance(i, str)]
+def _cached_model_list(base_url: str, api_key: str) -> list[str]:
+    # lista dal catalogo condiviso (refresh in background, mai I/O sul path della richiesta)
+    return remote_catalog.ids("anthropic", base_url, api_key)
 
 def _pick_latest_with_prefix(ids: list[str], prefix: str) -> str | None:
     cand = []
@@ -297,8 +291,10 @@ def _filter_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
         raise ValueError(f"[payload-validation] Unknown parameter(s) for Anthropic Messages: {unknown}")
     return payload
 
-def _split_system_messages(messages: List[Dict[str, Any]]) -> tuple[str, List[Dict[str, Any]]]:
+def _split_system_messages(messages: List[Dict[str, Any]]) -> tuple[Any, List[Dict[str, Any]]]:
+    """System unito in una stringa; se il chiamante ha già messo cache_control sui blocchi li preserva."""
     systems: List[str] = []
+    blocks: List[Dict[str, Any]] = []
     rest: List[Dict[str, Any]] = []
     for m in messages or []:
         role = (m.get("role") or "").strip().lower()
@@ -306,12 +302,16 @@ def _split_system_messages(messages: List[Dict[str, Any]]) -> tuple[str, List[Di
         if role == "system":
             if isinstance(content, str):
                 systems.append(content)
+                blocks.append({"type": "text", "text": content})
             elif isinstance(content, list):
                 for b in content:
                     if isinstance(b, dict) and isinstance(b.get("text"), str):
                         systems.append(b["text"])
+                        blocks.append(b)
         else:
             rest.append(m)
+    if any("cache_control" in b for b in blocks):
+        return blocks, rest
     return ("\n\n".join(systems).strip() if systems else ""), rest
 
 def _convert_tools_for_anthropic(tools: Sequence[Dict[str, Any]]) -> List[Dict[str, Any]]:
@@ -377,7 +377,9 @@ def _build_messages_payload(
     if gen.get("stop_sequences"):
         out["stop_sequences"] = gen["stop_sequences"]
     if gen.get("system"):
-        out["system"] = gen["system"]
+        # breakpoint automatico sul system lungo e stabile (prompt caching Anthropic)
+        sys_val = gen["system"]
+        out["system"] = system_blocks(sys_val) if isinstance(sys_val, str) else sys_val
     if gen.get("tools"):
         out["tools"] = _convert_tools_for_anthropic(gen["tools"])
     if gen.get("tool_choice"):
@@ -629,8 +631,7 @@ async def anthropic_complete_unified(
     url = f"{base_url.rstrip('/')}/messages"
     
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            r = await client.post(url, headers=headers, json=payload)
+        r = await get_client(url).post(url, headers=headers, json=payload, timeout=timeout)
     except Exception as e:
         log.exception("anthropic_complete_unified httpx error")
         return _mk_unified_result(
@@ -689,6 +690,132 @@ async def anthropic_complete_unified(
             raw={"body_preview": body_preview}, errors=[f"normalize:{e}"],
         )
 
+# ----------------------------- Streaming ------------------------------------------
+
+_STOP_REASON_TO_OPENAI = {
+    "end_turn": "stop",
+    "stop_sequence": "stop",
+    "max_tokens": "length",
+    "tool_use": "tool_calls",
+}
+
+def _usage_to_openai(u: Dict[str, Any]) -> Dict[str, Any]:
+    """usage Anthropic (input/output tokens) → shape OpenAI, mantenendo i contatori di cache."""
+    pt = int(u.get("input_tokens") or 0)
+    ct = int(u.get("output_tokens") or 0)
+    out: Dict[str, Any] = {"prompt_tokens": pt, "completion_tokens": ct, "total_tokens": pt + ct}
+    for k in ("cache_creation_input_tokens", "cache_read_input_tokens"):
+        if u.get(k) is not None:
+            out[k] = u[k]
+    return out
+
+async def anthropic_stream_unified(
+    base_url: str,
+    api_key: Optional[str],
+    model: str,
+    messages: List[Dict[str, Any]],
+    gen: Optional[Dict[str, Any]] = None,
+    timeout: Optional[float] = 240.0,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Messages API con stream=true. Traduce gli eventi Anthropic
+    (message_start / content_block_* / message_delta / message_stop) negli eventi
+    normalizzati del gateway: delta / finish_reason / usage / error. Non solleva eccezioni.
+    """
+    gen = dict(gen or {})
+    normalized_model = _normalize_model_id_for_anthropic(model, base_url, api_key)
+    payload = _build_messages_payload(normalized_model, messages, gen)
+    payload["stream"] = True
+    betas = gen.get("betas") or []
+
+    headers = {
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+        "anthropic-version": ANTHROPIC_VERSION,
+    }
+    if api_key:
+        headers["x-api-key"] = api_key
+    if betas:
+        headers["anthropic-beta"] = ",".join(betas)
+
+    url = f"{base_url.rstrip('/')}/messages"
+    usage: Dict[str, Any] = {}
+    tool_idx: Dict[int, int] = {}  # index content block → index tool_calls OpenAI
+    try:
+        async with get_client(url).stream("POST", url, headers=headers, json=payload, timeout=timeout) as r:
+            if r.status_code >= 400:
+                body = (await r.aread()).decode("utf-8", "replace")
+                log.error("anthropic_stream_unified HTTP %s body=%s", r.status_code, body[:800])
+                yield {"error": {"code": r.status_code, "message": body[:800]}}
+                return
+            async for data in iter_sse_data(r):
+                try:
+                    j = json.loads(data)
+                except Exception:
+                    continue
+                et = j.get("type")
+                if et == "message_start":
+                    usage.update((j.get("message") or {}).get("usage") or {})
+                elif et == "content_block_start":
+                    block = j.get("content_block") or {}
+                    if block.get("type") == "tool_use":
+                        i = tool_idx[j.get("index", 0)] = len(tool_idx)
+                        yield {"delta": {"tool_calls": [{
+                            "index": i, "id": block.get("id"), "type": "function",
+                            "function": {"name": block.get("name"), "arguments": ""},
+                        }]}}
+                elif et == "content_block_delta":
+                    d = j.get("delta") or {}
+                    if d.get("type") == "text_delta" and d.get("text"):
+                        yield {"delta": {"content": d["text"]}}
+                    elif d.get("type") == "input_json_delta" and j.get("index", 0) in tool_idx:
+                        yield {"delta": {"tool_calls": [{
+                            "index": tool_idx[j.get("index", 0)],
+                            "function": {"arguments": d.get("partial_json") or ""},
+                        }]}}
+                elif et == "message_delta":
+                    usage.update(j.get("usage") or {})
+                    sr = (j.get("delta") or {}).get("stop_reason")
+                    if sr:
+                        yield {"finish_reason": _STOP_REASON_TO_OPENAI.get(sr, sr)}
+                elif et == "error":
+                    yield {"error": j.get("error") or {"message": "anthropic stream error"}}
+                    return
+                elif et == "message_stop":
+                    break
+    except Exception as e:
+        log.error("anthropic_stream_unified exception: %s", e)
+        yield {"error": {"code": "httpx", "message": f"{e.__class__.__name__}: {e}"}}
+        return
+
+    if usage:
+        yield {"usage": _usage_to_openai(usage)}
+
+def _chat_gen(
+    temperature: Optional[float],
+    max_tokens: Optional[int],
+    response_format: Optional[Dict[str, Any]],
+    tools: Optional[List[Dict[str, Any]]],
+    tool_choice: Optional[Any],
+    top_p: Optional[float],
+    stop: Optional[List[str]],
+    kwargs: Dict[str, Any],
+) -> Dict[str, Any]:
+    gen = {
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "response_format": response_format,  # ignorato da Anthropic
+        "tools": tools,
+        "tool_choice": tool_choice,
+        "top_p": top_p,
+        "stop_sequences": stop if stop else None,
+        "thinking": kwargs.get("thinking"),
+        "attachments": kwargs.get("attachments"),
+        "cache_control": kwargs.get("cache_control"),
+        "betas": kwargs.get("betas"),
+    }
+    return {k: v for k, v in gen.items() if v is not None}
+
 # Compat API (stessa firma logica di openai_compat.chat)
 async def chat(
     base_url: str,
@@ -707,20 +834,7 @@ async def chat(
     stop: Optional[List[str]] = None,
     **kwargs: Any,
 ) -> Dict[str, Any]:
-    gen = {
-        "temperature": temperature,
-        "max_tokens": max_tokens,
-        "response_format": response_format,  # ignorato da Anthropic
-        "tools": tools,
-        "tool_choice": tool_choice,
-        "top_p": top_p,
-        "stop_sequences": stop if stop else None,
-        "thinking": kwargs.get("thinking"),
-        "attachments": kwargs.get("attachments"),
-        "cache_control": kwargs.get("cache_control"),
-        "betas": kwargs.get("betas"),
-    }
-    gen = {k: v for k, v in gen.items() if v is not None}
+    gen = _chat_gen(temperature, max_tokens, response_format, tools, tool_choice, top_p, stop, kwargs)
 
     return await anthropic_complete_unified(
         base_url=base_url,
@@ -731,6 +845,26 @@ async def chat(
         timeout=timeout,
     )
 
+async def chat_stream(
+    base_url: str,
+    api_key: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    *,
+    timeout: Optional[float] = 340.0,
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[Any] = None,
+    top_p: Optional[float] = None,
+    stop: Optional[List[str]] = None,
+    **kwargs: Any,
+) -> AsyncIterator[Dict[str, Any]]:
+    gen = _chat_gen(temperature, max_tokens, response_format, tools, tool_choice, top_p, stop, kwargs)
+    async for ev in anthropic_stream_unified(base_url, api_key, model, messages, gen, timeout):
+        yield ev
+
 async def embeddings(*_args: Any, **_kwargs: Any) -> Dict[str, Any]:
     return _mk_unified_result(
         ok=False, text="", files=[], usage={}, finish_reason="",
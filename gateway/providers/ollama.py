@@ -1,9 +1,11 @@
 # app/providers/ollama.py
 from __future__ import annotations
+import json
 import logging
-from typing import Any, Dict, List, Optional, Tuple
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
 
-import httpx
+
+from http_pool import get_client
 
 log = logging.getLogger("gateway.provider.ollama")
 
@@ -46,14 +48,13 @@ def _flatten_messages(messages: List[Dict[str, Any]]) -> str:
     return "\n".join(out)
 
 async def _post_json(url: str, json: Dict[str, Any], timeout: float) -> Tuple[int, Dict[str, Any], str]:
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(url, json=json)
-        txt = r.text
-        try:
-            j = r.json()
-        except Exception:
-            j = {}
-        return r.status_code, j, txt
+    r = await get_client(url).post(url, json=json, timeout=timeout)
+    txt = r.text
+    try:
+        j = r.json()
+    except Exception:
+        j = {}
+    return r.status_code, j, txt
 
 def _usage_from_ollama(j: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -198,6 +199,72 @@ async def chat(
     }
     return await ollama_complete_unified(base, model, messages, gen, timeout)
 
+# Streaming: Ollama risponde in NDJSON (una riga JSON per chunk, l'ultima con done=true e i contatori)
+async def ollama_stream_unified(
+    base_url: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    gen: Optional[Dict[str, Any]] = None,
+    timeout: float = 240.0,
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Stream da /api/chat (fallback /api/generate se /api/chat non esiste).
+    Eventi normalizzati come openai_compat.stream_openai_like: delta / finish_reason / usage / error.
+    """
+    gen = gen or {}
+    base = base_url.rstrip("/")
+    routes = [
+        ("chat", f"{base}/api/chat",
+         {"model": model, "messages": messages, "stream": True, "options": _build_options(gen)}),
+        ("generate", f"{base}/api/generate",
+         {"model": model, "prompt": _flatten_messages(messages), "stream": True, "options": _build_options(gen)}),
+    ]
+    try:
+        for route, url, payload in routes:
+            async with get_client(url).stream("POST", url, json=payload, timeout=timeout) as r:
+                if r.status_code == 404 and route == "chat":
+                    await r.aread()
+                    continue
+                if r.status_code != 200:
+                    body = (await r.aread()).decode("utf-8", "replace")
+                    yield {"error": {"code": r.status_code, "message": body[:800], "route": route}}
+                    return
+                async for line in r.aiter_lines():
+                    if not line.strip():
+                        continue
+                    try:
+                        j = json.loads(line)
+                    except Exception:
+                        continue
+                    if j.get("error"):
+                        yield {"error": {"message": str(j["error"]), "route": route}}
+                        return
+                    piece = ((j.get("message") or {}).get("content") or j.get("response") or "")
+                    if piece:
+                        yield {"delta": {"content": piece}}
+                    if j.get("done"):
+                        yield {"finish_reason": j.get("done_reason") or "stop"}
+                        yield {"usage": _usage_from_ollama(j)}
+                return
+    except Exception as e:
+        log.error("ollama_stream_unified exception: %s", e)
+        yield {"error": {"code": "httpx", "message": f"{e.__class__.__name__}: {e}"}}
+
+async def chat_stream(
+    base: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    timeout: float = 240.0,
+) -> AsyncIterator[Dict[str, Any]]:
+    gen = {
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    async for ev in ollama_stream_unified(base, model, messages, gen, timeout):
+        yield ev
+
 # Optional: retro-compat (string only)
 async def chat_text(base_url: str, model: str, messages: List[Dict[str, Any]], **gen: Any) -> str:
     out = await ollama_complete_unified(base_url, model, messages, gen, timeout=float(gen.get("timeout", 240.0)))
@@ -211,14 +278,27 @@ async def embeddings(base_url: str, model: str, input_text: str, timeout: float
     log.info("Embeddings: %s", url + f"?model={model}&prompt={input_text}")
     payload = {"model": model, "prompt": input_text}
     log.info("Embeddings payload: %s", payload)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(url, json=payload)
-        r.raise_for_status()
-        j = r.json()
-        # common shapes: {'embedding': [...]} or OpenAI-like {'data':[{'embedding':[...]}]}
-        if isinstance(j.get("embedding"), list):
-            return j["embedding"]
-        data = (j.get("data") or [])
-        if data and isinstance(data[0], dict) and isinstance(data[0].get("embedding"), list):
-            return data[0]["embedding"]
-        return []
+    r = await get_client(url).post(url, json=payload, timeout=timeout)
+    r.raise_for_status()
+    j = r.json()
+    # common shapes: {'embedding': [...]} or OpenAI-like {'data':[{'embedding':[...]}]}
+    if isinstance(j.get("embedding"), list):
+        return j["embedding"]
+    data = (j.get("data") or [])
+    if data and isinstance(data[0], dict) and isinstance(data[0].get("embedding"), list):
+        return data[0]["embedding"]
+    return []
+
+# Batch embeddings: /api/embed accetta 'input' come lista (Ollama >= 0.3);
+# sui server più vecchi (404) ricade su /api/embeddings un testo alla volta.
+async def embeddings_batch(base_url: str, model: str, inputs: List[str], timeout: float = 120.0) -> List[List[float]]:
+    url = f"{base_url.rstrip('/')}/api/embed"
+    payload = {"model": model, "input": list(inputs)}
+    r = await get_client(url).post(url, json=payload, timeout=timeout)
+    if r.status_code == 404:
+        return [await embeddings(base_url, model, t, timeout) for t in inputs]
+    r.raise_for_status()
+    vecs = r.json().get("embeddings") or []
+    if len(vecs) != len(inputs):
+        raise ValueError(f"ollama embed: expected {len(inputs)} vectors, got {len(vecs)}")
+    return vecs
@@ -1,10 +1,12 @@
 # --- begin: openai_compat unified imports/helpers ---
 import json
 import logging
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
 import httpx
 
+from http_pool import get_client
+
 _OPENAI_CHAT_URL = "https://api.openai.com/v1/chat/completions"
 _OPENAI_RESPONSES_URL = "https://api.openai.com/v1/responses"
 #TODO params filtering
@@ -86,6 +88,8 @@ def _build_chat_payload(
     #if "stop" in gen and gen["stop"]: out["stop"] = gen["stop"]
     if "presence_penalty" in gen: out["presence_penalty"] = gen["presence_penalty"]
     #if "frequency_penalty" in gen: out["frequency_penalty"] = gen["frequency_penalty"]
+    # seed: campionamento riproducibile (solo Chat Completions; /v1/responses non lo supporta)
+    if gen.get("seed") is not None: out["seed"] = gen["seed"]
 
     # Token budget (Chat)
     # Se arriva max_output_tokens per sbaglio, lo mappiamo → max_completion_tokens
@@ -104,6 +108,9 @@ def _build_chat_payload(
     if gen.get("tools"): out["tools"] = gen["tools"]
     if gen.get("tool_choice"): out["tool_choice"] = gen["tool_choice"]
 
+    # Prompt caching: stessa chiave → stessa cache di prefisso lato OpenAI
+    if gen.get("prompt_cache_key"): out["prompt_cache_key"] = gen["prompt_cache_key"]
+
     return out
 
 
@@ -170,6 +177,7 @@ def _build_responses_payload(
     #     out["response_format"] = gen["response_format"]
     if gen.get("tools"): out["tools"] = gen["tools"]
     if gen.get("tool_choice"): out["tool_choice"] = gen["tool_choice"]
+    if gen.get("prompt_cache_key"): out["prompt_cache_key"] = gen["prompt_cache_key"]
 
     # Ripulisci chiavi None per evitare 400 inutili
     return {k: v for k, v in out.items() if v is not None}
@@ -327,7 +335,8 @@ async def chat(
     tool_choice: Optional[Union[str, Dict[str, Any]]] = None,
     timeout: Optional[float] = 240.0,
     top_p: Optional[float] = None,
-    stop: Optional[List[str]] = None
+    stop: Optional[List[str]] = None,
+    seed: Optional[int] = None,
 ) -> Dict[str, Any]:
     headers = {"Authorization": f"Bearer {api_key}"}
     url = f"{base.rstrip('/')}/chat/completions"
@@ -340,6 +349,7 @@ async def chat(
     gen["tool_choice"] = tool_choice
     gen["top_p"] = top_p
     gen["stop"] = stop
+    gen["seed"] = seed
     gen["api"] = "chat"
 
     return await openai_complete_unified(api_key=api_key, model=model, messages=messages, gen=gen, timeout_s=timeout)
@@ -380,9 +390,9 @@ async def openai_complete_unified(
                 "Authorization": f"Bearer {api_key}",
                 "Content-Type": "application/json",
         }
-        async with httpx.AsyncClient(timeout=timeout_s) as client:
-                r = await client.post(url, headers=headers, json=payload)
-                log.info("openai_complete_unified response %s", r.status_code)
+        client = get_client(url)
+        r = await client.post(url, headers=headers, json=payload, timeout=timeout_s)
+        log.info("openai_complete_unified response %s", r.status_code)
                 #LOG RESPONSE OPENAI 
                 # log.info("gateway._post_with_retries response text %s", r.text)
        
@@ -447,13 +457,138 @@ async def openai_complete_unified(
         errors=[f"openai:{code}:{param}:{message}"],
     )
 
-async def embeddings(base_url: str, api_key: str | None, model: str, input_text: str):
+# --- begin: streaming (SSE) ---
+async def iter_sse_data(resp: httpx.Response) -> AsyncIterator[str]:
+    """
+    Estrae il payload dei campi 'data:' da uno stream text/event-stream.
+    Le righe 'data:' consecutive vengono unite; gli eventi sono separati da riga vuota.
+    """
+    buf: List[str] = []
+    async for line in resp.aiter_lines():
+        if line.startswith("data:"):
+            buf.append(line[5:].lstrip())
+        elif not line.strip() and buf:
+            yield "\n".join(buf)
+            buf = []
+    if buf:
+        yield "\n".join(buf)
+
+
+def _stream_error_from_body(status_code: int, body: str) -> Dict[str, Any]:
+    try:
+        j = json.loads(body)
+        err = j.get("error") if isinstance(j, dict) else None
+        if isinstance(err, dict):
+            return {"code": status_code, **err}
+    except Exception:
+        pass
+    return {"code": status_code, "message": (body or f"HTTP {status_code}")[:800]}
+
+
+async def stream_openai_like(
+    url: str,
+    headers: Dict[str, str],
+    payload: Dict[str, Any],
+    timeout: Optional[float],
+) -> AsyncIterator[Dict[str, Any]]:
+    """
+    Streaming verso un endpoint /chat/completions OpenAI-compatibile (OpenAI, vLLM).
+    Produce eventi normalizzati (stesso contratto per tutti i provider):
+      {"delta": {...}}          delta OpenAI (content / tool_calls)
+      {"finish_reason": "..."}
+      {"usage": {...}}          prompt_tokens / completion_tokens / total_tokens
+      {"error": {...}}          ultimo evento, nessuna eccezione sollevata
+    """
+    try:
+        async with get_client(url).stream("POST", url, headers=headers, json=payload, timeout=timeout) as r:
+            if r.status_code != 200:
+                body = (await r.aread()).decode("utf-8", "replace")
+                log.error("stream_openai_like HTTP %s url=%s body=%s", r.status_code, url, body[:800])
+                yield {"error": _stream_error_from_body(r.status_code, body)}
+                return
+            async for data in iter_sse_data(r):
+                if data == "[DONE]":
+                    break
+                try:
+                    j = json.loads(data)
+                except Exception:
+                    continue
+                if isinstance(j.get("error"), dict):
+                    yield {"error": j["error"]}
+                    return
+                for ch in j.get("choices") or []:
+                    delta = ch.get("delta") or {}
+                    if delta:
+                        yield {"delta": delta}
+                    if ch.get("finish_reason"):
+                        yield {"finish_reason": ch["finish_reason"]}
+                if isinstance(j.get("usage"), dict):
+                    yield {"usage": j["usage"]}
+    except Exception as e:
+        log.error("stream_openai_like exception url=%s: %s", url, e)
+        yield {"error": {"code": "httpx", "message": f"{e.__class__.__name__}: {e}"}}
+
+
+async def chat_stream(
+    base: str,
+    api_key: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[Union[str, Dict[str, Any]]] = None,
+    timeout: Optional[float] = 240.0,
+    seed: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Variante streaming di chat(): stesso payload Chat Completions con stream=true + usage finale."""
+    gen = {
+        "max_tokens": max_tokens,
+        "response_format": response_format,
+        "tools": tools,
+        "tool_choice": tool_choice,
+        "seed": seed,
+    }
+    payload = _build_chat_payload(model, messages, {k: v for k, v in gen.items() if v is not None})
+    payload["stream"] = True
+    payload["stream_options"] = {"include_usage": True}
+    headers = {
+        "Authorization": f"Bearer {api_key}",
+        "Content-Type": "application/json",
+        "Accept": "text/event-stream",
+    }
+    url = f"{base.rstrip('/')}/chat/completions"
+    async for ev in stream_openai_like(url, headers, payload, timeout):
+        yield ev
+
+# --- end: streaming (SSE) ---
+
+async def embeddings_batch(
+    base_url: str,
+    api_key: str | None,
+    model: str,
+    inputs: List[str],
+    timeout: float = 120.0,
+) -> List[List[float]]:
+    """
+    /embeddings con input array: un vettore per input, nello stesso ordine
+    (riordinato per 'index' perché l'API non garantisce l'ordine della lista 'data').
+    """
     headers = {"Content-Type": "application/json"}
     if api_key:
         headers["Authorization"] = f"Bearer {api_key}"
-    payload = {"model": model, "input": input_text}
-    async with httpx.AsyncClient(timeout=120) as client:
-        r = await client.post(f"{base_url.rstrip('/')}/s", json=payload, headers=headers)
-        r.raise_for_status()
-        data = r.json()
-        return (data.get("data") or [{}])[0].get("embedding")
\ No newline at end of file
+    payload = {"model": model, "input": list(inputs)}
+    url = f"{base_url.rstrip('/')}/embeddings"
+    r = await get_client(url).post(url, json=payload, headers=headers, timeout=timeout)
+    r.raise_for_status()
+    data = [d for d in (r.json().get("data") or []) if isinstance(d, dict)]
+    data.sort(key=lambda d: d.get("index", 0))
+    vecs = [d.get("embedding") for d in data]
+    if len(vecs) != len(inputs) or not all(isinstance(v, list) for v in vecs):
+        raise ValueError(f"embeddings: expected {len(inputs)} vectors, got {len(vecs)}")
+    return vecs
+
+async def embeddings(base_url: str, api_key: str | None, model: str, input_text: str):
+    vecs = await embeddings_batch(base_url, api_key, model, [input_text])
+    return vecs[0]
@@ -1,11 +1,12 @@
 # app/providers/vllm.py
 from __future__ import annotations
 import logging
-from typing import Any, Dict, List, Optional, Tuple, Union
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
 
-import httpx
 
+from http_pool import get_client
 from .openai_compat import coerce_text_and_usage  # reuse same text/usage extraction
+from .openai_compat import stream_openai_like  # same SSE chunk shape
 
 log = logging.getLogger("gateway.vllm")
 
@@ -46,6 +47,8 @@ def _build_payload(
         out["top_p"] = gen["top_p"]
     if gen.get("stop"):
         out["stop"] = gen["stop"]
+    if gen.get("seed") is not None:
+        out["seed"] = gen["seed"]
     # budget
     if gen.get("max_tokens") is not None:
         out["max_tokens"] = gen["max_tokens"]
@@ -93,8 +96,7 @@ async def vllm_complete_unified(
     url = f"{base.rstrip('/')}/chat/completions"
     payload = _build_payload(model, messages, gen)
     try:
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            r = await client.post(url, json=payload)
+        r = await get_client(url).post(url, json=payload, timeout=timeout)
     except Exception as e:
         return _mk_unified_result(
             ok=False, text="", files=[], usage={}, finish_reason="",
@@ -138,6 +140,7 @@ async def chat(
     timeout: float = 240.0,
     top_p: Optional[float] = None,
     stop: Optional[List[str]] = None,
+    seed: Optional[int] = None,
 ) -> Dict[str, Any]:
     gen = {
         "temperature": temperature,
@@ -147,18 +150,52 @@ async def chat(
         "tool_choice": tool_choice,
         "top_p": top_p,
         "stop": stop,
+        "seed": seed,
     }
     return await vllm_complete_unified(base, model, messages, gen, timeout)
 
-# Optional: embeddings for vLLM OpenAI server
-async def embeddings(base_url: str, model: str, input_text: str, timeout: float = 120.0) -> List[float]:
+# Streaming: vLLM espone lo stesso SSE di OpenAI (stream_options.include_usage supportato)
+async def chat_stream(
+    base: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+    response_format: Optional[Dict[str, Any]] = None,
+    tools: Optional[List[Dict[str, Any]]] = None,
+    tool_choice: Optional[Union[str, Dict[str, Any]]] = None,
+    timeout: float = 240.0,
+    seed: Optional[int] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    gen = {
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "response_format": response_format,
+        "tools": tools,
+        "tool_choice": tool_choice,
+        "seed": seed,
+    }
+    payload = _build_payload(model, messages, gen)
+    payload["stream"] = True
+    payload["stream_options"] = {"include_usage": True}
+    url = f"{base.rstrip('/')}/chat/completions"
+    headers = {"Content-Type": "application/json", "Accept": "text/event-stream"}
+    async for ev in stream_openai_like(url, headers, payload, timeout):
+        yield ev
+
+# Optional: embeddings for vLLM OpenAI server (input array → un vettore per input)
+async def embeddings_batch(base_url: str, model: str, inputs: List[str], timeout: float = 120.0) -> List[List[float]]:
     url = f"{base_url.rstrip('/')}/embeddings"
-    payload = {"model": model, "input": input_text}
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(url, json=payload)
-        r.raise_for_status()
-        j = r.json()
-        data = (j.get("data") or [])
-        if data and isinstance(data[0], dict) and isinstance(data[0].get("embedding"), list):
-            return data[0]["embedding"]
-        return []
+    payload = {"model": model, "input": list(inputs)}
+    r = await get_client(url).post(url, json=payload, timeout=timeout)
+    r.raise_for_status()
+    j = r.json()
+    data = [d for d in (j.get("data") or []) if isinstance(d, dict)]
+    data.sort(key=lambda d: d.get("index", 0))
+    vecs = [d.get("embedding") for d in data]
+    if len(vecs) != len(inputs) or not all(isinstance(v, list) for v in vecs):
+        raise ValueError(f"vllm embeddings: expected {len(inputs)} vectors, got {len(vecs)}")
+    return vecs
+
+async def embeddings(base_url: str, model: str, input_text: str, timeout: float = 120.0) -> List[float]:
+    return (await embeddings_batch(base_url, model, [input_text], timeout))[0]
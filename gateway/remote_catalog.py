@@ -0,0 +1,196 @@
+# gateway/remote_catalog.py
+"""
+Catalogo asincrono dei modelli esposti dai provider remoti (GET /models).
+
+- Condiviso tra provider: una entry per (provider, base_url, api key).
+- ids() è sincrono e non fa mai I/O: ritorna la lista in cache (anche scaduta,
+  stale-while-revalidate) e, se scaduta, pianifica un refresh in background sul loop.
+  Prima del primo fetch ritorna [] (i chiamanti ricadono sul nome richiesto).
+- startup(): prefetch dei provider configurati via env + task periodico che rinfresca
+  ogni REMOTE_MODELS_TTL_S; errori → si tiene la lista vecchia e si riprova dopo
+  REMOTE_MODELS_RETRY_S.
+- Fetch via http_pool (stessi pool/breaker delle chiamate di generazione).
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from http_pool import get_client
+
+log = logging.getLogger("gateway.remote_catalog")
+
+TTL_S = float(os.getenv("REMOTE_MODELS_TTL_S", "600"))
+RETRY_S = float(os.getenv("REMOTE_MODELS_RETRY_S", "30"))
+FETCH_TIMEOUT_S = float(os.getenv("REMOTE_MODELS_TIMEOUT_S", "20"))
+
+ANTHROPIC_VERSION = "2023-06-01"
+
+
+async def _fetch_openai(base_url: str, api_key: str) -> List[str]:
+    url = f"{base_url.rstrip('/')}/models"
+    r = await get_client(url).get(url, headers={"Authorization": f"Bearer {api_key}"}, timeout=FETCH_TIMEOUT_S)
+    r.raise_for_status()
+    data = r.json() or {}
+    return [x["id"] for x in (data.get("data") or []) if isinstance(x, dict) and isinstance(x.get("id"), str)]
+
+
+async def _fetch_anthropic(base_url: str, api_key: str) -> List[str]:
+    base = base_url.rstrip("/")
+    if not base.endswith("/v1"):
+        base += "/v1"
+    url = f"{base}/models"
+    headers = {"x-api-key": api_key, "anthropic-version": ANTHROPIC_VERSION}
+    r = await get_client(url).get(url, headers=headers, params={"limit": 1000}, timeout=FETCH_TIMEOUT_S)
+    r.raise_for_status()
+    data = r.json() or {}
+    return [x["id"] for x in (data.get("data") or []) if isinstance(x, dict) and isinstance(x.get("id"), str)]
+
+
+FETCHERS: Dict[str, Callable[[str, str], Awaitable[List[str]]]] = {
+    "openai": _fetch_openai,
+    "deepseek": _fetch_openai,  # OpenAI-compatibile
+    "anthropic": _fetch_anthropic,
+}
+
+# provider → (env base_url, default, env api key) per il prefetch all'avvio
+_ENV_SOURCES = {
+    "openai": ("OPENAI_BASE_URL", "https://api.openai.com/v1", "OPENAI_API_KEY"),
+    "anthropic": ("ANTHROPIC_BASE_URL", "https://api.anthropic.com/v1", "ANTHROPIC_API_KEY"),
+}
+
+
+class _Entry:
+    __slots__ = ("provider", "base_url", "api_key", "ids", "fetched_at", "next_at", "task",
+                 "fetches", "errors", "last_error")
+
+    def __init__(self, provider: str, base_url: str, api_key: str):
+        self.provider = provider
+        self.base_url = base_url
+        self.api_key = api_key
+        self.ids: List[str] = []
+        self.fetched_at = 0.0
+        self.next_at = 0.0  # monotonic: prossimo refresh dovuto
+        self.task: Optional[asyncio.Task] = None
+        self.fetches = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "base_url": self.base_url,
+            "models": len(self.ids),
+            "age_s": round(time.time() - self.fetched_at, 1) if self.fetched_at else None,
+            "fetches": self.fetches,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+class RemoteModelCatalog:
+    def __init__(self, ttl_s: float = TTL_S, retry_s: float = RETRY_S):
+        self.ttl_s = ttl_s
+        self.retry_s = retry_s
+        self._entries: Dict[Tuple[str, str, str], _Entry] = {}
+        self._loop_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _key(provider: str, base_url: str, api_key: str) -> Tuple[str, str, str]:
+        return (provider, base_url.rstrip("/"), hashlib.sha256(api_key.encode()).hexdigest()[:16])
+
+    def _entry(self, provider: str, base_url: str, api_key: str) -> _Entry:
+        k = self._key(provider, base_url, api_key)
+        e = self._entries.get(k)
+        if e is None:
+            e = self._entries[k] = _Entry(provider, base_url.rstrip("/"), api_key)
+        return e
+
+    async def _refresh(self, e: _Entry) -> None:
+        fetch = FETCHERS[e.provider]
+        try:
+            ids = await fetch(e.base_url, e.api_key)
+            e.ids = ids
+            e.fetched_at = time.time()
+            e.next_at = time.monotonic() + self.ttl_s
+            e.fetches += 1
+            e.last_error = None
+            log.info("remote models refreshed provider=%s base=%s count=%d", e.provider, e.base_url, len(ids))
+        except Exception as ex:
+            e.errors += 1
+            e.last_error = f"{type(ex).__name__}: {ex}"[:300]
+            e.next_at = time.monotonic() + self.retry_s
+            log.warning("remote models refresh failed provider=%s base=%s: %s (keeping %d cached)",
+                        e.provider, e.base_url, e.last_error, len(e.ids))
+
+    def _schedule(self, e: _Entry) -> Optional[asyncio.Task]:
+        if e.task is not None and not e.task.done():
+            return e.task
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None  # fuori dal loop (script): nessun refresh, si serve la cache
+        e.task = loop.create_task(self._refresh(e), name=f"remote-models-{e.provider}")
+        return e.task
+
+    def ids(self, provider: str, base_url: str, api_key: Optional[str]) -> List[str]:
+        """Lista modelli in cache (mai bloccante); scaduta → refresh in background."""
+        provider = (provider or "").lower()
+        if not api_key or not base_url or provider not in FETCHERS:
+            return []
+        e = self._entry(provider, base_url, api_key)
+        if time.monotonic() >= e.next_at:
+            self._schedule(e)
+        return e.ids
+
+    async def _loop(self) -> None:
+        tick = max(1.0, min(self.ttl_s, self.retry_s) / 2)
+        while True:
+            await asyncio.sleep(tick)
+            now = time.monotonic()
+            for e in list(self._entries.values()):
+                if now >= e.next_at:
+                    self._schedule(e)
+
+    def start(self) -> None:
+        for provider, (env_base, default, env_key) in _ENV_SOURCES.items():
+            key = os.getenv(env_key)
+            if key:
+                self.ids(provider, os.getenv(env_base, default), key)
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._loop(), name="remote-models-refresh")
+
+    async def stop(self) -> None:
+        tasks = [t for t in [self._loop_task] + [e.task for e in self._entries.values()] if t is not None]
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._loop_task = None
+        for e in self._entries.values():
+            e.task = None
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {"ttl_s": self.ttl_s, "sources": [e.as_dict() for e in self._entries.values()]}
+
+
+_CATALOG = RemoteModelCatalog()
+
+
+def catalog() -> RemoteModelCatalog:
+    return _CATALOG
+
+
+def ids(provider: str, base_url: str, api_key: Optional[str]) -> List[str]:
+    return _CATALOG.ids(provider, base_url, api_key)
+
+
+async def startup() -> None:
+    _CATALOG.start()
+
+
+async def shutdown() -> None:
+    await _CATALOG.stop()
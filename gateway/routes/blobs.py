@@ -0,0 +1,45 @@
+# routes/blobs.py
+import logging
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+
+from utils.blob_store import BlobTooLarge, parse_handle, store
+
+router = APIRouter(prefix="/v1/blobs", tags=["blobs"])
+log = logging.getLogger("gateway.blobs")
+
+
+@router.post("")
+async def upload_blob(request: Request):
+    """
+    Upload binario (body raw, application/octet-stream: niente base64) → {"handle": "sha256:<hex>", ...}.
+    Contenuti identici non vengono riscritti (created=false). Il client può fare prima
+    HEAD /v1/blobs/{handle} e saltare l'upload se il blob c'è già.
+    """
+    try:
+        out = await store().put_stream(request.stream())
+    except BlobTooLarge as e:
+        raise HTTPException(413, detail=str(e))
+    log.info("blob %s size=%d created=%s", out["sha256"][:12], out["size"], out["created"])
+    return out
+
+
+def _sha_or_404(handle: str) -> str:
+    sha = parse_handle(handle)
+    if not sha or not store().exists(sha):
+        raise HTTPException(404, detail="blob not found")
+    store().touch(sha)  # il client lo sta riusando: la retention riparte da ora
+    return sha
+
+
+@router.head("/{handle}")
+async def head_blob(handle: str):
+    sha = _sha_or_404(handle)
+    return Response(headers={"content-length": str(store().size(sha) or 0), "x-blob-sha256": sha})
+
+
+@router.get("/{handle}")
+async def get_blob(handle: str):
+    sha = _sha_or_404(handle)
+    return FileResponse(store().blob_path(sha), media_type="application/octet-stream",
+                        headers={"x-blob-sha256": sha})
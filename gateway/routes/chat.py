@@ -1,14 +1,19 @@
 # gateway/routes/chat.py
-import os, httpx, asyncio, time, json, logging
-from fastapi import APIRouter, HTTPException, Request
+import os, httpx, asyncio, time, json, logging, uuid
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from typing import List, Dict, Any, Optional, Union
+from typing import List, Dict, Any, Literal, Optional, Union, AsyncIterator
 
 from providers import openai_compat as oai
 from providers import anthropic as anth
 from providers import deepseek as dsk
 from providers import ollama as oll
 from providers import vllm as vll
+import metrics
+import remote_catalog
+from utils.openai_like import format_chat_chunk, format_usage_chunk, sse_event
+from utils import response_cache
 
 
 OPENAI_BASE = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/")
@@ -54,28 +59,14 @@ SNAPSHOT_ALIAS = {
     "gpt-5-nano": "gpt-5-nano-2025-08-07",
 }
 
-_models_cache = {"ts": 0.0, "ids": []}  # list per JSON-friendliness
-
 async def _get_openai_models() -> list[str]:
-    now = time.time()
-    if _models_cache["ids"] and (now - _models_cache["ts"] < 60):
-        return _models_cache["ids"]
-    if not OPENAI_API_KEY:
-        return []
-    try:
-        async with httpx.AsyncClient(timeout=20) as client:
-            r = await client.get(f"{OPENAI_BASE}/models", headers={"Authorization": f"Bearer {OPENAI_API_KEY}"})
-            r.raise_for_status()
-            data = r.json()
-            ids = [x.get("id") for x in (data.get("data") or []) if isinstance(x, dict) and x.get("id")]
-            _models_cache["ts"] = now
-            _models_cache["ids"] = ids
-            return ids
-    except httpx.HTTPError:
-        return []
+    # catalogo condiviso con refresh in background: la richiesta non attende mai /models
+    return remote_catalog.ids("openai", OPENAI_BASE, OPENAI_API_KEY)
 
 async def _pick_openai_remote(norm: str) -> str:
     avail = await _get_openai_models()
+    if not avail:
+        return norm  # catalogo non ancora popolato: decide il provider
     snap = SNAPSHOT_ALIAS.get(norm)
     if snap and snap in avail:
         return snap
@@ -106,6 +97,10 @@ class ChatRequest(BaseModel):
     base_url: Optional[str] = None
     remote_name: Optional[str] = None
     max_completion_tokens: int | None = Field(None, description="GPT-5 style")
+    stream: bool = Field(False, description="SSE: chunk chat.completion.chunk + usage finale + [DONE]")
+    seed: Optional[int] = Field(None, description="inoltrato a openai/vllm; entra nella chiave della response cache")
+    cache: Optional[Literal["bypass", "read", "write"]] = Field(
+        None, description="response cache; default LLM_CACHE_MODE (auto: read se temperature=0 o seed)")
 
 # ---------- Utils ----------
 
@@ -122,10 +117,72 @@ def _json(obj: Any) -> str:
     except Exception:
         return str(obj)
 
+async def _sse_chat_stream(events: AsyncIterator[Dict[str, Any]], provider: str, model: str):
+    """
+    Converte gli eventi normalizzati dei provider (delta / finish_reason / usage / error)
+    in SSE OpenAI-compatibili: ruolo iniziale, delta, chunk con finish_reason,
+    chunk finale con usage (choices vuoto) e 'data: [DONE]'.
+    """
+    chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+    created = int(time.time())
+    t0 = time.perf_counter()
+    ttft_ms = None
+    n_chunks = 0
+    finish_reason = None
+    usage: Dict[str, Any] = {}
+    error = None
+
+    yield sse_event(format_chat_chunk(chunk_id, model, created, {"role": "assistant", "content": ""}))
+    try:
+        async for ev in events:
+            if ev.get("error"):
+                error = ev["error"]
+                break
+            if ev.get("delta"):
+                if ttft_ms is None:
+                    ttft_ms = int((time.perf_counter() - t0) * 1000)
+                n_chunks += 1
+                yield sse_event(format_chat_chunk(chunk_id, model, created, ev["delta"]))
+            if ev.get("finish_reason"):
+                finish_reason = ev["finish_reason"]
+            if ev.get("usage"):
+                usage = ev["usage"]
+    except Exception as e:
+        log.exception("chat stream failed provider=%s model=%s", provider, model)
+        error = {"code": "internal_error", "message": f"{e.__class__.__name__}: {e}"}
+
+    metrics.observe_llm(provider, model, time.perf_counter() - t0, usage=usage, ok=error is None,
+                        ttft_s=(ttft_ms / 1000.0) if ttft_ms is not None else None)
+    if error is not None:
+        yield sse_event({"error": error})
+    else:
+        yield sse_event(format_chat_chunk(chunk_id, model, created, {}, finish_reason or "stop"))
+        yield sse_event(format_usage_chunk(chunk_id, model, created, usage))
+    yield sse_event("[DONE]")
+    log.info(
+        "chat stream done %s",
+        _json({
+            "provider": provider,
+            "model": model,
+            "ttft_ms": ttft_ms,
+            "total_ms": int((time.perf_counter() - t0) * 1000),
+            "chunks": n_chunks,
+            "finish_reason": finish_reason,
+            "error": bool(error),
+        })
+    )
+
+def _streaming_response(events: AsyncIterator[Dict[str, Any]], provider: str, model: str) -> StreamingResponse:
+    return StreamingResponse(
+        _sse_chat_stream(events, provider, model),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
 # ---------- Endpoint ----------
 
 @router.post("/v1/chat/completions")
-async def chat_completions(req: ChatRequest,  request: Request):
+async def chat_completions(req: ChatRequest,  request: Request, response: Response):
     provider = (req.provider or request.headers.get("X-CLike-Provider") or _infer_provider(req.model) or "").lower().strip()
 
     # ----- Normalizza input per provider -----
@@ -140,7 +197,7 @@ async def chat_completions(req: ChatRequest,  request: Request):
             # fallback super-sicuro
             messages.append({"role": getattr(m, "role", "user"), "content": getattr(m, "content", "")})
 
-    temperature = req.temperature or 0.4
+    temperature = req.temperature if req.temperature is not None else 0.4
     max_tokens = req.max_tokens
     response_format = req.response_format
     tools = req.tools
@@ -160,48 +217,87 @@ async def chat_completions(req: ChatRequest,  request: Request):
             "has_tool_choice": bool(tool_choice),
             "has_response_format": bool(response_format),
             "max_tokens": max_tokens,
+            "stream": bool(req.stream),
         })
     )
 
 
-    # Routing per provider
-    if provider == "openai":
-        if not OPENAI_API_KEY:
-            raise HTTPException(401, "missing OPENAI api key")
-        data = await oai.chat(OPENAI_BASE, OPENAI_API_KEY, model, messages, temperature=temperature,
-                                                                            max_tokens=max_tokens,
-                                                                            tools=tools,
-                                                                            tool_choice=tool_choice,
-                                                                            response_format=response_format,
-                                                                            timeout=timeout) 
-        return data
-    if provider == "vllm":
-        return await vll.chat(VLLM_BASE, model, messages, temperature, max_tokens, max_tokens, response_format, tools, tool_choice, timeout)
-    if provider == "ollama":
-        return await oll.chat(OLLAMA_BASE, model, messages, temperature, max_tokens, timeout)
-    elif provider == "anthropic":
-        if not ANTHROPIC_API_KEY:
-            raise HTTPException(401, "missing ANTHROPIC api key")
-            
-        try:
-            data = await anth.chat(
-                ANTHROPIC_BASE, 
-                ANTHROPIC_API_KEY, 
-                model, 
-                messages, 
-                temperature=temperature,
-                max_tokens=max_tokens,
-                tools=tools,
-                tool_choice=tool_choice,
-                response_format=response_format,
-                timeout=timeout)
-            return data
-        except httpx.HTTPStatusError as e:
-            txt = e.response.text if e.response is not None else str(e)
-            code = e.response.status_code if e.response is not None else 502
-            raise HTTPException(code, detail=f"provider error for model={model}: {txt}")
-        except httpx.HTTPError as e:
-            raise HTTPException(502, detail=f"provider connection error: {e}")
-    else:
+    # Streaming (SSE): stessa selezione provider, chunk normalizzati al formato OpenAI
+    if req.stream:
+        if provider == "openai":
+            if not OPENAI_API_KEY:
+                raise HTTPException(401, "missing OPENAI api key")
+            events = oai.chat_stream(OPENAI_BASE, OPENAI_API_KEY, model, messages, temperature=temperature,
+                                     max_tokens=max_tokens, response_format=response_format,
+                                     tools=tools, tool_choice=tool_choice, timeout=timeout, seed=req.seed)
+        elif provider == "vllm":
+            events = vll.chat_stream(VLLM_BASE, model, messages, temperature=temperature, max_tokens=max_tokens,
+                                     response_format=response_format, tools=tools, tool_choice=tool_choice,
+                                     timeout=timeout, seed=req.seed)
+        elif provider == "ollama":
+            events = oll.chat_stream(OLLAMA_BASE, model, messages, temperature=temperature,
+                                     max_tokens=max_tokens, timeout=timeout)
+        elif provider == "anthropic":
+            if not ANTHROPIC_API_KEY:
+                raise HTTPException(401, "missing ANTHROPIC api key")
+            events = anth.chat_stream(ANTHROPIC_BASE, ANTHROPIC_API_KEY, model, messages, temperature=temperature,
+                                      max_tokens=max_tokens, tools=tools, tool_choice=tool_choice,
+                                      response_format=response_format, timeout=timeout)
+        else:
+            raise HTTPException(400, f"unsupported provider for chat: {provider} for model '{req.model}")
+        return _streaming_response(events, provider, model)
+
+    # Routing per provider (non-stream) dietro la response cache
+    async def _call():
+        if provider == "openai":
+            if not OPENAI_API_KEY:
+                raise HTTPException(401, "missing OPENAI api key")
+            return await oai.chat(OPENAI_BASE, OPENAI_API_KEY, model, messages, temperature=temperature,
+                                  max_tokens=max_tokens, tools=tools, tool_choice=tool_choice,
+                                  response_format=response_format, timeout=timeout, seed=req.seed)
+        if provider == "vllm":
+            return await vll.chat(VLLM_BASE, None, model, messages, temperature=temperature, max_tokens=max_tokens,
+                                  response_format=response_format, tools=tools, tool_choice=tool_choice, timeout=timeout,
+                                  seed=req.seed)
+        if provider == "ollama":
+            return await oll.chat(OLLAMA_BASE, model, messages, temperature, max_tokens, timeout)
+        if provider == "anthropic":
+            if not ANTHROPIC_API_KEY:
+                raise HTTPException(401, "missing ANTHROPIC api key")
+            try:
+                return await anth.chat(
+                    ANTHROPIC_BASE,
+                    ANTHROPIC_API_KEY,
+                    model,
+                    messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    tools=tools,
+                    tool_choice=tool_choice,
+                    response_format=response_format,
+                    timeout=timeout)
+            except httpx.HTTPStatusError as e:
+                txt = e.response.text if e.response is not None else str(e)
+                code = e.response.status_code if e.response is not None else 502
+                raise HTTPException(code, detail=f"provider error for model={model}: {txt}")
+            except httpx.HTTPError as e:
+                raise HTTPException(502, detail=f"provider connection error: {e}")
         raise HTTPException(400, f"unsupported provider for chat: {provider} for model '{req.model}")
 
+    cache_mode = response_cache.effective_mode(req.cache, temperature, req.seed, provider)
+    t0 = time.perf_counter()
+    try:
+        data, cache_state = await response_cache.cached_call(
+            cache_mode, provider, model, messages,
+            {"temperature": temperature, "max_tokens": max_tokens, "seed": req.seed, "tools": tools,
+             "tool_choice": tool_choice, "response_format": response_format},
+            _call,
+        )
+    except Exception:
+        metrics.observe_llm(provider, model, time.perf_counter() - t0, ok=False)
+        raise
+    metrics.observe_llm(provider, model, time.perf_counter() - t0,
+                        usage=(data or {}).get("usage") if isinstance(data, dict) else None,
+                        ok=not (isinstance(data, dict) and data.get("ok") is False), cache=cache_state)
+    response.headers["X-Cache"] = cache_state
+    return data
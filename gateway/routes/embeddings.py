@@ -1,29 +1,86 @@
-import os, logging
+import os, asyncio, logging
+from typing import Any, Dict, List
 from fastapi import APIRouter, Request, HTTPException
 from config import load_models_cfg
 from model_resolver import resolve_model
 from providers import ollama as oll
 from providers import openai_compat as oai
 from providers import deepseek as dsk
+from providers import vllm as vll
 from utils.openai_like import format_embeddings_response
 
 router = APIRouter()
 logger = logging.getLogger("gateway.embeddings")
 
+# Dimensione sub-batch per provider (override per modello con 'batch_size' in models.yaml)
+# OpenAI accetta fino a 2048 input per richiesta; i server locali soffrono batch troppo grandi.
+DEFAULT_BATCH_SIZE = {"openai": 256, "deepseek": 256, "vllm": 64, "ollama": 32}
+# Sub-batch in volo contemporaneamente per singola richiesta /v1/embeddings
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+
+
+def _normalize_inputs(input_raw: Any) -> List[str]:
+    """Stringa → [stringa]; lista → lista di stringhe (ordine preservato, niente join)."""
+    if isinstance(input_raw, list):
+        out = []
+        for x in input_raw:
+            if isinstance(x, bytes):
+                x = x.decode("utf-8", "ignore")
+            if not isinstance(x, str):
+                raise HTTPException(400, "'input' list must contain only strings")
+            out.append(x)
+        return out
+    s = str(input_raw or "")
+    return [s] if s.strip() else []
+
+
+async def _embed_sub_batch(provider: str, base: str, api_key: str | None, remote: str, texts: List[str]) -> List[List[float]]:
+    if provider == "ollama":
+        return await oll.embeddings_batch(base, remote, texts)
+    if provider == "vllm":
+        return await vll.embeddings_batch(base, remote, texts)
+    if provider == "openai":
+        return await oai.embeddings_batch(base, api_key, remote, texts)
+    if provider == "deepseek":
+        return await dsk.embeddings_batch(base, api_key, remote, texts)
+    if provider == "anthropic":
+        raise HTTPException(400, "anthropic provider does not support embeddings")
+    raise HTTPException(400, f"unsupported provider for embeddings: {provider}")
+
+
+async def embed_batched(m: Dict[str, Any], texts: List[str]) -> List[List[float]]:
+    """
+    Spezza 'texts' in sub-batch della dimensione ottimale per il provider e li esegue
+    con concorrenza limitata (EMBED_CONCURRENCY). Ritorna un vettore per input, in ordine.
+    """
+    provider = (m.get("provider") or "").lower()
+    base = (m.get("base_url") or "").rstrip("/") or os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
+    remote = m.get("remote_name") or m.get("name")
+    api_key_env = m.get("api_key_env")
+    api_key = os.getenv(api_key_env) if api_key_env else None
+
+    size = max(1, int(m.get("batch_size") or DEFAULT_BATCH_SIZE.get(provider, 16)))
+    batches = [texts[i:i + size] for i in range(0, len(texts), size)]
+    sem = asyncio.Semaphore(max(1, EMBED_CONCURRENCY))
+
+    async def _one(chunk: List[str]) -> List[List[float]]:
+        async with sem:
+            return await _embed_sub_batch(provider, base, api_key, remote, chunk)
+
+    logger.info(f"[emb] provider={provider} model={m.get('name')} remote={remote} base={base} "
+                f"inputs={len(texts)} batches={len(batches)} batch_size={size}")
+    results = await asyncio.gather(*(_one(b) for b in batches))
+    return [v for part in results for v in part]
+
+
 @router.post("/v1/embeddings")
 async def embeddings(req: Request):
     body = await req.json()
     model_name = (body.get("model") or "").strip()
-    input_raw = body.get("input", "")
 
-    # 1) Normalizza input: accetta stringa o lista -> stringa unica
-    if isinstance(input_raw, list):
-        # tipicamente per query RAG è una stringa; se arriva lista, unisci
-        input_text = "\n\n".join([str(x) for x in input_raw if isinstance(x, (str, bytes))]).strip()
-    else:
-        input_text = str(input_raw or "").strip()
-
-    if not input_text:
+    # 1) Normalizza input: stringa singola o lista (batch reale, un vettore per elemento)
+    texts = _normalize_inputs(body.get("input", ""))
+    if not texts:
         raise HTTPException(400, "missing 'input' for embeddings")
 
     # 2) Default modello se non specificato
@@ -36,36 +93,18 @@ async def embeddings(req: Request):
         )
 
     # 3) Resolve dal models.yaml (modality embeddings)
-    _, models = load_models_cfg(os.getenv("MODELS_CONFIG", "/workspace/configs/models.yaml"))
+    cfg, models = load_models_cfg(os.getenv("MODELS_CONFIG", "/workspace/configs/models.yaml"))
     try:
-        m = resolve_model(models, model_name, want_modality="embeddings")
+        m = resolve_model(cfg, models, model_name, want_modality="embeddings")
     except Exception as e:
         raise HTTPException(400, f"model resolution failed for '{model_name}': {e}")
 
-    provider = (m.get("provider") or "").lower()
-    base = (m.get("base_url") or "").rstrip("/") or os.getenv("OLLAMA_BASE_URL", "http://ollama:11434")
-    remote = m.get("remote_name") or m.get("name")
-    api_key_env = m.get("api_key_env")
-    api_key = os.getenv(api_key_env) if api_key_env else None
-
-    logger.info(f"[emb] provider={provider} model={m.get('name')} remote={remote} base={base}")
-
     try:
-        if provider == "ollama":
-            vec = await oll.embeddings(base, remote, input_text)
-        elif provider in ("openai", "vllm"):
-            vec = await oai.embeddings(base, api_key, remote, input_text)
-        elif provider == "deepseek":
-            vec = await dsk.embeddings(base, api_key, remote, input_text)
-        elif provider == "anthropic":
-            raise HTTPException(400, "anthropic provider does not support embeddings")
-        else:
-            raise HTTPException(400, f"unsupported provider for embeddings: {provider}")
+        vecs = await embed_batched(m, texts)
     except HTTPException:
         raise
     except Exception as e:
         logger.exception(f"emb provider error: {e}")
         raise HTTPException(502, f"upstream embeddings provider failed: {type(e).__name__}: {e}")
 
-    return format_embeddings_response(m.get("name"), vec)
-
+    return format_embeddings_response(m.get("name"), vecs)
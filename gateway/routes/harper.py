@@ -12,16 +12,26 @@ import os, datetime
 import httpx
 from utils.sanitize import sanitize_for_path
 from utils.utils import   collect_rag_materials_http, decide_inline_or_rag
-from utils.rag_store import RagStore
+from utils.rag_store import RagStore, open_store
+import metrics
+import telemetry_writer
+from utils import response_cache
+from utils import prompt_cache
+from utils import tracing
+from utils.tokenizer import clip_to_tokens, count_message_tokens
+import prompt_registry
 from routes.chat import ANTHROPIC_API_KEY, ANTHROPIC_BASE, OLLAMA_BASE, OPENAI_API_KEY, OPENAI_BASE, VLLM_BASE, _json
 from providers import openai_compat as oai
 from providers import anthropic as anth
 from providers import deepseek as dsk
 from providers import ollama as oll
 from providers import vllm as vll
-import yaml, re
+import re
 import mimetypes
 from pricing import PricingManager  # [pricing]
+from model_catalog import get_catalog
+from config import load_models_cfg
+from model_resolver import resolve_model
 
 
 log = logging.getLogger("harper")
@@ -65,9 +75,19 @@ PHASE_MODEL_PARAMS = {
 
 _PRICING = None  # [pricing-singleton]
 
+_PRICING_VERSION = None
+
 def _get_pricing_manager():
-    global _PRICING
-    if _PRICING is None:
+    global _PRICING, _PRICING_VERSION
+    try:
+        cat = get_catalog()
+    except Exception:
+        cat = None
+    if cat is not None and (_PRICING is None or _PRICING_VERSION != cat.version):
+        # ricostruito solo quando il catalogo viene ricaricato
+        _PRICING = PricingManager.from_cfg(cat.cfg)
+        _PRICING_VERSION = cat.version
+    elif _PRICING is None:
         _PRICING = PricingManager.from_models_yaml(os.getenv("MODELS_CONFIG", "../config/models.yaml"))
     return _PRICING
 
@@ -406,16 +426,15 @@ def _inject_repo_url_in_system(system_text: str, repo_url: str | None) -> str:
     url = _normalize_repo_url(repo_url) or "https:/afucompany.it/"
     return system_text.replace(_REPO_PLACEHOLDER, url)
 
-def _clip_text_to_tokens(text: str, max_tokens: int) -> str:
-    """Taglia per stare sotto max_tokens (approssimazione char→token già usata altrove)."""
-    if not text or max_tokens <= 0:
-        return ""
-    approx = approx_tokens_from_chars(text)
-    if approx <= max_tokens:
-        return text
-    # taglio grezzo per sicurezza (≈ 4 char/token)
-    target_chars = max(128, int(max_tokens * 4))
-    return text[-target_chars:]
+def _tok_target(model_entry: dict | None, model: str | None = None) -> tuple[str | None, str | None]:
+    # (provider, nome remoto) per scegliere l'encoder del tokenizer
+    if isinstance(model_entry, dict):
+        return model_entry.get("provider"), (model_entry.get("remote_name") or model_entry.get("name") or model)
+    return None, model
+
+def _clip_text_to_tokens(text: str, max_tokens: int, model_entry: dict | None = None) -> str:
+    """Taglia (tenendo la coda) per stare sotto max_tokens, contati col tokenizer del modello."""
+    return clip_to_tokens(text, max_tokens, *_tok_target(model_entry))
 
 def _guess_mime(path: str) -> str:
     # Usa libreria standard per dedurre il MIME; fallback binario generico.
@@ -534,12 +553,10 @@ def _extract_file_blocks(text: str) -> tuple[list[dict], str]:
 
 # --- PATCH END (helpers) ---
 
-def approx_tokens_from_chars(text: str) -> int:
-    # euristica stabile usata nel resto del repo (≈ 4 chars/token)
-    return max(1, int(len(text) / 4))
-
-def _messages_text_len(messages: list[dict]) -> int:
-    return sum(len(m.get("content","")) for m in (messages or []) if isinstance(m.get("content"), str))
+# margine per header/formattazione del provider non coperti dal conteggio dei messaggi
+TOKEN_SAFETY_MARGIN = int(os.getenv("HARPER_TOKEN_SAFETY_MARGIN", "256"))
+# sotto questo spazio di output il prompt è considerato troppo lungo per il modello (413)
+MIN_OUTPUT_TOKENS = int(os.getenv("HARPER_MIN_OUTPUT_TOKENS", "256"))
 
 def _resolve_ctx_caps(model_entry: dict | None) -> tuple[int, int]:
     DEFAULT_CONTEXT_WINDOW = 128000
@@ -551,11 +568,8 @@ def _resolve_ctx_caps(model_entry: dict | None) -> tuple[int, int]:
     return cw, mo
 
 def _gw_load_models() -> list[dict]:
-    path = os.getenv("MODELS_CONFIG", "/workspace/configs/models.yaml")
     try:
-        with open(path, "r", encoding="utf-8") as f:
-            data = yaml.safe_load(f) or {}
-            return [m for m in (data.get("models") or []) if m.get("enabled", False)]
+        return get_catalog().enabled(enabled_default=False)
     except Exception:
         return []
 
@@ -563,23 +577,38 @@ def _gw_try_match_model(alias_or_id: str) -> Optional[dict]:
     ms = (alias_or_id or "").strip().lower()
     if not ms:
         return None
-    models = _gw_load_models()
-    for m in models:
-        mid = str(m.get("id","")).lower()
-        name = str(m.get("name","")).lower()
-        rname = str(m.get("remote_name","")).lower()
-        if ms == mid or ms == name or ms == rname:
-            return m
-    return None
-
-def _read_text(path: str) -> str:
     try:
-        with open(path, "r", encoding="utf-8", errors="replace") as f:
-            log.info("Loading %s", path)
-            return f.read()
+        # indice id/name/remote_name/alias del catalogo (niente scansione né parse YAML per run)
+        return get_catalog().find(ms, enabled_default=False)
     except Exception:
-        log.error("Error reading %s", path)
-        return ""
+        return None
+
+def _gw_route_model(hint: str, phase: str) -> Optional[dict]:
+    # "auto" (profilo da routing[phase]) o nome di profilo → resolve_model: salute provider e,
+    # con scoring.mode: measured, latenza/costo/failure misurati per fase (routing_stats)
+    hint = (hint or "auto").strip()
+    try:
+        cfg, models = load_models_cfg()
+        profiles = cfg.get("profiles") or {}
+        if hint.lower() == "auto":
+            profile = (cfg.get("routing") or {}).get((phase or "").lower())
+        elif hint in profiles:
+            profile = hint
+        else:
+            return None
+        return resolve_model(cfg, models, "auto", profile=profile if profile in profiles else None,
+                             want_modality="chat", phase=(phase or "").lower() or None)
+    except Exception as e:
+        log.warning("harper.gateway routing for '%s' failed: %s", hint, e)
+        return None
+
+def _read_text(path: str) -> str:
+    # dal registry in memoria (preload all'avvio, invalidazione per mtime): niente I/O per richiesta
+    return prompt_registry.read_text(path)
+
+def _system_prompt_name(phase: str) -> str:
+    name = f"system:{(phase or '').lower()}"
+    return name if name in prompt_registry.PROMPT_PATHS else "system:spec"
 
 
 
@@ -657,7 +686,7 @@ def compose_system_messages(phase: str,  repo_url: str | None) -> list[dict]:
         "finalize": PROMPT_FINALIZE_SYSTEM_PATH,
     }
     system_path = system_by_phase.get(phase)
-    system = _read_text(system_path).strip() or "# Harper System Prompt\nFollow the phase contract strictly."
+    system = prompt_registry.registry().rendered(system_path, "# Harper System Prompt\nFollow the phase contract strictly.")
     #log.info("System prdockeompt for phase %s: %s", phase, system)
     if phase == "kit" and repo_url:
         system = _inject_repo_url_in_system(system, repo_url) 
@@ -683,7 +712,7 @@ def _too_long_compose_system_messages(phase: str,
         "finalize": PROMPT_FINALIZE_SYSTEM_PATH,
     }
     system_path = system_by_phase.get(phase, PROMPT_SPEC_SYSTEM_PATH)
-    system = _read_text(system_path).strip() or "# Harper System Prompt\nFollow the phase contract strictly."
+    system = prompt_registry.registry().rendered(system_path, "# Harper System Prompt\nFollow the phase contract strictly.")
     #log.info("System prdockeompt for phase %s: %s", phase, system)
     if phase == "kit" and repo_url:
         system = _inject_repo_url_in_system(system, repo_url) 
@@ -741,13 +770,19 @@ def _too_long_compose_system_messages(phase: str,
     idea_txt = ""
     if idea_md and phase.lower() == 'spec':
         idea_txt = f"### IDEA.md (verbatim)\n{idea_md}\n\n"
-    user = (
+    # Prefisso stabile prima (principi, IDEA, core blobs, checklist): identico tra i run dello stesso
+    # progetto/fase → riusabile dal prompt caching dei provider. Route/runId/task in coda.
+    static = (
         f"{foreground}\n\n"
-        f"### Route\n- profile: {profile_hint or '—'}\n- model: {model_route_label or '—'}\n- runId: {run_id or 'n/a'}\n\n"
         f"{idea_txt}"
         f"{refs}\n\n"
+        f"{suffix.strip()}\n\n"
         f"{_output_checklist_for_phase(phase)}"
-        f"### Task\nProduce/Transform the {phase.upper()} output that strictly follows the Output contract. Return only the Markdown document for this phase.{suffix}"
+    ).strip()
+    user = (
+        f"{static}\n\n"
+        f"### Route\n- profile: {profile_hint or '—'}\n- model: {model_route_label or '—'}\n- runId: {run_id or 'n/a'}\n\n"
+        f"### Task\nProduce/Transform the {phase.upper()} output that strictly follows the Output contract. Return only the Markdown document for this phase."
     )
     # --- se fase KIT, inietta direttiva target ---
     if (phase or "").lower() == "kit":
@@ -755,7 +790,7 @@ def _too_long_compose_system_messages(phase: str,
 
     messages_output = [
         {"role": "system", "content": system.strip()},
-        {"role": "user", "content": user.strip()},
+        {"role": "user", "content": user.strip(), prompt_cache.PREFIX_KEY: len(static)},
     ]
     return messages_output
 
@@ -798,6 +833,7 @@ class Attachment(BaseModel):
     size: Optional[int] = None
     content: Optional[str] = None
     bytes_b64: Optional[str] = None
+    blob: Optional[str] = None  # handle "sha256:<hex>" da POST /v1/blobs (al posto di bytes_b64)
 
 
 class HarperKitOptions(BaseModel):
@@ -853,7 +889,7 @@ async def _append_attachs_by_files(messages: list[dict], project_id: str, paths:
     Non usa HTTP: parla direttamente con RagStore/Qdrant.
     """
     try:
-        store = RagStore(project_id=project_id or "default_id") if RagStore else None
+        store = open_store(project_id or "default_id") if RagStore else None
     except Exception:
         store = None
     log.info("RAG Store %s", store)
@@ -960,10 +996,9 @@ def _telemetry_path(project_id: str) -> Path:
     return path
 
 def _write_telemetry(project_id: str, record: dict) -> None:
+    # non blocca il loop: il writer di background fa append a batch + aggiornamento indice/rollup
     try:
-        path = _telemetry_path(project_id)
-        with path.open("a", encoding="utf-8") as f:
-            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        telemetry_writer.submit(_telemetry_path(project_id), record)
     except Exception as e:
         log.warning("telemetry write failed: %s", e)
 
@@ -986,22 +1021,29 @@ async def gather_rag_materials(rag_chunks,rag_top_k, store, rag_queries = None)
         materials.append({"title": f"{name}#{idx}", "text": txt, "source": "client"})
 
     # 2) Query sullo store (se definito e se arrivano rag_queries)
-    queries = rag_queries or []
+    queries = [q for q in (rag_queries or []) if q][:8]  # cap query
     if store and queries:
-        for q in queries[:8]:  # cap query
-            try:
-                res = await store.search(q, top_k=ragTopK or 6)
-            except Exception:
-                res = []
+        # un solo giro: embed di tutte le query + batch search; hit duplicati tra query → score migliore
+        try:
+            with tracing.span("rag.search", queries=len(queries), top_k=int(ragTopK or 6)):
+                results = await store.search_many(queries, top_k=int(ragTopK or 6))
+        except Exception:
+            results = []
+        best: dict = {}
+        for res in results:
             for hit in res:
-                txt = (hit.get("text") or "").strip()
-                if not txt:
-                    # fallback: mappa su client chunks se possibile
-                    key = (hit.get("path","").split("/")[-1], int(hit.get("chunk",0)))
-                    txt = cmap.get(key, "")
-                if txt:
-                    title = f"{hit.get('path','') or 'doc'}#{hit.get('chunk',0)} (score={hit.get('score',0.0):.3f})"
-                    materials.append({"title": title, "text": txt, "source": "store"})
+                key = (hit.get("path", ""), hit.get("chunk", 0))
+                if key not in best or hit.get("score", 0.0) > best[key].get("score", 0.0):
+                    best[key] = hit
+        for hit in sorted(best.values(), key=lambda h: -float(h.get("score", 0.0))):
+            txt = (hit.get("text") or "").strip()
+            if not txt:
+                # fallback: mappa su client chunks se possibile
+                key = (hit.get("path","").split("/")[-1], int(hit.get("chunk",0)))
+                txt = cmap.get(key, "")
+            if txt:
+                title = f"{hit.get('path','') or 'doc'}#{hit.get('chunk',0)} (score={hit.get('score',0.0):.3f})"
+                materials.append({"title": title, "text": txt, "source": "store"})
     return materials
 """
 usage for having SPEC.mD IDEA.md as RAG: 
@@ -1020,7 +1062,7 @@ async def _retrive_rag_chunks(messages: list[dict], rag_chunks: list[dict] | Non
     materials = []
     try:
         log.info("Clike with '%s' ", project_id)
-        store = RagStore(project_id=project_id or "default") if RagStore else None
+        store = open_store(project_id or "default") if RagStore else None
         log.info("store  '%s' ", store)
 
         # Prepara 'rag_queries' se non arrivano dal client: estrai da IDEA/SPEC headings nei chunks
@@ -1048,12 +1090,22 @@ def _tokens_per_model(messages: list[dict], model_entry: dict | None, req_max: i
     """
     Calcola i max tokens di completion effettivi nel rispetto di:
       ctx_window - prompt_tokens, req_max e max_output_tokens del modello.
+    HTTPException 413 se il prompt non lascia almeno MIN_OUTPUT_TOKENS di output.
     """
     ctx_window, max_out_cap = _resolve_ctx_caps(model_entry)
-    prompt_text = "".join(m.get("content","") for m in (messages or []) if isinstance(m.get("content"), str))
-    prompt_tokens = approx_tokens_from_chars(prompt_text)
+    prompt_tokens = count_message_tokens(messages or [], *_tok_target(model_entry))
 
-    available_ctx = max(10000, ctx_window - prompt_tokens)
+    # conteggio reale: niente pavimento a 10k che sforava la finestra di contesto
+    available_ctx = ctx_window - prompt_tokens - TOKEN_SAFETY_MARGIN
+    min_out = max(1, min(req_max, max_out_cap, MIN_OUTPUT_TOKENS))
+    if available_ctx < min_out:
+        # meglio un errore chiaro che un prompt oltre finestra con max_tokens=1
+        raise HTTPException(
+            status_code=413,
+            detail=(f"prompt too long for model context: prompt_tokens={prompt_tokens} "
+                    f"ctx_window={ctx_window} safety_margin={TOKEN_SAFETY_MARGIN} min_output={min_out}; "
+                    "reduce attachments/core blobs or use a model with a larger context window"),
+        )
     eff_max = max(1, min(req_max, available_ctx, max_out_cap))
 
     return eff_max
@@ -1152,6 +1204,13 @@ async def run(req: HarperRunRequest,  request: Request):
         if resolved_entry:
             log.info("harper.gateway normalized model '%s' -> id=%s (provider=%s)",
                      req.model, resolved_entry.get("id"), resolved_entry.get("provider"))
+    routed = False
+    if resolved_entry is None and not str(req.model or "").lower().startswith(("openai:","anthropic:","ollama:","vllm:","deepseek:","azure:","google:")):
+        resolved_entry = _gw_route_model(str(req.model or "auto"), phase)
+        routed = resolved_entry is not None
+        if routed:
+            log.info("harper.gateway routed model '%s' phase=%s -> id=%s (provider=%s)",
+                     req.model, phase, resolved_entry.get("id"), resolved_entry.get("provider"))
     
     # --- Context budgeting ---
     ctx_window, max_out_cap = _resolve_ctx_caps(resolved_entry)
@@ -1174,7 +1233,8 @@ async def run(req: HarperRunRequest,  request: Request):
     inline_files, rag_files, attachments = normalize_context_from_body(req)
     # If no explicit files were provided, but we have generic attachments, partition them.
     if not inline_files and not rag_files and attachments:
-        inline_files, rag_files = await decide_inline_or_rag(attachments)
+        with tracing.span("harper.attachments", attachments=len(attachments)):
+            inline_files, rag_files = await decide_inline_or_rag(attachments)
 
     
     log.info("inline_files  rag_files & attachments fileds: %s, %s, %s",  len(inline_files), len(rag_files), len(attachments))
@@ -1189,6 +1249,8 @@ async def run(req: HarperRunRequest,  request: Request):
     # ----- Normalizza input per provider -----
     # ATTENZIONE: niente virgola -> niente tupla!
     model = req.model  # era: req.model,
+    if routed:
+        model = resolved_entry.get("remote_name") or resolved_entry.get("name") or model
     if req.kit is not None:
         targets = req.kit.targets or []
         log.info("harper targets=%s", targets)
@@ -1276,15 +1338,16 @@ async def run(req: HarperRunRequest,  request: Request):
     # system_txt = compose_system_messages(phase, repourl)
     # #log.info("harper.gateway system_txt messages '%s' ", system_txt)
 
-    messages = _too_long_compose_system_messages(
-                            phase,
-                            idea,
-                            core_blobs,
-                            req.profileHint,
-                            model_route_label,
-                            req.runId,
-                            repourl,
-                            targets)
+    with tracing.span("harper.prompt", phase=phase, core_blobs=len(core_blobs)):
+        messages = _too_long_compose_system_messages(
+                                phase,
+                                idea,
+                                core_blobs,
+                                req.profileHint,
+                                model_route_label,
+                                req.runId,
+                                repourl,
+                                targets)
     
     if (phase or "").lower() == "idea":
 
@@ -1294,7 +1357,9 @@ async def run(req: HarperRunRequest,  request: Request):
             appended = []  # <--- evita UnboundLocalError
             # 1) tentativo locale via RagStore
             try:
-                appended = await _append_attachs_by_files(messages, project_id, pathFiles, inline_files)
+                with tracing.span("rag.attachments", paths=len(pathFiles), inline=len(inline_files)) as sp:
+                    appended = await _append_attachs_by_files(messages, project_id, pathFiles, inline_files)
+                    sp.set(materials=appended)
             except Exception as e:
                 log.warning("RAG (local RagStore) append failed: %s", e)
                 appended = 0
@@ -1349,9 +1414,7 @@ async def run(req: HarperRunRequest,  request: Request):
             incoming.append({"role": role, "content": content})
 
     # 2) calcola budget token per la chat in base a ctx_window, prompt_base e max out richiesto
-    base_prompt_tokens = approx_tokens_from_chars("".join(
-        m.get("content","") for m in messages if isinstance(m.get("content"), str)
-    ))
+    base_prompt_tokens = count_message_tokens(messages, *_tok_target(resolved_entry, req.model))
     ctx_window, max_out_cap = _resolve_ctx_caps(resolved_entry)
     requested_out = int((req.gen or {}).get("max_tokens", 7500))
     # margine di sicurezza per header/model/tooling
@@ -1360,23 +1423,25 @@ async def run(req: HarperRunRequest,  request: Request):
     chat_budget = max(0, ctx_window - base_prompt_tokens - requested_out - SAFETY_PROMPT_TOKENS)
     if incoming and chat_budget > 0:
         raw_ctx = _render_chat_context(incoming)
-        clipped_ctx = _clip_text_to_tokens(raw_ctx, chat_budget)
+        clipped_ctx = _clip_text_to_tokens(raw_ctx, chat_budget, resolved_entry)
         if clipped_ctx:
             # Ricicliamo il messaggio 'user' già costruito, aggiungendo un blocco "Recent Harper chat"
             messages[1]["content"] += "\n\n### Recent Harper chat (trimmed)\n" + clipped_ctx
     # 0) Check token per model
     # --- Context budgeting ---
-    eff_max = _tokens_per_model(messages, resolved_entry, gen_max_tokens)
+    with tracing.span("harper.budget", messages=len(messages)) as sp:
+        eff_max = _tokens_per_model(messages, resolved_entry, gen_max_tokens)
+        sp.set(eff_max=eff_max)
     # timeout dinamico (60s base + 2s per 1k token, max 180s)
     # tuning: timeout dinamico (90s base + 3.5s per 1k token, max 3000)
     timeout_sec = min(300.0, 110 + (eff_max / 1000.0) * 3.5)
     timeout_sec =600.0
     log.info("harper.gateway eff_max & timeout '%s' '%s'",
                     eff_max, timeout_sec)
-    log.info("harper.gateway eff_max=%s ctx_window=%s prompt_tokens≈%s cap=%s",
+    log.info("harper.gateway eff_max=%s ctx_window=%s prompt_tokens=%s cap=%s",
         eff_max,
         (_resolve_ctx_caps(resolved_entry)[0]),
-        approx_tokens_from_chars("".join(m.get("content","") for m in messages if isinstance(m.get("content"), str))),
+        count_message_tokens(messages, *_tok_target(resolved_entry, req.model)),
         (_resolve_ctx_caps(resolved_entry)[1]))
     #log.info("harper.gateway normalized messages '%s' ", messages)
 
@@ -1384,29 +1449,44 @@ async def run(req: HarperRunRequest,  request: Request):
         "phase": phase,
         "model": model_route_label,
         "runId": req.runId,
+        "trace_id": tracing.current_trace_id(),
     }
     warnings: list[str] = []
     errors: list[str] = []
     llm_text = None
     llm_usage = {}
-    try:
+    gen_cfg = dict(req.gen or {})
+    # /v1/responses non accetta seed: lì il seed non rende la chiamata deterministica
+    seed_provider = None if (provider == "openai" and gen_cfg.get("api") == "responses") else provider
+    cache_mode = response_cache.effective_mode(gen_cfg.pop("cache", None), gen_temperature, gen_cfg.get("seed"),
+                                               seed_provider)
+    # prompt caching del provider: breakpoint sul prefisso stabile (anthropic), chiave di prefisso (openai)
+    messages = prompt_cache.prepare_messages(messages, provider)
+    prompt_sha = prompt_registry.prompt_hash(_system_prompt_name(phase))
+    if provider == "openai" and prompt_cache.openai_cache_key(project_id, phase, prompt_sha):
+        gen_cfg.setdefault("prompt_cache_key", prompt_cache.openai_cache_key(project_id, phase, prompt_sha))
+
+    async def _call_llm():
         # Routing per provider
         if provider == "openai":
             if not OPENAI_API_KEY:
                 raise HTTPException(401, "missing OpenAI api key")
 
-            llm_text = await oai.openai_complete_unified(OPENAI_API_KEY, model, messages, req.gen, timeout_sec)
+            return await oai.openai_complete_unified(OPENAI_API_KEY, model, messages, gen_cfg, timeout_sec)
                 #llm_text = await oai.chat(OPENAI_BASE, OPENAI_API_KEY, model, messages, gen_temperature, eff_max, gen_response_format,gen_reasoning, gen_tools, gen_tool_choice, timeout=timeout_sec, top_p=gen_top_p, stop=gen_stop) 
 
         elif provider == "vllm":
-            llm_text =  await vll.chat(VLLM_BASE, model, messages, gen_temperature, eff_max, gen_response_format, gen_tools, gen_tool_choice, gen_top_p)
+            return await vll.chat(VLLM_BASE, None, model, messages, temperature=gen_temperature, max_tokens=eff_max,
+                                  response_format=gen_response_format, tools=gen_tools, tool_choice=gen_tool_choice,
+                                  timeout=timeout_sec, top_p=gen_top_p, seed=gen_seed)
         elif provider == "ollama":
-            llm_text =  await oll.chat(OLLAMA_BASE, model, messages, gen_temperature, eff_max, gen_top_p)   
+            return await oll.chat(OLLAMA_BASE, model, messages, temperature=gen_temperature, max_tokens=eff_max,
+                                  timeout=timeout_sec)
 
         elif provider == "anthropic":
             if not ANTHROPIC_API_KEY:
                 raise HTTPException(401, "missing ANTHROPIC api key")
-            llm_text = await anth.chat(
+            return await anth.chat(
                 ANTHROPIC_BASE, 
                 ANTHROPIC_API_KEY, 
                 model, 
@@ -1427,20 +1507,62 @@ async def run(req: HarperRunRequest,  request: Request):
             # log.info("harper_plan_debug: start")
             # await asyncio.sleep(60*10)  # 400 secondi
             # log.info("harper_plan_debug: end")
-            
-            
+        
+        
         else:
             raise HTTPException(400, f"unsupported provider for chat: {provider} for model '{req.model}")
 
+    cache_state = "bypass"
+    llm_t0 = time.monotonic()
+
+    def _write_provider_failure(status: int) -> None:
+        # errore HTTP del provider: record ok=false prima dell'HTTPException (routing_stats conta i fallimenti)
+        _write_telemetry(project_id, {
+            "project_id": project_id,
+            "project_name": project_id,
+            "run_id": req.runId,
+            "phase": phase,
+            "model": model,
+            "provider": provider,
+            "model_id": resolved_entry.get("id") if isinstance(resolved_entry, dict) else None,
+            "timestamp": time.time(),
+            "latency_ms": round((time.monotonic() - llm_t0) * 1000.0, 1),
+            "status": status,
+            "cache": cache_state,
+            "usage": {},
+            "ok": False})
+    try:
+        # exact-match response cache: re-run identici (stessi messages/modello/gen) tornano in ms
+        # span del provider (provider.http, da http_pool) annidato sotto llm.call
+        with tracing.span("llm.call", kind="client", provider=provider, model=model, cache_mode=cache_mode) as llm_sp:
+            llm_text, cache_state = await response_cache.cached_call(
+                cache_mode, provider, model, messages,
+                {"gen": gen_cfg, "temperature": gen_temperature, "max_tokens": gen_max_tokens, "eff_max": eff_max,
+                 "top_p": gen_top_p, "tools": gen_tools, "tool_choice": gen_tool_choice,
+                 "response_format": gen_response_format},
+                _call_llm,
+            )
+            tin, tout = metrics.usage_tokens(llm_text.get("usage") if isinstance(llm_text, dict) else None)
+            llm_sp.set(cache=cache_state, tokens_in=tin, tokens_out=tout)
+        telemetry["cache"] = cache_state
+        telemetry["latency_ms"] = round((time.monotonic() - llm_t0) * 1000.0, 1)
+        metrics.observe_llm(provider, model, time.monotonic() - llm_t0, cache=cache_state,
+                            usage=llm_text.get("usage") if isinstance(llm_text, dict) else None,
+                            ok=not (isinstance(llm_text, dict) and llm_text.get("ok") is False))
     except httpx.HTTPStatusError as e:
+            metrics.observe_llm(provider, model, time.monotonic() - llm_t0, ok=False)
             log.error("httpx error: %s", e)
             txt = e.response.text if e.response is not None else str(e)
             code = e.response.status_code if e.response is not None else 502
+            _write_provider_failure(code)
             raise HTTPException(code, detail=f"provider error for model={model}: {txt}")
     except httpx.HTTPError as e:
+            metrics.observe_llm(provider, model, time.monotonic() - llm_t0, ok=False)
             log.error("httpx error: %s", e)
+            _write_provider_failure(502)
             raise HTTPException(502, detail=f"provider connection error: {e}")
     except Exception as e:
+        metrics.observe_llm(provider, model, time.monotonic() - llm_t0, ok=False)
         log.error("httpx error: %s", e)
         errors.append(f"provider_error: {type(e).__name__}: {e}")
         spec_md_txt, llm_diag = ("", {})
@@ -1627,6 +1749,7 @@ async def run(req: HarperRunRequest,  request: Request):
 
     
     # --- Telemetry ---
+    llm_latency_ms = telemetry.get("latency_ms")
     telemetry = {}
 
      # === persist telemetry ====================================================
@@ -1642,18 +1765,22 @@ async def run(req: HarperRunRequest,  request: Request):
     }
     telemetry["files"] = [ {"path": f["path"], "bytes": len(f.get("content") or "")} for f in files ]
 
+    # cache hit: nessuna spesa verso il provider → usage/costo a zero, l'usage originale resta in cached_usage
+    billed_usage = {} if cache_state == "hit" else (llm_usage or {})
     telemetry.update({
         "text_len": text_len,
         "files_len": len(files),
-        "usage": llm_usage or {},
+        "usage": billed_usage,
         "provider": provider,    
     })
+    if cache_state == "hit":
+        telemetry["cached_usage"] = llm_usage or {}
     pm = _get_pricing_manager()  # [pricing]
     pricing_info = pm.estimate_cost(
         model_id=resolved_entry.get("id") if isinstance(resolved_entry, dict) else None,
         provider=resolved_entry.get("provider") if isinstance(resolved_entry, dict) else provider,
         name=resolved_entry.get("name") if isinstance(resolved_entry, dict) else model,
-        usage=llm_usage,
+        usage=billed_usage,
     )  # [pricing]
     log.info("pricing_info=%s", pricing_info)
     telemetry.setdefault("pricing", {})  # dict
@@ -1682,8 +1809,16 @@ async def run(req: HarperRunRequest,  request: Request):
         "snapshot": telemetry.get("usage") or {},
         "text_len": text_len,
         "files_len": len(files),
-        "usage": llm_usage or {},
-        "provider": provider})
+        "usage": billed_usage,
+        "cached_usage": telemetry.get("cached_usage"),
+        "provider": provider,
+        # segnali per lo scoring adattivo del routing (routing_stats)
+        "model_id": resolved_entry.get("id") if isinstance(resolved_entry, dict) else None,
+        "latency_ms": llm_latency_ms,
+        "cache": cache_state,
+        "prompt_cache": prompt_cache.cache_usage(billed_usage),
+        "prompt_sha": prompt_sha[:16],
+        "ok": len(errors) == 0})
     log.info("Telemetry saved for project_id=%s phase=%s model=%s telemetry=%s", project_id, phase, model, telemetry)
     return {
         "ok": len(errors) == 0,
@@ -1,6 +1,18 @@
 import os
 from fastapi import APIRouter
+from access_log import histograms as http_histograms
 from config import load_models_cfg
+from http_pool import pool_stats
+from model_catalog import catalog_status
+from prompt_registry import registry as prompt_registry
+from remote_catalog import catalog as remote_models_catalog
+from provider_health import tracker as provider_tracker
+import telemetry_writer
+from utils.blob_store import store as blob_store
+from utils.extraction import service as extraction_service
+from utils.response_cache import get_cache as get_response_cache
+from utils.tokenizer import get_tokenizer
+from utils import tracing
 
 router = APIRouter()
 
@@ -8,6 +20,41 @@ router = APIRouter()
 async def health():
     return {"clike gateway status": "ok"}
 
+@router.get("/health/pools")
+async def health_pools():
+    return {**pool_stats(), "extraction": extraction_service().stats(), "telemetry": telemetry_writer.stats()}
+
+@router.get("/health/http")
+async def health_http():
+    # istogrammi di latenza per route (access log middleware)
+    return http_histograms().snapshot()
+
+@router.get("/health/tracing")
+async def health_tracing():
+    # exporter locale degli span (coda, scritti, scartati)
+    return tracing.exporter().stats()
+
+@router.get("/health/providers")
+async def health_providers():
+    # stato breaker/EWMA per origin: letto anche dal router dell'orchestrator
+    return provider_tracker().snapshot()
+
+@router.get("/health/models")
+async def health_models():
+    # versione/caricamento del catalogo models.yaml (hot reload) ed eventuale errore di reload
+    return {"catalogs": catalog_status(), "remote": remote_models_catalog().snapshot()}
+
+@router.get("/health/prompts")
+async def health_prompts():
+    # sha256 dei prompt caricati: la "versione" usata in telemetria e nelle chiavi di cache
+    return prompt_registry().snapshot()
+
+@router.get("/health/cache")
+async def health_cache():
+    cache = get_response_cache()
+    return {"llm_responses": cache.stats() if cache else None, "tokenizer": get_tokenizer().stats(),
+            "blobs": blob_store().stats()}
+
 @router.get("/v1/models")
 async def list_models():
     _, models = load_models_cfg(os.getenv("MODELS_CONFIG", "/workspace/configs/models.yaml"))
@@ -0,0 +1,84 @@
+# routes/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+import telemetry_writer
+from access_log import LATENCY_BUCKETS, histograms as http_histograms, in_flight as http_in_flight
+from http_pool import pool_stats
+from metrics import Family, histogram_samples, registry
+from provider_health import tracker as provider_tracker
+from utils.extraction import service as extraction_service
+
+router = APIRouter()
+
+
+@registry().collector
+def _http_server():
+    # richieste servite dal gateway (access log middleware)
+    dur = Family("clike_http_request_duration_seconds", "histogram", "Durata delle richieste HTTP per route")
+    req = Family("clike_http_requests_total", "counter", "Richieste HTTP per route e classe di status")
+    for method, route, counts, total, count, status in http_histograms().items():
+        labels = {"method": method, "route": route}
+        for s in histogram_samples(LATENCY_BUCKETS, counts, total, count, labels):
+            dur.add(s[1], s[2], suffix=s[0])
+        for cls, n in status.items():
+            req.add({**labels, "status": cls}, n)
+    return [
+        dur,
+        req,
+        Family("clike_http_requests_in_flight", "gauge", "Richieste HTTP in corso").add({}, http_in_flight()),
+    ]
+
+
+@registry().collector
+def _http_pools():
+    # connection pool verso i provider (http_pool)
+    in_flight = Family("clike_upstream_pool_in_flight", "gauge", "Richieste in corso per origin")
+    max_conn = Family("clike_upstream_pool_max_connections", "gauge", "Limite connessioni per origin")
+    util = Family("clike_upstream_pool_utilization", "gauge", "in_flight / max_connections")
+    reqs = Family("clike_upstream_requests_total", "counter", "Richieste verso i provider per origin")
+    errs = Family("clike_upstream_errors_total", "counter", "Errori di rete/5xx/429 per origin")
+    sat = Family("clike_upstream_pool_saturated_total", "counter", "Richieste arrivate con pool saturo")
+    for p in pool_stats().get("pools") or []:
+        lbl = {"origin": p["origin"]}
+        in_flight.add(lbl, p["in_flight"])
+        max_conn.add(lbl, p["max_connections"])
+        util.add(lbl, p["utilization"])
+        reqs.add(lbl, p["requests_total"])
+        errs.add(lbl, p["errors_total"])
+        sat.add(lbl, p["saturated_total"])
+    return [in_flight, max_conn, util, reqs, errs, sat]
+
+
+@registry().collector
+def _providers():
+    # breaker e EWMA per origin (provider_health)
+    up = Family("clike_provider_available", "gauge", "1 se il breaker lascia passare richieste")
+    lat = Family("clike_provider_latency_ewma_seconds", "gauge", "Latenza EWMA fino agli header")
+    err = Family("clike_provider_error_rate", "gauge", "Tasso d'errore EWMA")
+    trips = Family("clike_provider_breaker_trips_total", "counter", "Aperture del breaker")
+    for p in provider_tracker().snapshot().get("providers") or []:
+        lbl = {"origin": p["origin"]}
+        up.add(lbl, 1 if p["available"] else 0)
+        if p["latency_ewma_s"] is not None:
+            lat.add(lbl, p["latency_ewma_s"])
+        err.add(lbl, p["error_rate"])
+        trips.add(lbl, p["trips"])
+    return [up, lat, err, trips]
+
+
+@registry().collector
+def _queues():
+    ex = extraction_service()
+    return [
+        Family("clike_telemetry_queue_depth", "gauge", "Record di telemetria in coda").add({}, telemetry_writer.queue_depth()),
+        Family("clike_telemetry_dropped_total", "counter", "Record di telemetria scartati a coda piena").add(
+            {}, telemetry_writer.stats()["dropped"]),
+        Family("clike_extraction_waiting", "gauge", "Estrazioni in attesa di uno slot").add({}, ex.waiting),
+        Family("clike_extraction_in_flight", "gauge", "Estrazioni in corso nel process pool").add({}, ex.in_flight),
+    ]
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry().render(), media_type="text/plain; version=0.0.4; charset=utf-8")
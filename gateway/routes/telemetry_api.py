@@ -3,10 +3,14 @@ from __future__ import annotations
 import logging
 import json, os
 from pathlib import Path
-from typing import Dict, List, Optional, Iterable
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 from fastapi import APIRouter, Query, HTTPException
 
+from utils.telemetry_store import get_store, EXTS as _EXTS, BUCKETS
+from routing_stats import routing_stats
+from utils import tracing
+
 # opzionale se lo userai in futuro
 try:
     from pricing import PricingManager  # noqa: F401
@@ -17,11 +21,11 @@ router = APIRouter(prefix="/v1/metrics", tags=["metrics"])
 log = logging.getLogger("gateway.telemetry")
 
 # === Config e util ===
+# Le API leggono dall'indice SQLite (utils/telemetry_store) allineato per offset ai file JSONL.
+
 _TELEMETRY_DIR_ENV = os.getenv("HARPER_TELEMETRY_DIR", "/workspace/telemetry")
 TELEMETRY_DIR: Path = Path(_TELEMETRY_DIR_ENV).resolve()
 
-_EXTS = {".json", ".jsonl",".ndjson", ".log", ".txt"}
-
 def _as_path(p) -> Path:
     return p if isinstance(p, Path) else Path(p)
 
@@ -30,82 +34,7 @@ def _ensure_base_dir() -> Path:
     base.mkdir(parents=True, exist_ok=True)
     return base
 
-def _iter_project_files() -> List[Path]:
-    base = _ensure_base_dir()
-    log.info("TELEMETRY_DIR [%s]: %s", type(base).__name__, base)
-    files: List[Path] = []
-    for p in base.rglob("*"):
-        if p.is_file() and p.suffix.lower() in _EXTS:
-            files.append(p)
-    files.sort()
-    return files
-
-def _safe_read_text(path: Path) -> str:
-    try:
-        with path.open("r", encoding="utf-8", errors="ignore") as f:
-            return f.read()
-    except Exception:
-        return ""
-
-def _load_any_json(path: Path, max_lines: Optional[int] = None) -> List[dict]:
-    """
-    Supporta:
-     - JSON array completo
-     - JSON Lines (una JSON per riga)
-    max_lines: se impostato, limita le righe processate (utile per /projects)
-    """
-    rows: List[dict] = []
-    if not path.exists():
-        return rows
-    text = _safe_read_text(path).strip()
-    if not text:
-        return rows
-
-    if text.startswith("[") and text.endswith("]"):
-        try:
-            arr = json.loads(text)
-            if isinstance(arr, list):
-                for x in arr:
-                    if isinstance(x, dict):
-                        rows.append(x)
-            return rows
-        except Exception:
-            # se array fallisce, tenta come JSONL
-            pass
-
-    # JSONL
-    count = 0
-    for line in text.splitlines():
-        if max_lines is not None and count >= max_lines:
-            break
-        s = line.strip()
-        if not s:
-            continue
-        try:
-            obj = json.loads(s)
-            if isinstance(obj, dict):
-                rows.append(obj)
-                count += 1
-        except Exception:
-            continue
-    return rows
-
-def _load_project(project_id: str) -> List[dict]:
-    # 1) file singolo <id>.(json|ndjson|log|txt) nella root
-    for ext in _EXTS:
-        cand = TELEMETRY_DIR / f"{project_id}{ext}"
-        if cand.exists():
-            return _load_any_json(cand)
-    # 2) cartella telemetry/<project_id>/** con file supportati
-    folder = TELEMETRY_DIR / project_id
-    rows: List[dict] = []
-    if folder.exists() and folder.is_dir():
-        for p in sorted(folder.rglob("*")):
-            if p.is_file() and p.suffix.lower() in _EXTS:
-                rows.extend(_load_any_json(p))
-    return rows
-
-def _resolve_relpath(relpath: str) -> Path:
+def _resolve_relpath(relpath: str) -> str:
     base = _ensure_base_dir()
     # normalizza e impedisci path traversal
     p = (base / relpath).resolve()
@@ -115,211 +44,195 @@ def _resolve_relpath(relpath: str) -> Path:
         raise HTTPException(status_code=404, detail="File not found")
     if p.suffix.lower() not in _EXTS:
         raise HTTPException(status_code=400, detail="Unsupported extension")
-    return p
+    return str(p.relative_to(base))
 
-def _load_file(relpath: str) -> List[dict]:
-    p = _resolve_relpath(relpath)
-    return _load_any_json(p)
+def _scope_project(project_id: str) -> Tuple[str, tuple]:
+    # <dir>/<id>.json oppure <dir>/<id>/**
+    return "file_project=?", (project_id,)
 
-def _num(x, default=0.0) -> float:
-    try:
-        return float(x)
-    except Exception:
-        return float(default)
+def _scope_file(relpath: str) -> Tuple[str, tuple]:
+    return "relpath=?", (_resolve_relpath(relpath),)
 
-def _int(x, default=0) -> int:
-    try:
-        return int(x)
-    except Exception:
-        return int(default)
-
-def _cost_from_row(r: dict) -> float:
-    """
-    Normalizza il costo:
-      - preferisci pricing.total_cost se presente
-      - poi r['cost_usd_est']
-      - fallback 0.0
-    """
-    pricing = r.get("pricing") or {}
-    tc = pricing.get("total_cost")
-    if tc is not None:
-        return _num(tc, 0.0)
-    return _num(r.get("cost_usd_est"), 0.0)
-
-def _tokens_in_from_row(r: dict) -> int:
-    usage = r.get("usage") or {}
-    return _int(
-        usage.get("prompt_tokens")
-        or usage.get("input_tokens")
-        or usage.get("cache_creation_input_tokens")
-        or 0,
-        0,
-    )
-
-def _tokens_out_from_row(r: dict) -> int:
-    usage = r.get("usage") or {}
-    return _int(
-        usage.get("completion_tokens")
-        or usage.get("output_tokens")
-        or 0,
-        0,
-    )
-
-def _project_ids_from_content(paths: Iterable[Path]) -> Dict[str, int]:
-    """
-    Scansiona i file e conta quante occorrenze/righe per project_id abbiamo.
-    Per efficienza, per i file molto grandi legge solo le prime ~50 righe.
-    """
-    counts: Dict[str, int] = {}
-    for p in paths:
-        if not (p.is_file() and p.suffix.lower() in _EXTS):
-            continue
-        rows = _load_any_json(p, max_lines=50)
-        for r in rows:
-            pid = r.get("project_id") or r.get("project") or ""
-            if not pid:
-                continue
-            counts[pid] = counts.get(pid, 0) + 1
-    return counts
+def _synced_store():
+    store = get_store()
+    store.sync()
+    return store
 
 # === API: elenco file presenti (globale o filtrato per progetto) ===
 @router.get("/harper/files")
 def list_telemetry_files(project_id: Optional[str] = Query(None)) -> dict:
     base = _ensure_base_dir()
+    store = _synced_store()
+    if project_id:
+        # file del progetto (nome file/cartella) o che contengono record col project_id
+        files = store.query(
+            "SELECT * FROM files WHERE file_project=? OR relpath IN "
+            "(SELECT DISTINCT relpath FROM rows WHERE project_id=?) ORDER BY relpath",
+            (project_id, project_id),
+        )
+    else:
+        files = store.files()
     items: List[dict] = []
-    for p in _iter_project_files():
-        if project_id:
-            rows = _load_any_json(p, max_lines=50)
-            # include se contiene almeno un record col project_id
-            if not any((r.get("project_id") == project_id) for r in rows):
-                # fallback: nome file/stem o nome cartella
-                if p.stem != project_id and p.parent.name != project_id:
-                    continue
-        st = p.stat()
-        try:
-            rel = str(p.relative_to(base))
-        except ValueError:
-            rel = str(p)
+    for f in files:
+        rel = f["relpath"]
         items.append({
-            "name": p.name,
+            "name": Path(rel).name,
             "relpath": rel,
-            "bytes": st.st_size,
-            "kb": round(st.st_size / 1024, 2),
-            "mtime": datetime.fromtimestamp(st.st_mtime).isoformat(timespec="seconds"),
-            "ext": p.suffix.lower(),
+            "bytes": f["size"],
+            "kb": round(f["size"] / 1024, 2),
+            "mtime": datetime.fromtimestamp(f["mtime"]).isoformat(timespec="seconds"),
+            "ext": Path(rel).suffix.lower(),
         })
     return {"dir": str(base), "files": items}
 
 # === Elenco progetti (dedotti dal contenuto) ===
 @router.get("/harper/projects")
 def list_projects() -> dict:
-    paths = _iter_project_files()
-    counts = _project_ids_from_content(paths)
-
-    # fallback: se vuoto, prova a dedurre da file/folder names
+    store = _synced_store()
+    counts: Dict[str, int] = {
+        r["pid"]: r["n"] for r in store.query(
+            "SELECT project_id AS pid, COUNT(DISTINCT relpath) AS n FROM rows"
+            " WHERE project_id != '' GROUP BY project_id"
+        )
+    }
+    # fallback: se vuoto, deduci da file/folder names
     if not counts:
-        for p in paths:
-            if p.parent == TELEMETRY_DIR and p.suffix.lower() in _EXTS:
-                counts[p.stem] = counts.get(p.stem, 0) + 1
-            elif p.parent.parent == TELEMETRY_DIR:
-                counts[p.parent.name] = counts.get(p.parent.name, 0) + 1
+        for r in store.query("SELECT file_project AS pid, COUNT(*) AS n FROM files GROUP BY file_project"):
+            counts[r["pid"]] = r["n"]
 
     projects = [{"id": pid, "files": n} for pid, n in sorted(counts.items())]
     return {"projects": projects}
 
-# === Helpers per aggregate/series/top/raw su una lista di righe ===
-def _aggregate_rows(rows: List[dict]) -> dict:
-    total_cost = 0.0
-    per_phase: Dict[str, dict] = {}
-    per_provider: Dict[str, dict] = {}
-    per_model: Dict[str, dict] = {}
-    by_day: Dict[str, dict] = {}
-
-    for r in rows:
-        phase = (r.get("phase") or "").lower()
-        prov  = (r.get("provider") or "").lower()
-        model = r.get("model") or ""
-        tin   = _tokens_in_from_row(r)
-        tout  = _tokens_out_from_row(r)
-        cost  = _cost_from_row(r)
-        total_cost += cost
-
-        per = per_phase.setdefault(phase, {"runs":0,"cost_usd":0.0,"tokens_in":0,"tokens_out":0})
-        per["runs"]+=1; per["cost_usd"]+=cost; per["tokens_in"]+=tin; per["tokens_out"]+=tout
-
-        pp = per_provider.setdefault(prov, {"runs":0,"cost_usd":0.0})
-        pp["runs"]+=1; pp["cost_usd"]+=cost
-
-        pm = per_model.setdefault(model, {"runs":0,"cost_usd":0.0})
-        pm["runs"]+=1; pm["cost_usd"]+=cost
-
-        day = datetime.utcfromtimestamp(_num(r.get("timestamp"),0)).strftime("%Y-%m-%d")
-        bd = by_day.setdefault(day, {"runs":0,"cost_usd":0.0,"tokens_in":0,"tokens_out":0})
-        bd["runs"]+=1; bd["cost_usd"]+=cost; bd["tokens_in"]+=tin; bd["tokens_out"]+=tout
+# === Query su indice per aggregate/series/top/raw (scope = progetto o file) ===
+def _where(scope: Tuple[str, tuple], since_ts: Optional[float] = None,
+           until_ts: Optional[float] = None) -> Tuple[str, list]:
+    clause, params = scope
+    parts, args = [clause], list(params)
+    if since_ts is not None:
+        parts.append("ts >= ?"); args.append(since_ts)
+    if until_ts is not None:
+        parts.append("ts <= ?"); args.append(until_ts)
+    return " AND ".join(parts), args
+
+def _rollup_where(scope: Tuple[str, tuple], gran: str, since_ts: Optional[float] = None,
+                  until_ts: Optional[float] = None) -> Tuple[str, list]:
+    # range allineato ai bucket della granularità scelta
+    clause, params = scope
+    parts, args = ["gran = ?", clause], [gran, *params]
+    width = BUCKETS[gran]
+    if since_ts is not None:
+        parts.append("bucket >= ?"); args.append(int(since_ts // width) * width)
+    if until_ts is not None:
+        parts.append("bucket <= ?"); args.append(until_ts)
+    return " AND ".join(parts), args
 
-    return {
-        "total_runs": len(rows),
-        "total_cost_usd": round(total_cost, 6),
-        "per_phase": per_phase,
-        "per_provider": per_provider,
-        "per_model": per_model,
-        "by_day": by_day,
+def _aggregate_rows(scope: Tuple[str, tuple], since_ts: Optional[float] = None,
+                    until_ts: Optional[float] = None, bucket: Optional[str] = None) -> dict:
+    """
+    Aggregate dai rollup: O(bucket). Senza range bastano i bucket giornalieri;
+    con since/until si usano quelli al minuto (precisione del range: 1 minuto).
+    """
+    store = _synced_store()
+    gran = "minute" if (since_ts is not None or until_ts is not None) else "day"
+    where, args = _rollup_where(scope, gran, since_ts, until_ts)
+    tot = store.query(
+        f"SELECT COALESCE(SUM(runs),0) AS runs, COALESCE(SUM(cost),0) AS cost FROM rollup WHERE {where}",
+        tuple(args),
+    )[0]
+
+    def _group(col: str, with_tokens: bool, where: str = where, args: list = args) -> Dict[str, dict]:
+        extra = ", SUM(tokens_in) AS tin, SUM(tokens_out) AS tout" if with_tokens else ""
+        out: Dict[str, dict] = {}
+        for r in store.query(
+            f"SELECT {col} AS k, SUM(runs) AS runs, SUM(cost) AS cost{extra} FROM rollup WHERE {where}"
+            " GROUP BY k ORDER BY k",
+            tuple(args),
+        ):
+            d = {"runs": r["runs"], "cost_usd": r["cost"] or 0.0}
+            if with_tokens:
+                d["tokens_in"] = r["tin"] or 0
+                d["tokens_out"] = r["tout"] or 0
+            out[r["k"]] = d
+        return out
+
+    agg = {
+        "total_runs": tot["runs"],
+        "total_cost_usd": round(tot["cost"], 6),
+        "per_phase": _group("phase", True),
+        "per_provider": _group("provider", False),
+        "per_model": _group("model", False),
+        "by_day": _group("strftime('%Y-%m-%d', bucket, 'unixepoch')", True),
     }
+    if bucket:
+        bw, ba = _rollup_where(scope, bucket, since_ts, until_ts)
+        agg["bucket"] = bucket
+        agg["by_bucket"] = _group("strftime('%Y-%m-%dT%H:%M:%SZ', bucket, 'unixepoch')", True, bw, ba)
+    return agg
 
-def _series_rows(rows: List[dict], phase: Optional[str]) -> List[dict]:
-    out = []
-    for r in rows:
-        if phase and (r.get("phase") or "").lower() != phase.lower():
-            continue
-        out.append({
-            "t": _num(r.get("timestamp"), 0.0),
-            "cost_usd": _cost_from_row(r),
-            "tokens_in": _tokens_in_from_row(r),
-            "tokens_out": _tokens_out_from_row(r),
-            "phase": r.get("phase"),
-            "model": r.get("model"),
-            "provider": r.get("provider"),
-            "run_id": r.get("run_id"),
-        })
-    out.sort(key=lambda x: x["t"])
-    return out
+def _bucket_series(scope: Tuple[str, tuple], phase: Optional[str], bucket: str,
+                   since_ts: Optional[float], until_ts: Optional[float]) -> List[dict]:
+    where, args = _rollup_where(scope, bucket, since_ts, until_ts)
+    if phase:
+        where += " AND phase = ?"; args.append(phase.lower())
+    rows = _synced_store().query(
+        "SELECT bucket, SUM(runs) AS runs, SUM(cost) AS cost, SUM(tokens_in) AS tin, SUM(tokens_out) AS tout"
+        f" FROM rollup WHERE {where} GROUP BY bucket ORDER BY bucket",
+        tuple(args),
+    )
+    return [{"t": float(r["bucket"]), "runs": r["runs"], "cost_usd": r["cost"],
+             "tokens_in": r["tin"], "tokens_out": r["tout"]} for r in rows]
+
+def _series_rows(scope: Tuple[str, tuple], phase: Optional[str],
+                 since_ts: Optional[float] = None, until_ts: Optional[float] = None) -> List[dict]:
+    where, args = _where(scope, since_ts, until_ts)
+    if phase:
+        where += " AND phase = ?"; args.append(phase.lower())
+    rows = _synced_store().query(
+        "SELECT ts, cost, tokens_in, tokens_out, json_extract(raw,'$.phase') AS phase,"
+        " json_extract(raw,'$.model') AS model, json_extract(raw,'$.provider') AS provider,"
+        f" json_extract(raw,'$.run_id') AS run_id FROM rows WHERE {where} ORDER BY ts, id",
+        tuple(args),
+    )
+    return [{
+        "t": r["ts"],
+        "cost_usd": r["cost"],
+        "tokens_in": r["tokens_in"],
+        "tokens_out": r["tokens_out"],
+        "phase": r["phase"],
+        "model": r["model"],
+        "provider": r["provider"],
+        "run_id": r["run_id"],
+    } for r in rows]
+
+def _top_rows(scope: Tuple[str, tuple], limit: int) -> List[dict]:
+    where, args = _where(scope)
+    rows = _synced_store().query(
+        f"SELECT raw FROM rows WHERE {where} ORDER BY cost DESC, id LIMIT ?", tuple(args + [limit])
+    )
+    return [json.loads(r["raw"]) for r in rows]
 
-def _raw_rows(rows: List[dict],
+_SORT_COLS = {"timestamp": "ts", "cost": "cost", "tokens_in": "tokens_in", "tokens_out": "tokens_out"}
+
+def _raw_rows(scope: Tuple[str, tuple],
               phase: Optional[str], model: Optional[str], provider: Optional[str],
               q: Optional[str], sort: str, page: int, page_size: int) -> dict:
-    def norm(s): return (s or "").lower()
-    if phase:    rows = [r for r in rows if norm(r.get("phase"))    == norm(phase)]
-    if model:    rows = [r for r in rows if norm(r.get("model"))    == norm(model)]
-    if provider: rows = [r for r in rows if norm(r.get("provider")) == norm(provider)]
-    if q:        rows = [r for r in rows if q.lower() in norm(r.get("run_id"))]
-
-    for r in rows:
-        r["_tokens_in"]  = _tokens_in_from_row(r)
-        r["_tokens_out"] = _tokens_out_from_row(r)
-        r["_cost"]       = _cost_from_row(r)
-        r["_ts"]         = _num(r.get("timestamp"), 0.0)
+    where, args = _where(scope)
+    if phase:    where += " AND phase = ?";              args.append(phase.lower())
+    if model:    where += " AND lower(model) = ?";       args.append(model.lower())
+    if provider: where += " AND provider = ?";           args.append(provider.lower())
+    if q:        where += " AND instr(lower(run_id), ?) > 0"; args.append(q.lower())
 
     key, direction = sort.split(":")
-    keymap = {
-        "timestamp": lambda r: r["_ts"],
-        "cost":      lambda r: r["_cost"],
-        "tokens_in": lambda r: r["_tokens_in"],
-        "tokens_out":lambda r: r["_tokens_out"],
-    }
-    rows.sort(key=keymap[key], reverse=(direction=="desc"))
-
-    total = len(rows)
-    start = (page-1)*page_size
-    end   = start + page_size
-    page_items = rows[start:end]
-
-    for r in page_items:
-        for k in ["_tokens_in","_tokens_out","_cost","_ts"]:
-            r.pop(k, None)
-
+    order = f"{_SORT_COLS[key]} {'DESC' if direction == 'desc' else 'ASC'}, id"
+    store = _synced_store()
+    total = store.query(f"SELECT COUNT(*) AS n FROM rows WHERE {where}", tuple(args))[0]["n"]
+    rows = store.query(
+        f"SELECT raw FROM rows WHERE {where} ORDER BY {order} LIMIT ? OFFSET ?",
+        tuple(args + [page_size, (page - 1) * page_size]),
+    )
     return {
         "page": page, "page_size": page_size, "total": total,
-        "items": page_items,
+        "items": [json.loads(r["raw"]) for r in rows],
     }
 
 # === Aggregate / Series / Top per PROGETTO ===
@@ -328,26 +241,30 @@ def harper_aggregate(
     project_id: str = Query(...),
     since_ts: Optional[float] = Query(None),
     until_ts: Optional[float] = Query(None),
+    bucket: Optional[str] = Query(None, regex=r"^(minute|hour|day)$", description="granularità dei bucket (rollup)"),
 ) -> dict:
-    rows = _load_project(project_id)
-    if since_ts is not None:
-        rows = [r for r in rows if _num(r.get("timestamp")) >= since_ts]
-    if until_ts is not None:
-        rows = [r for r in rows if _num(r.get("timestamp")) <= until_ts]
-    agg = _aggregate_rows(rows)
+    agg = _aggregate_rows(_scope_project(project_id), since_ts, until_ts, bucket)
     agg["project_id"] = project_id
     return agg
 
 @router.get("/harper/series")
-def harper_series(project_id: str, phase: Optional[str] = None) -> dict:
-    rows = _load_project(project_id)
-    return {"project_id": project_id, "phase": phase, "series": _series_rows(rows, phase)}
+def harper_series(
+    project_id: str,
+    phase: Optional[str] = None,
+    bucket: Optional[str] = Query(None, regex=r"^(minute|hour|day)$", description="granularità dei bucket (rollup)"),
+    since_ts: Optional[float] = Query(None),
+    until_ts: Optional[float] = Query(None),
+) -> dict:
+    scope = _scope_project(project_id)
+    if bucket:
+        series = _bucket_series(scope, phase, bucket, since_ts, until_ts)
+    else:
+        series = _series_rows(scope, phase, since_ts, until_ts)
+    return {"project_id": project_id, "phase": phase, "bucket": bucket, "series": series}
 
 @router.get("/harper/top")
 def harper_top(project_id: str, limit: int = Query(10, ge=1, le=100)) -> dict:
-    rows = _load_project(project_id)
-    ranked = sorted(rows, key=lambda r: _cost_from_row(r), reverse=True)[:limit]
-    return {"project_id": project_id, "top": ranked}
+    return {"project_id": project_id, "top": _top_rows(_scope_project(project_id), limit)}
 
 @router.get("/harper/raw")
 def harper_raw(
@@ -360,29 +277,40 @@ def harper_raw(
     page: int = Query(1, ge=1),
     page_size: int = Query(25, ge=1, le=200),
 ) -> dict:
-    rows = _load_project(project_id)
-    data = _raw_rows(rows, phase, model, provider, q, sort, page, page_size)
+    data = _raw_rows(_scope_project(project_id), phase, model, provider, q, sort, page, page_size)
     data["project_id"] = project_id
     return data
 
 # === Aggregate / Series / Top / Raw per FILE ===
 @router.get("/harper/aggregate_file")
-def harper_aggregate_file(relpath: str = Query(...)) -> dict:
-    rows = _load_file(relpath)
-    agg = _aggregate_rows(rows)
+def harper_aggregate_file(
+    relpath: str = Query(...),
+    since_ts: Optional[float] = Query(None),
+    until_ts: Optional[float] = Query(None),
+    bucket: Optional[str] = Query(None, regex=r"^(minute|hour|day)$", description="granularità dei bucket (rollup)"),
+) -> dict:
+    agg = _aggregate_rows(_scope_file(relpath), since_ts, until_ts, bucket)
     agg["relpath"] = relpath
     return agg
 
 @router.get("/harper/series_file")
-def harper_series_file(relpath: str = Query(...), phase: Optional[str] = None) -> dict:
-    rows = _load_file(relpath)
-    return {"relpath": relpath, "phase": phase, "series": _series_rows(rows, phase)}
+def harper_series_file(
+    relpath: str = Query(...),
+    phase: Optional[str] = None,
+    bucket: Optional[str] = Query(None, regex=r"^(minute|hour|day)$", description="granularità dei bucket (rollup)"),
+    since_ts: Optional[float] = Query(None),
+    until_ts: Optional[float] = Query(None),
+) -> dict:
+    scope = _scope_file(relpath)
+    if bucket:
+        series = _bucket_series(scope, phase, bucket, since_ts, until_ts)
+    else:
+        series = _series_rows(scope, phase, since_ts, until_ts)
+    return {"relpath": relpath, "phase": phase, "bucket": bucket, "series": series}
 
 @router.get("/harper/top_file")
 def harper_top_file(relpath: str = Query(...), limit: int = Query(10, ge=1, le=100)) -> dict:
-    rows = _load_file(relpath)
-    ranked = sorted(rows, key=lambda r: _cost_from_row(r), reverse=True)[:limit]
-    return {"relpath": relpath, "top": ranked}
+    return {"relpath": relpath, "top": _top_rows(_scope_file(relpath), limit)}
 
 @router.get("/harper/raw_file")
 def harper_raw_file(
@@ -395,7 +323,40 @@ def harper_raw_file(
     page: int = Query(1, ge=1),
     page_size: int = Query(25, ge=1, le=200),
 ) -> dict:
-    rows = _load_file(relpath)
-    data = _raw_rows(rows, phase, model, provider, q, sort, page, page_size)
+    data = _raw_rows(_scope_file(relpath), phase, model, provider, q, sort, page, page_size)
     data["relpath"] = relpath
     return data
+
+# === API: trace distribuito di una richiesta (span di orchestrator + gateway, vedi tracing.py) ===
+@router.get("/traces/{trace_id}")
+def trace_spans(trace_id: str, days: int = Query(2, ge=1, le=31)) -> dict:
+    if not tracing.parse_traceparent(f"00-{trace_id.lower()}-{'1' * 16}-01"):
+        raise HTTPException(status_code=400, detail="Invalid trace_id")
+    spans = tracing.read_trace(trace_id, days=days)
+    if not spans:
+        raise HTTPException(status_code=404, detail="Trace not found")
+    # tempo per stage (nome dello span): dove va la durata di una fase
+    stages: Dict[str, dict] = {}
+    for sp in spans:
+        st = stages.setdefault(sp.get("name") or "?", {"count": 0, "total_ms": 0.0, "max_ms": 0.0, "errors": 0})
+        d = float(sp.get("duration_ms") or 0.0)
+        st["count"] += 1
+        st["total_ms"] = round(st["total_ms"] + d, 2)
+        st["max_ms"] = max(st["max_ms"], d)
+        st["errors"] += 1 if sp.get("status") == "error" else 0
+    t0 = spans[0].get("ts") or 0
+    t1 = max((sp.get("ts") or 0) + float(sp.get("duration_ms") or 0) / 1000 for sp in spans)
+    return {
+        "trace_id": trace_id.lower(),
+        "duration_ms": round((t1 - t0) * 1000, 2),
+        "stages": dict(sorted(stages.items(), key=lambda kv: -kv[1]["total_ms"])),
+        "spans": spans,
+    }
+
+# === API: statistiche misurate per il routing adattivo (lette anche dall'orchestrator) ===
+@router.get("/routing")
+async def routing_metrics(refresh: bool = Query(False)):
+    stats = routing_stats()
+    if refresh:
+        await stats.refresh_async(force=True)
+    return stats.snapshot()
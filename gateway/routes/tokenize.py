@@ -0,0 +1,48 @@
+# routes/tokenize.py
+import logging
+from typing import Any, Dict, List, Optional
+from fastapi import APIRouter, HTTPException
+from pydantic import BaseModel, Field
+
+from model_catalog import get_catalog
+from utils.tokenizer import get_tokenizer
+
+router = APIRouter()
+log = logging.getLogger("gateway.tokenize")
+
+
+class TokenizeRequest(BaseModel):
+    model: Optional[str] = Field(None, description="id/name/alias da models.yaml o nome remoto (es. gpt-4o)")
+    provider: Optional[str] = None
+    text: Optional[str] = None
+    messages: Optional[List[Dict[str, Any]]] = None
+    return_ids: bool = Field(False, description="solo per encoding esatti (OpenAI/tiktoken)")
+
+
+def _resolve(model: Optional[str], provider: Optional[str]) -> tuple:
+    # modello del catalogo → provider + nome remoto; altrimenti si usa quanto passato
+    try:
+        m = get_catalog().find(model or "") if model else None
+    except Exception:
+        m = None
+    if m:
+        return (provider or m.get("provider")), (m.get("remote_name") or m.get("name") or model)
+    return provider, model
+
+
+@router.post("/v1/tokenize")
+def tokenize(req: TokenizeRequest):
+    # sync: FastAPI la esegue nel threadpool, l'encoding BPE di testi lunghi non blocca l'event loop
+    if req.text is None and req.messages is None:
+        raise HTTPException(400, "either 'text' or 'messages' is required")
+    provider, model = _resolve(req.model, req.provider)
+    tok = get_tokenizer()
+    if req.messages is not None:
+        info = tok.encode("", provider, model)
+        info.pop("ids", None)
+        info["tokens"] = tok.count_messages(req.messages, provider, model)
+    else:
+        info = tok.encode(req.text or "", provider, model)
+        if not req.return_ids:
+            info.pop("ids", None)
+    return {"model": req.model, "provider": provider, "remote_model": model, **info}
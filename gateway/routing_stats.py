@@ -0,0 +1,205 @@
+# gateway/routing_stats.py
+"""
+Statistiche misurate per il routing adattivo, derivate dalla telemetria Harper
+(indice utils/telemetry_store).
+
+Per (fase, provider, modello) sulla finestra ROUTING_STATS_WINDOW_H (default 7 giorni):
+  - latenza p50/p95 della chiamata al provider (latency_ms; esclusi i cache hit)
+  - throughput tokens/sec (tokens_out / latenza)
+  - failure rate (record con ok == false)
+  - costo medio per run (pricing.total_cost)
+Ricalcolate al più ogni ROUTING_STATS_REFRESH_S secondi, in un thread (asyncio.to_thread):
+lookup()/snapshot() non fanno mai I/O, leggono la cache (anche scaduta) e, se scaduta,
+pianificano il ricalcolo in background sul loop (come remote_catalog).
+
+Per lo scoring ogni metrica è normalizzata in [0,1] (0 = migliore) rispetto alla
+mediana della fase: norm = x / (x + mediana), quindi 0.5 = "nella media".
+Con meno di ROUTING_STATS_MIN_SAMPLES campioni il modello resta sulle etichette statiche.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import statistics
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils.telemetry_store import get_store
+
+log = logging.getLogger("gateway.routing_stats")
+
+WINDOW_H = float(os.getenv("ROUTING_STATS_WINDOW_H", str(7 * 24)))
+REFRESH_S = float(os.getenv("ROUTING_STATS_REFRESH_S", "60"))
+MIN_SAMPLES = int(os.getenv("ROUTING_STATS_MIN_SAMPLES", "5"))
+SCORE_MODE = os.getenv("ROUTING_SCORE_MODE", "static").strip().lower()  # static | measured
+
+ALL_PHASES = "*"
+
+
+def _pct(sorted_vals: List[float], q: float) -> Optional[float]:
+    if not sorted_vals:
+        return None
+    i = min(len(sorted_vals) - 1, max(0, int(round(q * (len(sorted_vals) - 1)))))
+    return sorted_vals[i]
+
+
+def _ratio(x: Optional[float], ref: Optional[float]) -> Optional[float]:
+    if x is None or not ref or ref <= 0:
+        return None
+    return x / (x + ref)
+
+
+def _summarize(samples: List[Tuple[Optional[float], int, float, bool]]) -> Dict[str, Any]:
+    lats = sorted(l for l, _t, _c, ok in samples if ok and l)
+    tps = [t / (l / 1000.0) for l, t, _c, ok in samples if ok and l and t]
+    fails = sum(1 for *_x, ok in samples if not ok)
+    costs = [c for _l, _t, c, ok in samples if ok]
+    return {
+        "n": len(samples),
+        "p50_ms": _pct(lats, 0.5),
+        "p95_ms": _pct(lats, 0.95),
+        "tok_s": statistics.median(tps) if tps else None,
+        "failure_rate": fails / len(samples) if samples else 0.0,
+        "cost": statistics.fmean(costs) if costs else None,
+    }
+
+
+def _normalize(stats: Dict[str, Dict[str, Any]]) -> None:
+    # riferimenti di fase: mediana tra i modelli con campioni sufficienti
+    ok = [s for s in stats.values() if s["n"] >= MIN_SAMPLES]
+
+    def med(key):
+        vals = [s[key] for s in ok if s.get(key)]
+        return statistics.median(vals) if vals else None
+
+    ref_lat = med("p50_ms")
+    ref_p95 = med("p95_ms")
+    ref_tps = med("tok_s")
+    ref_cost = med("cost")
+    for s in stats.values():
+        lat = [v for v in (_ratio(s["p50_ms"], ref_lat), _ratio(s["p95_ms"], ref_p95)) if v is not None]
+        tps = _ratio(ref_tps, s["tok_s"]) if s.get("tok_s") else None  # più tok/s → valore minore
+        speed = [v for v in (sum(lat) / len(lat) if lat else None, tps) if v is not None]
+        s["norm"] = {
+            "latency": sum(speed) / len(speed) if speed else None,
+            "cost": _ratio(s["cost"], ref_cost),
+            "failure": s["failure_rate"],
+        }
+        s["measured"] = s["n"] >= MIN_SAMPLES
+
+
+class RoutingStats:
+    def __init__(self, window_h: float = WINDOW_H, refresh_s: float = REFRESH_S):
+        self.window_s = window_h * 3600.0
+        self.refresh_s = refresh_s
+        self._lock = threading.Lock()
+        self._at = 0.0
+        self._task: Optional[asyncio.Task] = None
+        # phase -> "provider:model" -> stats
+        self._stats: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+    def refresh(self, force: bool = False) -> None:
+        # sincrono: usato fuori dal loop (script) o dentro asyncio.to_thread
+        if not force and time.monotonic() - self._at < self.refresh_s:
+            return
+        with self._lock:
+            if not force and time.monotonic() - self._at < self.refresh_s:
+                return
+            try:
+                self._stats = self._compute()
+            except Exception as e:
+                log.warning("routing stats refresh failed: %s", e)
+            self._at = time.monotonic()
+
+    async def refresh_async(self, force: bool = False) -> None:
+        # store.sync() + SQL aggregata fuori dall'event loop
+        await asyncio.to_thread(self.refresh, force)
+
+    def _schedule(self) -> Optional[asyncio.Task]:
+        if time.monotonic() - self._at < self.refresh_s:
+            return None
+        if self._task is not None and not self._task.done():
+            return self._task
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return None  # fuori dal loop (script): nessun refresh, si serve la cache
+        self._task = loop.create_task(self.refresh_async(), name="routing-stats-refresh")
+        return self._task
+
+    def _compute(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        store = get_store()
+        store.sync()
+        rows = store.query(
+            "SELECT phase, provider, model, tokens_out, cost,"
+            " json_extract(raw, '$.latency_ms') AS latency_ms,"
+            " json_extract(raw, '$.ok') AS ok,"
+            " json_extract(raw, '$.cache') AS cache,"
+            " json_extract(raw, '$.model_id') AS model_id"
+            " FROM rows WHERE ts >= ?",
+            (time.time() - self.window_s,),
+        )
+        samples: Dict[str, Dict[str, list]] = defaultdict(lambda: defaultdict(list))
+        for r in rows:
+            if r["cache"] == "hit":
+                continue  # risposta dalla cache: non misura il provider
+            ok = r["ok"] is None or bool(r["ok"])
+            lat = float(r["latency_ms"]) if r["latency_ms"] is not None else None
+            if ok and lat is None:
+                continue  # record storici senza latenza
+            sample = (lat, int(r["tokens_out"] or 0), float(r["cost"] or 0.0), ok)
+            for key in {f"{r['provider']}:{r['model']}", f"{r['provider']}:{r['model_id']}"}:
+                if not key.endswith(":None"):
+                    samples[r["phase"]][key].append(sample)
+                    samples[ALL_PHASES][key].append(sample)
+        out: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for phase, by_model in samples.items():
+            out[phase] = {k: _summarize(v) for k, v in by_model.items()}
+            _normalize(out[phase])
+        log.info("routing stats refreshed: %d rows, phases=%s", len(rows), sorted(out))
+        return out
+
+    def lookup(self, m: Dict[str, Any], phase: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Stats misurate per il modello (per fase, altrimenti su tutte le fasi) o None."""
+        self._schedule()
+        provider = (m.get("provider") or "").lower()
+        keys = [f"{provider}:{m.get(k)}" for k in ("id", "name", "remote_name") if m.get(k)]
+        for ph in ([(phase or "").lower()] if phase else []) + [ALL_PHASES]:
+            by_model = self._stats.get(ph) or {}
+            for k in keys:
+                s = by_model.get(k)
+                if s and s.get("measured"):
+                    return s
+        return None
+
+    def snapshot(self) -> Dict[str, Any]:
+        self._schedule()
+        return {"window_h": self.window_s / 3600.0, "min_samples": MIN_SAMPLES, "phases": self._stats}
+
+
+_STATS = RoutingStats()
+
+
+def routing_stats() -> RoutingStats:
+    return _STATS
+
+
+async def startup() -> None:
+    # primo calcolo in background: fino ad allora lo scoring resta sulle etichette statiche
+    _STATS._schedule()
+
+
+async def shutdown() -> None:
+    t = _STATS._task
+    if t is not None and not t.done():
+        t.cancel()
+        await asyncio.gather(t, return_exceptions=True)
+    _STATS._task = None
+
+
+def score_mode(cfg: Optional[Dict[str, Any]]) -> str:
+    # models.yaml scoring.mode ha la precedenza sull'env
+    return str(((cfg or {}).get("scoring") or {}).get("mode") or SCORE_MODE).strip().lower()
@@ -0,0 +1,186 @@
+# gateway/telemetry_writer.py
+"""
+Writer asincrono della telemetria Harper.
+
+- I record arrivano su una asyncio.Queue (submit() non blocca mai il loop).
+- Un task di background li accumula e ogni HARPER_TELEMETRY_FLUSH_MS (o a
+  HARPER_TELEMETRY_BATCH record) fa un solo append bufferizzato per file, in thread.
+- Rotazione: se il file supera HARPER_TELEMETRY_ROTATE_MB (0 = off) o, con
+  HARPER_TELEMETRY_ROTATE_DAILY=1, se l'ultimo append è di un altro giorno (UTC),
+  <dir>/<id>.json viene spostato in <dir>/<id>/<id>-<YYYYmmdd-HHMMSS>.json
+  (stesso progetto per l'indice di utils/telemetry_store).
+- Dopo ogni flush i file scritti vengono ingeriti nell'indice (righe + rollup).
+- Avviato/fermato dal lifespan FastAPI; lo shutdown svuota la coda e fa l'ultimo flush.
+  Se il writer non è attivo (script/test) si scrive in modo sincrono; a coda piena il record viene
+  scartato e contato (dropped, in /health/pools e /metrics): mai I/O sul loop sotto carico.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from utils.telemetry_store import get_store
+
+log = logging.getLogger("gateway.telemetry_writer")
+
+FLUSH_MS = int(os.getenv("HARPER_TELEMETRY_FLUSH_MS", "500"))
+BATCH_MAX = int(os.getenv("HARPER_TELEMETRY_BATCH", "500"))
+QUEUE_MAX = int(os.getenv("HARPER_TELEMETRY_QUEUE", "10000"))
+ROTATE_MB = float(os.getenv("HARPER_TELEMETRY_ROTATE_MB", "64"))
+ROTATE_DAILY = os.getenv("HARPER_TELEMETRY_ROTATE_DAILY", "0").strip() in ("1", "true", "True", "yes")
+
+
+def _rotate_if_needed(path: Path, incoming: int) -> bool:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return False
+    too_big = ROTATE_MB > 0 and st.st_size + incoming > ROTATE_MB * 1024 * 1024
+    new_day = ROTATE_DAILY and time.strftime("%Y%m%d", time.gmtime(st.st_mtime)) != time.strftime("%Y%m%d", time.gmtime())
+    if not (st.st_size and (too_big or new_day)):
+        return False
+    dest_dir = path.parent / path.stem
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.gmtime(st.st_mtime))
+    dest = dest_dir / f"{path.stem}-{stamp}{path.suffix}"
+    n = 1
+    while dest.exists():
+        dest = dest_dir / f"{path.stem}-{stamp}-{n}{path.suffix}"
+        n += 1
+    os.replace(path, dest)
+    log.info("telemetry rotated %s -> %s (%s)", path, dest, "size" if too_big else "day")
+    return True
+
+
+def write_batch(batch: List[Tuple[Path, dict]]) -> None:
+    """Append sincrono di un batch: un open/write per file, poi aggiornamento dell'indice."""
+    by_path: Dict[Path, List[str]] = defaultdict(list)
+    for path, record in batch:
+        by_path[path].append(json.dumps(record, ensure_ascii=False) + "\n")
+    rotated = False
+    for path, lines in by_path.items():
+        data = "".join(lines)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            rotated |= _rotate_if_needed(path, len(data.encode("utf-8")))
+            with path.open("a", encoding="utf-8") as f:
+                f.write(data)
+        except Exception as e:
+            log.warning("telemetry write failed for %s: %s", path, e)
+    try:
+        store = get_store()
+        if rotated:
+            store.sync(force=True)  # file spostati: riallinea tutto
+        else:
+            for path in by_path:
+                store.ingest(path)
+    except Exception as e:
+        log.warning("telemetry index update failed: %s", e)
+
+
+class TelemetryWriter:
+    def __init__(self, flush_ms: int = FLUSH_MS, batch_max: int = BATCH_MAX, queue_max: int = QUEUE_MAX):
+        self.flush_s = max(0.01, flush_ms / 1000.0)
+        self.batch_max = max(1, batch_max)
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max(1, queue_max))
+        self._task: Optional[asyncio.Task] = None
+        self.written = 0
+        self.flushes = 0
+        self.dropped = 0
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name="telemetry-writer")
+
+    def submit(self, path: Path, record: dict) -> None:
+        try:
+            self.queue.put_nowait((path, record))
+        except asyncio.QueueFull:
+            # niente scrittura inline (file + indice SQLite sul loop, in gara con il flush in thread)
+            self.dropped += 1
+            if self.dropped == 1 or self.dropped % 1000 == 0:
+                log.warning("telemetry queue full: record dropped (dropped=%d)", self.dropped)
+
+    async def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is None:  # sentinella di stop()
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.flush_s
+            while len(batch) < self.batch_max:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    nxt = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                if nxt is None:
+                    stopping = True
+                    break
+                batch.append(nxt)
+            await self._flush(batch)
+
+    async def _flush(self, batch: List[Tuple[Path, dict]]) -> None:
+        try:
+            await asyncio.to_thread(write_batch, batch)
+            self.written += len(batch)
+            self.flushes += 1
+        except Exception as e:
+            log.warning("telemetry flush failed (%d records): %s", len(batch), e)
+
+    async def stop(self) -> None:
+        # la sentinella arriva dopo i record già in coda: tutto viene scritto prima di uscire
+        if self._task is not None:
+            await self.queue.put(None)
+            await self._task
+            self._task = None
+        log.info("telemetry writer stopped (written=%d flushes=%d dropped=%d)",
+                 self.written, self.flushes, self.dropped)
+
+    def stats(self) -> Dict[str, int]:
+        return {"queued": self.queue.qsize(), "written": self.written, "flushes": self.flushes,
+                "dropped": self.dropped}
+
+
+_WRITER: Optional[TelemetryWriter] = None
+
+
+async def startup() -> None:
+    global _WRITER
+    _WRITER = TelemetryWriter()
+    _WRITER.start()
+
+
+async def shutdown() -> None:
+    global _WRITER
+    if _WRITER is not None:
+        await _WRITER.stop()
+        _WRITER = None
+
+
+def submit(path: Path, record: dict) -> None:
+    """Accoda un record; senza writer attivo scrive subito (script/test)."""
+    if _WRITER is None:
+        write_batch([(path, record)])
+    else:
+        _WRITER.submit(path, record)
+
+
+def stats() -> Dict[str, int]:
+    if _WRITER is None:
+        return {"queued": 0, "written": 0, "flushes": 0, "dropped": 0}
+    return _WRITER.stats()
+
+
+def queue_depth() -> int:
+    """Record in coda non ancora scritti (0 senza writer attivo)."""
+    return _WRITER.queue.qsize() if _WRITER is not None else 0
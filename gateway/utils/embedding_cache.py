@@ -0,0 +1,152 @@
+# Embedding cache content-addressed: (model id, sha256 del testo normalizzato) -> vettore float32
+# Persistente su SQLite (WAL) così gateway e orchestrator possono condividere lo stesso file
+# (entrambi montano /workspace). Eviction LRU per numero di entry e dimensione del file.
+
+from __future__ import annotations
+import os, time, sqlite3, hashlib, asyncio, logging, threading, unicodedata
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+log = logging.getLogger("rag.embed_cache")
+
+CACHE_PATH        = os.getenv("RAG_EMBED_CACHE_PATH", "/workspace/.cache/embeddings.sqlite")
+CACHE_ENABLED     = os.getenv("RAG_EMBED_CACHE", "1").strip() not in ("0", "false", "False", "no")
+CACHE_MAX_ENTRIES = int(os.getenv("RAG_EMBED_CACHE_MAX_ENTRIES", "500000"))
+CACHE_MAX_MB      = int(os.getenv("RAG_EMBED_CACHE_MAX_MB", "2048"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS emb (
+    model     TEXT NOT NULL,
+    h         TEXT NOT NULL,
+    dim       INTEGER NOT NULL,
+    vec       BLOB NOT NULL,
+    last_used REAL NOT NULL,
+    PRIMARY KEY (model, h)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS emb_last_used ON emb(last_used);
+"""
+
+
+def normalize_text(text: str) -> str:
+    # normalizzazione minima e stabile: unicode NFC, newline unix, spazi ai bordi
+    t = unicodedata.normalize("NFC", text or "")
+    return t.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+
+def text_key(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode("utf-8", "ignore")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = CACHE_PATH, *, max_entries: int = CACHE_MAX_ENTRIES, max_mb: int = CACHE_MAX_MB):
+        self.path = path
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_mb)) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    # --- sync core (eseguito in thread dagli wrapper async) ---
+    def get_many_sync(self, model: str, keys: Sequence[str]) -> Dict[str, List[float]]:
+        out: Dict[str, List[float]] = {}
+        uniq = list(dict.fromkeys(keys))
+        with self._lock:
+            for i in range(0, len(uniq), 500):  # limite variabili SQLite
+                part = uniq[i:i + 500]
+                qs = ",".join("?" * len(part))
+                rows = self._db.execute(
+                    f"SELECT h, vec FROM emb WHERE model=? AND h IN ({qs})", [model, *part]
+                ).fetchall()
+                for h, blob in rows:
+                    v = array("f")
+                    v.frombytes(blob)
+                    out[h] = v.tolist()
+            if out:
+                now = time.time()
+                self._db.executemany(
+                    "UPDATE emb SET last_used=? WHERE model=? AND h=?",
+                    [(now, model, h) for h in out],
+                )
+        self.hits += sum(1 for k in keys if k in out)
+        self.misses += sum(1 for k in keys if k not in out)
+        return out
+
+    def put_many_sync(self, model: str, items: Dict[str, List[float]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, h, len(v), array("f", v).tobytes(), now) for h, v in items.items()]
+        with self._lock:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO emb(model, h, dim, vec, last_used) VALUES (?,?,?,?,?)", rows
+            )
+            self._db.execute("COMMIT")
+            self.puts += len(rows)
+            self._evict_locked()
+
+    def _evict_locked(self) -> None:
+        n = self._db.execute("SELECT COUNT(*) FROM emb").fetchone()[0]
+        page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        # pagine in uso: page_count da solo non scende mai dopo i DELETE (restano nella freelist)
+        pages = (self._db.execute("PRAGMA page_count").fetchone()[0]
+                 - self._db.execute("PRAGMA freelist_count").fetchone()[0])
+        used = page_size * pages
+        over = n - self.max_entries
+        if used > self.max_bytes:
+            # sopra soglia dimensione: libera i meno usati, almeno il 10% e quanto basta a rientrare
+            over = max(over, n // 10, int(n * (1 - self.max_bytes / used)) + 1)
+        if over <= 0:
+            return
+        self._db.execute(
+            "DELETE FROM emb WHERE (model, h) IN (SELECT model, h FROM emb ORDER BY last_used LIMIT ?)",
+            (over,),
+        )
+        self.evictions += over
+        log.info("embed cache evicted %d entries (entries=%d)", over, n - over)
+
+    # --- async API ---
+    async def get_many(self, model: str, keys: Sequence[str]) -> Dict[str, List[float]]:
+        return await asyncio.to_thread(self.get_many_sync, model, keys)
+
+    async def put_many(self, model: str, items: Dict[str, List[float]]) -> None:
+        await asyncio.to_thread(self.put_many_sync, model, items)
+
+    def stats(self) -> Dict[str, object]:
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "puts": self.puts,
+            "evictions": self.evictions,
+        }
+
+
+_CACHE: Optional[EmbeddingCache] = None
+_CACHE_FAILED = False
+
+
+def get_cache() -> Optional[EmbeddingCache]:
+    """Singleton di processo; None se disabilitata o se il file non è apribile."""
+    global _CACHE, _CACHE_FAILED
+    if not CACHE_ENABLED or _CACHE_FAILED:
+        return None
+    if _CACHE is None:
+        try:
+            _CACHE = EmbeddingCache()
+        except Exception as e:
+            _CACHE_FAILED = True
+            log.warning("embed cache disabled (%s): %s", CACHE_PATH, e)
+            return None
+    return _CACHE
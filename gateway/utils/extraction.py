@@ -0,0 +1,455 @@
+# gateway/utils/extraction.py
+"""
+Estrazione testo dagli allegati binari (PDF/DOCX/XLSX/XLS/XLSB/PPTX) fuori dall'event loop.
+
+- Gli estrattori girano in un ProcessPoolExecutor limitato (EXTRACT_WORKERS processi, spawn):
+  il parsing CPU-bound di un allegato grande non blocca le altre richieste né tiene il GIL.
+- Timeout per file (EXTRACT_TIMEOUT_S): allo scadere il pool viene ricreato terminando i worker
+  e l'allegato vale "" come un'estrazione fallita. Le estrazioni sorelle perse nel reset (o per un
+  worker morto) vengono rilanciate sul pool nuovo fino a EXTRACT_RETRIES volte, poi contate e
+  loggate come fallite. Il reset avviene solo se il pool è ancora quello della submission:
+  chi attendeva sul pool già sostituito non abbatte quello nuovo.
+- Memoria: RLIMIT_AS per worker (EXTRACT_MEM_MB, Linux) → un file patologico fa morire il
+  worker, non il servizio; allegati oltre EXTRACT_MAX_MB non vengono aperti.
+- Fogli di calcolo in streaming: openpyxl read_only / xlrd on_demand / pyxlsb riga per riga,
+  con tetto di caratteri (EXTRACT_MAX_CHARS) che interrompe la lettura appena raggiunto.
+- Al più EXTRACT_MAX_PENDING estrazioni in volo; le altre attendono senza accodare byte nel pool.
+- EXTRACT_WORKERS=0 → stessi estrattori in thread (niente processi, timeout solo lato attesa).
+"""
+from __future__ import annotations
+
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Dict, List, Optional
+
+from utils import tracing
+
+log = logging.getLogger("gateway.extraction")
+
+EXTRACT_WORKERS = int(os.getenv("EXTRACT_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_TIMEOUT_S = float(os.getenv("EXTRACT_TIMEOUT_S", "60"))
+EXTRACT_MEM_MB = int(os.getenv("EXTRACT_MEM_MB", "1024"))
+EXTRACT_MAX_MB = int(os.getenv("EXTRACT_MAX_MB", "100"))
+EXTRACT_MAX_CHARS = int(os.getenv("EXTRACT_MAX_CHARS", "2000000"))
+EXTRACT_MAX_PENDING = int(os.getenv("EXTRACT_MAX_PENDING", str(max(1, EXTRACT_WORKERS) * 2)))
+EXTRACT_TASKS_PER_CHILD = int(os.getenv("EXTRACT_TASKS_PER_CHILD", "50"))
+EXTRACT_START_METHOD = os.getenv("EXTRACT_START_METHOD", "spawn")
+EXTRACT_RETRIES = int(os.getenv("EXTRACT_RETRIES", "1"))
+
+
+class _PoolLost(Exception):
+    """Submission persa per un reset del pool (timeout di un'altra estrazione / worker morto)."""
+
+
+class _Budget:
+    """Accumula righe fino al tetto di caratteri; add() → False quando il tetto è raggiunto."""
+
+    def __init__(self, max_chars: int):
+        self.parts: List[str] = []
+        self.left = max(1, int(max_chars))
+
+    def add(self, s: str) -> bool:
+        if self.left <= 0:
+            return False
+        s = s[: self.left]
+        self.parts.append(s)
+        self.left -= len(s) + 1
+        return self.left > 0
+
+    def text(self) -> str:
+        return "\n".join(self.parts)
+
+
+# --- estrattori (eseguiti nel worker) -----------------------------------------
+def _extract_text_from_pdf_bytes(raw: bytes, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    # pdfminer.six
+    try:
+        from pdfminer.high_level import extract_text
+        return (extract_text(io.BytesIO(raw)) or "")[:max_chars]
+    except Exception as e:
+        log.warning("PDF extract failed: %s", e)
+        return ""
+
+
+def _extract_text_from_docx_bytes(raw: bytes, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    # python-docx
+    try:
+        import docx
+        doc = docx.Document(io.BytesIO(raw))
+        out = _Budget(max_chars)
+        # paragraphs
+        for p in doc.paragraphs:
+            t = (p.text or "").strip()
+            if t and not out.add(t):
+                return out.text()
+        # tables (cells)
+        for tbl in getattr(doc, "tables", []):
+            for row in tbl.rows:
+                for cell in row.cells:
+                    t = (cell.text or "").strip()
+                    if t and not out.add(t):
+                        return out.text()
+        return out.text()
+    except Exception as e:
+        log.warning("DOCX extract failed: %s", e)
+        return ""
+
+
+def _extract_text_from_xlsx_bytes(raw: bytes, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    try:
+        import openpyxl  # .xlsx
+    except ImportError:
+        log.warning("openpyxl non disponibile: skip xlsx")
+        return ""
+    try:
+        # read_only: celle lette in streaming dal file, niente modello completo in memoria
+        wb = openpyxl.load_workbook(io.BytesIO(raw), data_only=True, read_only=True)
+        out = _Budget(max_chars)
+        try:
+            for ws in wb.worksheets:
+                if not out.add(f"# Sheet: {ws.title}"):
+                    break
+                for row in ws.iter_rows(values_only=True):
+                    line = "\t".join(str(c) if c is not None else "" for c in row).strip()
+                    if line and not out.add(line):
+                        break
+                if out.left <= 0:
+                    break
+        finally:
+            wb.close()
+        return out.text()
+    except Exception as e:
+        log.warning("XLSX extract failed: %s", e)
+        return ""
+
+
+def _extract_text_from_xls_bytes(raw: bytes, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    # Richiede xlrd>=2.0 (legge solo .xls)
+    try:
+        import xlrd  # .xls (legacy)
+    except ImportError:
+        log.warning("xlrd non disponibile: skip xls")
+        return ""
+    try:
+        # on_demand: un foglio alla volta, scaricato dopo la lettura
+        book = xlrd.open_workbook(file_contents=raw, on_demand=True)
+        out = _Budget(max_chars)
+        try:
+            for si in range(book.nsheets):
+                sh = book.sheet_by_index(si)
+                if not out.add(f"# Sheet: {sh.name}"):
+                    break
+                for r in range(sh.nrows):
+                    line = "\t".join(str(v) for v in sh.row_values(r)).strip()
+                    if line and not out.add(line):
+                        break
+                book.unload_sheet(si)
+                if out.left <= 0:
+                    break
+        finally:
+            book.release_resources()
+        return out.text()
+    except Exception as e:
+        log.warning("XLS extract failed: %s", e)
+        return ""
+
+
+def _extract_text_from_xlsb_bytes(raw: bytes, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    try:
+        from pyxlsb import open_workbook as open_xlsb  # .xlsb
+    except ImportError:
+        log.warning("pyxlsb non disponibile: skip xlsb")
+        return ""
+    try:
+        out = _Budget(max_chars)
+        with open_xlsb(io.BytesIO(raw)) as wb:
+            for sheet_name in wb.sheets:
+                if not out.add(f"# Sheet: {sheet_name}"):
+                    break
+                with wb.get_sheet(sheet_name) as sh:
+                    for row in sh.rows():
+                        line = "\t".join(str(c.v) if c.v is not None else "" for c in row).strip()
+                        if line and not out.add(line):
+                            break
+                if out.left <= 0:
+                    break
+        return out.text()
+    except Exception as e:
+        log.warning("XLSB extract failed: %s", e)
+        return ""
+
+
+def _extract_text_from_pptx_bytes(raw: bytes, max_chars: int = EXTRACT_MAX_CHARS) -> str:
+    try:
+        from pptx import Presentation  # .pptx
+    except ImportError:
+        log.warning("python-pptx non disponibile: skip pptx")
+        return ""
+    try:
+        prs = Presentation(io.BytesIO(raw))
+        out = _Budget(max_chars)
+        for i, slide in enumerate(prs.slides, start=1):
+            if not out.add(f"# Slide {i}"):
+                break
+            for shape in slide.shapes:
+                if hasattr(shape, "text_frame") and shape.text_frame:
+                    for para in shape.text_frame.paragraphs:
+                        text = "".join(run.text or "" for run in para.runs).strip()
+                        if text:
+                            out.add(text)
+                elif hasattr(shape, "text") and shape.text:
+                    t = (shape.text or "").strip()
+                    if t:
+                        out.add(t)
+        return out.text()
+    except Exception as e:
+        log.warning("PPTX extract failed: %s", e)
+        return ""
+
+
+EXTRACTORS: Dict[str, Callable[[bytes, int], str]] = {
+    ".pdf": _extract_text_from_pdf_bytes,
+    ".docx": _extract_text_from_docx_bytes,
+    ".xlsx": _extract_text_from_xlsx_bytes,
+    ".xls": _extract_text_from_xls_bytes,
+    ".xlsb": _extract_text_from_xlsb_bytes,
+    ".pptx": _extract_text_from_pptx_bytes,
+}
+
+
+def _ext_from_path(p: Optional[str]) -> str:
+    try:
+        return os.path.splitext((p or "").strip())[1].lower()
+    except Exception:
+        return ""
+
+
+def _worker_init(mem_mb: int) -> None:
+    # tetto di address space per worker: oltre → MemoryError / worker terminato, non il servizio
+    if mem_mb <= 0:
+        return
+    try:
+        import resource
+        lim = mem_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (lim, lim))
+    except Exception:
+        pass
+
+
+def _run(ext: str, raw: bytes, max_chars: int) -> str:
+    try:
+        return EXTRACTORS[ext](raw, max_chars)
+    except MemoryError:
+        log.warning("extract %s: memory cap reached", ext)
+        return ""
+
+
+class ExtractionService:
+    def __init__(self, *, workers: int = EXTRACT_WORKERS, timeout_s: float = EXTRACT_TIMEOUT_S,
+                 mem_mb: int = EXTRACT_MEM_MB, max_mb: int = EXTRACT_MAX_MB,
+                 max_chars: int = EXTRACT_MAX_CHARS, max_pending: int = EXTRACT_MAX_PENDING,
+                 retries: int = EXTRACT_RETRIES):
+        self.workers = max(0, int(workers))
+        self.timeout_s = max(1.0, float(timeout_s))
+        self.mem_mb = int(mem_mb)
+        self.max_bytes = max(1, int(max_mb)) * 1024 * 1024
+        self.max_chars = max(1, int(max_chars))
+        self.max_pending = max(1, int(max_pending))
+        self.retries = max(0, int(retries))
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._sem: Optional[asyncio.Semaphore] = None
+        self._retry_lock: Optional[asyncio.Lock] = None
+        self.done = 0
+        self.timeouts = 0
+        self.failures = 0
+        self.skipped = 0
+        self.resets = 0
+        self.retried = 0
+        self.lost = 0
+        self.busy_s = 0.0
+        self.waiting = 0    # in attesa di uno slot (EXTRACT_MAX_PENDING)
+        self.in_flight = 0  # inviate al pool / thread
+
+    def _executor(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            kw: Dict[str, Any] = {}
+            if EXTRACT_START_METHOD != "fork" and EXTRACT_TASKS_PER_CHILD > 0:
+                kw["max_tasks_per_child"] = EXTRACT_TASKS_PER_CHILD  # ricicla i worker (frammentazione)
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context(EXTRACT_START_METHOD),
+                initializer=_worker_init,
+                initargs=(self.mem_mb,),
+                **kw,
+            )
+        return self._pool
+
+    def _reset(self, reason: str, executor: ProcessPoolExecutor) -> bool:
+        # un worker bloccato non si può interrompere singolarmente: si butta il pool intero,
+        # ma solo se è ancora quello corrente (altrimenti è già stato sostituito da un altro reset)
+        if executor is None or self._pool is not executor:
+            return False
+        self._pool = None
+        self.resets += 1
+        procs = list((getattr(executor, "_processes", None) or {}).values())
+        executor.shutdown(wait=False, cancel_futures=True)
+        for p in procs:
+            try:
+                p.kill()
+            except Exception:
+                pass
+        log.warning("extraction pool reset: %s", reason)
+        return True
+
+    async def _attempt(self, path: Optional[str], ext: str, raw: bytes) -> str:
+        if self.workers == 0:
+            return await asyncio.wait_for(asyncio.to_thread(_run, ext, raw, self.max_chars), self.timeout_s)
+        executor = self._executor()
+        cfut = None
+        try:
+            cfut = executor.submit(_run, ext, raw, self.max_chars)
+            return await asyncio.wait_for(asyncio.wrap_future(cfut), self.timeout_s)
+        except asyncio.TimeoutError:
+            self._reset(f"timeout on {path}", executor)
+            raise
+        except BrokenProcessPool as e:
+            # il worker morto può essere di un'altra estrazione: non sappiamo chi, si riprova
+            self._reset(f"worker died on {path}: {e}", executor)
+            raise _PoolLost(f"worker died: {e}") from e
+        except RuntimeError as e:
+            if self._pool is executor:
+                raise
+            raise _PoolLost(f"pool shut down: {e}") from e  # submit su un pool appena resettato
+        except asyncio.CancelledError:
+            # future cancellata da shutdown(cancel_futures=True) di un reset, non dal chiamante
+            task = asyncio.current_task()
+            if cfut is not None and cfut.cancelled() and not (task and task.cancelling()):
+                raise _PoolLost("cancelled by pool reset") from None
+            raise
+
+    async def _attempts(self, path: Optional[str], ext: str, raw: bytes, sp: tracing.Span) -> str:
+        try:
+            return await self._attempt(path, ext, raw)
+        except _PoolLost as e:
+            if not self.retries:
+                raise
+            log.warning("extract %s lost to pool reset (%s): retrying on a fresh pool", path, e)
+        # retry uno alla volta: se il colpevole è tra i rilanciati, abbatte solo sé stesso
+        if self._retry_lock is None:
+            self._retry_lock = asyncio.Lock()
+        async with self._retry_lock:
+            for attempt in range(1, self.retries + 1):
+                self.retried += 1
+                sp.set(retries=attempt)
+                try:
+                    return await self._attempt(path, ext, raw)
+                except _PoolLost:
+                    if attempt >= self.retries:
+                        raise
+
+    async def extract(self, path: Optional[str], raw: bytes) -> str:
+        """Testo estratto da 'raw' in base all'estensione di 'path'; "" se fallisce o scade."""
+        ext = _ext_from_path(path)
+        if ext not in EXTRACTORS:
+            # fallback: se è testo “grezzo” o sconosciuto, prova a decodare come utf-8
+            try:
+                return raw.decode("utf-8", errors="ignore")
+            except Exception:
+                return ""
+        if len(raw) > self.max_bytes:
+            self.skipped += 1
+            log.warning("extract %s skipped: %d bytes > EXTRACT_MAX_MB", path, len(raw))
+            return ""
+        with tracing.span("extraction", ext=ext, bytes=len(raw)) as sp:
+            txt = await self._extract_bounded(path, ext, raw, sp)
+            sp.set(chars=len(txt))
+        return txt
+
+    async def _extract_bounded(self, path: Optional[str], ext: str, raw: bytes, sp: tracing.Span) -> str:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.max_pending)
+        self.waiting += 1
+        tw = time.monotonic()
+        try:
+            await self._sem.acquire()
+        finally:
+            self.waiting -= 1
+        sp.set(wait_ms=round((time.monotonic() - tw) * 1000, 1))
+        self.in_flight += 1
+        try:
+            t0 = time.monotonic()
+            try:
+                txt = await self._attempts(path, ext, raw, sp)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                log.warning("extract %s timed out after %.1fs (%d bytes)", path, self.timeout_s, len(raw))
+                sp.fail("timeout")
+                return ""
+            except _PoolLost as e:
+                self.failures += 1
+                self.lost += 1
+                log.warning("extract %s failed: lost to pool reset after %d retries (%s)",
+                            path, self.retries, e)
+                sp.fail(e)
+                return ""
+            except Exception as e:
+                self.failures += 1
+                log.warning("extract %s failed: %s", path, e)
+                sp.fail(e)
+                return ""
+            finally:
+                self.busy_s += time.monotonic() - t0
+        finally:
+            self.in_flight -= 1
+            self._sem.release()
+        self.done += 1
+        log.info("extract %s (%s, %d bytes) -> %d chars in %.2fs",
+                 path, ext, len(raw), len(txt), time.monotonic() - t0)
+        return txt
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "workers": self.workers,
+            "waiting": self.waiting,
+            "in_flight": self.in_flight,
+            "timeout_s": self.timeout_s,
+            "mem_mb": self.mem_mb,
+            "done": self.done,
+            "timeouts": self.timeouts,
+            "failures": self.failures,
+            "skipped": self.skipped,
+            "pool_resets": self.resets,
+            "retried": self.retried,
+            "lost_to_reset": self.lost,
+            "busy_s": round(self.busy_s, 3),
+        }
+
+    def shutdown(self) -> None:
+        pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False, cancel_futures=True)
+
+
+_SERVICE: Optional[ExtractionService] = None
+
+
+def service() -> ExtractionService:
+    global _SERVICE
+    if _SERVICE is None:
+        _SERVICE = ExtractionService()
+    return _SERVICE
+
+
+async def extract_text(path: Optional[str], raw: bytes) -> str:
+    return await service().extract(path, raw)
+
+
+def shutdown() -> None:
+    if _SERVICE is not None:
+        _SERVICE.shutdown()
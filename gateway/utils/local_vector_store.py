@@ -0,0 +1,283 @@
+# Backend RAG locale in-process (RAG_BACKEND=local): stessa interfaccia di RagStore
+# (ensure/index_texts/search/purge) senza Qdrant.
+# Per namespace: vectors.npy (float32 [n, dim], righe normalizzate, letto in memmap) + rows.json
+# (id e payload allineati alle righe). Scritture atomiche (tmp + os.replace) sotto flock, così
+# gateway e orchestrator possono condividere la directory. Top-k coseno vettorizzato con numpy;
+# HNSW (hnswlib) opzionale sopra RAG_LOCAL_HNSW_MIN righe.
+# Se gli embeddings non sono disponibili (fallback hash) la ricerca è lessicale sui testi nel payload
+# invece che su vettori casuali.
+
+from __future__ import annotations
+import os, re, json, math, fcntl, asyncio, logging, threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from utils.rag_store import RagStore, TOP_K, _load_manifest, _save_manifest, _manifest_key, _norm_path
+from utils import tracing
+
+try:
+    import hnswlib  # type: ignore
+except Exception:
+    hnswlib = None
+
+log = logging.getLogger("rag.local_store")
+
+LOCAL_DIR = os.getenv("RAG_LOCAL_DIR", "/workspace/.cache/rag_local")
+HNSW_ENABLED = os.getenv("RAG_LOCAL_HNSW", "1").strip() not in ("0", "false", "False", "no")
+HNSW_MIN_ROWS = int(os.getenv("RAG_LOCAL_HNSW_MIN", "20000"))
+
+_WORD_RE = re.compile(r"\w{2,}", re.UNICODE)
+
+
+class _Index:
+    """Snapshot immutabile di un namespace caricato dal disco."""
+
+    def __init__(self, version: Any, ids: List[str], payloads: List[Dict[str, Any]], mat: np.ndarray):
+        self.version = version
+        self.ids = ids
+        self.payloads = payloads
+        self.mat = mat                                   # memmap [n, dim] (o array vuoto)
+        self.valid = np.any(mat != 0, axis=1) if len(ids) else np.zeros(0, dtype=bool)
+        self.hnsw = None
+        self._hnsw_lock = threading.Lock()
+
+    @property
+    def dim(self) -> int:
+        return int(self.mat.shape[1]) if self.mat.ndim == 2 and self.mat.shape[0] else 0
+
+    def hnsw_index(self):
+        # costruito al primo uso e riusato finché il file non cambia
+        if hnswlib is None or not HNSW_ENABLED or len(self.ids) < HNSW_MIN_ROWS:
+            return None
+        with self._hnsw_lock:
+            if self.hnsw is None:
+                rows = np.nonzero(self.valid)[0]
+                idx = hnswlib.Index(space="cosine", dim=self.dim)
+                idx.init_index(max_elements=max(1, len(rows)), ef_construction=200, M=16)
+                idx.add_items(np.asarray(self.mat[rows]), rows)
+                idx.set_ef(max(64, TOP_K * 4))
+                self.hnsw = idx
+        return self.hnsw
+
+
+_INDEXES: Dict[str, _Index] = {}
+_INDEXES_LOCK = threading.Lock()
+
+
+class LocalVectorStore(RagStore):
+    """RagStore su file locali; manifest, ID deterministici e chunking restano quelli di RagStore."""
+
+    def __init__(self, project_id: str):
+        super().__init__(project_id)
+        self.dir = os.path.join(LOCAL_DIR, self.namespace)
+        self.manifest_key = _manifest_key("local", LOCAL_DIR, self.namespace)
+        self._vec_path = os.path.join(self.dir, "vectors.npy")
+        self._rows_path = os.path.join(self.dir, "rows.json")
+
+    # ----------------------------- storage ------------------------------------
+
+    @contextmanager
+    def _flock(self, shared: bool = False):
+        # lock tra processi (gateway/orchestrator): esclusivo per scrivere, condiviso per leggere
+        os.makedirs(self.dir, exist_ok=True)
+        with open(os.path.join(self.dir, ".lock"), "a+") as fh:
+            fcntl.flock(fh, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh, fcntl.LOCK_UN)
+
+    def _version(self) -> Any:
+        try:
+            return (os.stat(self._rows_path).st_mtime_ns, os.stat(self._vec_path).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+
+    def _cached(self) -> Optional[_Index]:
+        version = self._version()
+        with _INDEXES_LOCK:
+            cur = _INDEXES.get(self.dir)
+        return cur if cur is not None and cur.version == version else None
+
+    def _read_locked(self) -> _Index:
+        # chiamare con il flock acquisito
+        cur = self._cached()
+        if cur is not None:
+            return cur
+        version = self._version()
+        if version is None:
+            idx = _Index(None, [], [], np.zeros((0, 0), dtype=np.float32))
+        else:
+            with open(self._rows_path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+            idx = _Index(version, rows["ids"], rows["payloads"], np.load(self._vec_path, mmap_mode="r"))
+        with _INDEXES_LOCK:
+            _INDEXES[self.dir] = idx
+        return idx
+
+    def _load(self) -> _Index:
+        cur = self._cached()
+        if cur is not None:
+            return cur
+        with self._flock(shared=True):
+            return self._read_locked()
+
+    def _save(self, ids: List[str], payloads: List[Dict[str, Any]], mat: np.ndarray) -> None:
+        tmp_vec = self._vec_path + ".tmp.npy"
+        tmp_rows = self._rows_path + ".tmp"
+        np.save(tmp_vec, np.ascontiguousarray(mat, dtype=np.float32))
+        with open(tmp_rows, "w", encoding="utf-8") as f:
+            json.dump({"ids": ids, "payloads": payloads}, f, ensure_ascii=False)
+        os.replace(tmp_vec, self._vec_path)
+        os.replace(tmp_rows, self._rows_path)
+
+    @staticmethod
+    def _normalize(vecs: List[List[float]]) -> np.ndarray:
+        m = np.asarray(vecs, dtype=np.float32)
+        if m.ndim != 2:
+            m = m.reshape(len(vecs), -1)
+        norms = np.linalg.norm(m, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return m / norms
+
+    def _apply_sync(self, points: List[Dict[str, Any]], delete_ids: List[str],
+                    delete_paths: List[str], degraded: bool) -> None:
+        with self._flock():
+            idx = self._read_locked()
+            drop = set(delete_ids) | {pt["id"] for pt in points}
+            paths = set(delete_paths)
+            keep = [i for i, (pid, pl) in enumerate(zip(idx.ids, idx.payloads))
+                    if pid not in drop and pl.get("path") not in paths]
+            if not points and len(keep) == len(idx.ids):
+                return
+            ids = [idx.ids[i] for i in keep]
+            payloads = [idx.payloads[i] for i in keep]
+            old = np.asarray(idx.mat[keep]) if keep else None
+            if points:
+                new = self._normalize([pt["vector"] for pt in points])
+                if degraded:
+                    # vettori hash: righe a zero, trovate solo dalla ricerca lessicale
+                    new[:] = 0.0
+                if old is not None and old.shape[1] != new.shape[1]:
+                    raise ValueError(f"embedding dim mismatch: store={old.shape[1]} new={new.shape[1]} (purge the store)")
+                mat = np.vstack([old, new]) if old is not None else new
+                ids += [pt["id"] for pt in points]
+                payloads += [pt.get("payload") or {} for pt in points]
+            else:
+                mat = old if old is not None else np.zeros((0, max(idx.dim, 1)), dtype=np.float32)
+            self._save(ids, payloads, mat)
+
+    # ----------------------------- interfaccia RagStore -----------------------
+
+    async def ensure(self, *, verify: bool = False) -> bool:
+        # True se il namespace non esiste ancora (il manifest va ignorato); sempre verificato su disco
+        if self._version() is not None:
+            return False
+        os.makedirs(self.dir, exist_ok=True)
+        log.info("RAG local store created %s", self.dir)
+        return True
+
+    async def _write_points(self, points: List[Dict[str, Any]], *, delete_ids: List[str],
+                            delete_paths: List[str]) -> None:
+        # vettori hash: righe a zero (i path restano fuori dal manifest, vedi RagStore.index_texts)
+        degraded = bool(points) and self.emb.degraded
+        await asyncio.to_thread(self._apply_sync, points, delete_ids, delete_paths, degraded)
+
+    async def search(self, query: str, top_k: int = TOP_K) -> List[Dict[str, Any]]:
+        return (await self.search_many([query], top_k=top_k))[0]
+
+    async def search_many(self, queries: List[str], top_k: int = TOP_K) -> List[List[Dict[str, Any]]]:
+        # indice caricato una volta e un solo embed per tutte le query
+        if not queries:
+            return []
+        try:
+            idx = await asyncio.to_thread(self._load)
+            if not idx.ids:
+                return [[] for _ in queries]
+            with tracing.span("rag.embed", queries=len(queries)) as sp:
+                vecs = await self.emb.embed(list(queries))
+                sp.set(degraded=self.emb.degraded)
+            lexical = self.emb.degraded or not idx.valid.any() or any(len(v) != idx.dim for v in vecs)
+            with tracing.span("rag.local_search", queries=len(queries), top_k=top_k, rows=len(idx.ids),
+                              mode="lexical" if lexical else "vector"):
+                if lexical:
+                    per_query = await asyncio.to_thread(
+                        lambda: [self._lexical_top_k(idx, q, top_k) for q in queries])
+                else:
+                    per_query = await asyncio.to_thread(
+                        lambda: [self._vector_top_k(idx, v, top_k) for v in vecs])
+        except Exception as e:
+            log.error("RAG local search failed: %s", e)
+            return [[] for _ in queries]
+        out = []
+        for hits in per_query:
+            rows = []
+            for row, score in hits:
+                pl = idx.payloads[row] or {}
+                rows.append({
+                    "path": pl.get("path", ""),
+                    "chunk": pl.get("chunk", 0),
+                    "score": float(score),
+                    "text": pl.get("text", ""),
+                })
+            out.append(rows)
+        return out
+
+    def _vector_top_k(self, idx: _Index, vec: List[float], top_k: int) -> List[tuple]:
+        q = self._normalize([vec])[0]
+        k = min(int(top_k), int(idx.valid.sum()))
+        if k <= 0:
+            return []
+        hnsw = idx.hnsw_index()
+        if hnsw is not None:
+            labels, dists = hnsw.knn_query(q, k=k)
+            return [(int(r), 1.0 - float(d)) for r, d in zip(labels[0], dists[0])]
+        scores = np.asarray(idx.mat) @ q
+        scores[~idx.valid] = -np.inf
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(r), float(scores[r])) for r in top]
+
+    @staticmethod
+    def _lexical_top_k(idx: _Index, query: str, top_k: int) -> List[tuple]:
+        # BM25-lite sui testi del payload: meglio di un coseno su vettori hash
+        terms = set(_WORD_RE.findall((query or "").lower()))
+        if not terms:
+            # query vuota (rag_fetch usa search("")): righe in ordine di inserimento
+            return [(row, 0.0) for row in range(min(int(top_k), len(idx.ids)))]
+        docs = [Counter(_WORD_RE.findall(((pl or {}).get("text") or "").lower())) for pl in idx.payloads]
+        n = len(docs)
+        df = {t: sum(1 for d in docs if t in d) for t in terms}
+        scored = []
+        for row, d in enumerate(docs):
+            s = sum(math.log(1 + d[t]) * math.log(1 + n / df[t]) for t in terms if d.get(t))
+            if s > 0:
+                scored.append((row, s))
+        scored.sort(key=lambda x: -x[1])
+        return scored[:int(top_k)]
+
+    async def purge(self, path_prefix: Optional[str] = None) -> Dict[str, Any]:
+        try:
+            if path_prefix:
+                await asyncio.to_thread(self._apply_sync, [], [], [_norm_path(path_prefix)], False)
+            else:
+                def _clear():
+                    with self._flock():
+                        for p in (self._vec_path, self._rows_path):
+                            if os.path.exists(p):
+                                os.remove(p)
+                await asyncio.to_thread(_clear)
+            # allinea il manifest: i path rimossi vanno re-indicizzati al prossimo giro
+            manifest = _load_manifest(self.manifest_key)
+            if path_prefix:
+                manifest.pop(_norm_path(path_prefix), None)
+            else:
+                manifest = {}
+            _save_manifest(self.manifest_key, manifest)
+            return {"ok": True}
+        except Exception as e:
+            log.error("RAG local purge failed: %s", e)
+            return {"ok": False, "error": str(e)}
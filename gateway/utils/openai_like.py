@@ -1,3 +1,7 @@
+import json
+from typing import Any, Dict, Optional
+
+
 def format_chat_response(model_name: str, content: str):
     return {
         "id": "chatcmpl-1",
@@ -8,9 +12,37 @@ def format_chat_response(model_name: str, content: str):
         "model": model_name,
     }
 
-def format_embeddings_response(model_name: str, vector):
+def format_embeddings_response(model_name: str, vectors):
+    # accetta un singolo vettore (compat) o una lista di vettori (batch, ordine = input)
+    if vectors and not isinstance(vectors[0], list):
+        vectors = [vectors]
     return {
         "object": "list",
-        "data": [{"object": "embedding", "embedding": vector, "index": 0}],
+        "data": [{"object": "embedding", "embedding": v, "index": i} for i, v in enumerate(vectors or [])],
+        "model": model_name,
+    }
+
+def format_chat_chunk(chunk_id: str, model_name: str, created: int,
+                      delta: Optional[Dict[str, Any]] = None, finish_reason: Optional[str] = None):
+    return {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": created,
         "model": model_name,
+        "choices": [{"index": 0, "delta": delta or {}, "finish_reason": finish_reason}],
     }
+
+def format_usage_chunk(chunk_id: str, model_name: str, created: int, usage: Dict[str, Any]):
+    # come OpenAI con stream_options.include_usage: choices vuoto, solo usage
+    return {
+        "id": chunk_id,
+        "object": "chat.completion.chunk",
+        "created": created,
+        "model": model_name,
+        "choices": [],
+        "usage": usage or {},
+    }
+
+def sse_event(obj: Any) -> str:
+    data = obj if isinstance(obj, str) else json.dumps(obj, ensure_ascii=False)
+    return f"data: {data}\n\n"
@@ -0,0 +1,77 @@
+# Prompt caching lato provider (non la response cache di utils/response_cache).
+#
+# I composer Harper mettono in testa al messaggio user il contenuto stabile (principi, IDEA,
+# core blobs, checklist) e ne segnano la lunghezza in msg[PREFIX_KEY]. Prima della chiamata:
+#   anthropic  system e prefisso user diventano blocchi text con cache_control ephemeral
+#              (breakpoint: tutto ciò che precede viene letto dalla cache ai run successivi)
+#   openai     prefix caching automatico (≥1024 token): basta il prefisso stabile + prompt_cache_key
+#              per instradare i run dello stesso progetto/fase sulla stessa cache
+#   altri      il marcatore viene solo rimosso
+# Sotto PROMPT_CACHE_MIN_CHARS (~1024 token, minimo cacheabile) non si inseriscono breakpoint.
+
+from __future__ import annotations
+import os
+from typing import Any, Dict, List, Optional
+
+PROMPT_CACHE      = os.getenv("PROMPT_CACHE", "1").strip() not in ("0", "false", "False", "no")
+PROMPT_CACHE_MIN_CHARS = int(os.getenv("PROMPT_CACHE_MIN_CHARS", "4096"))
+
+PREFIX_KEY = "cache_prefix_chars"
+EPHEMERAL = {"type": "ephemeral"}
+
+
+def _text_len(content: Any) -> int:
+    if isinstance(content, str):
+        return len(content)
+    if isinstance(content, list):
+        return sum(len(b.get("text") or "") for b in content if isinstance(b, dict))
+    return 0
+
+
+def system_blocks(system: str) -> Any:
+    """System Anthropic con breakpoint se abbastanza lungo, altrimenti la stringa com'è."""
+    if not PROMPT_CACHE or len(system or "") < PROMPT_CACHE_MIN_CHARS:
+        return system
+    return [{"type": "text", "text": system, "cache_control": dict(EPHEMERAL)}]
+
+
+def prepare_messages(messages: List[Dict[str, Any]], provider: str) -> List[Dict[str, Any]]:
+    """Copia dei messaggi pronta per il provider: breakpoint Anthropic sul prefisso, marcatori rimossi."""
+    anthropic = PROMPT_CACHE and (provider or "").lower() == "anthropic"
+    out: List[Dict[str, Any]] = []
+    seen = 0  # caratteri cumulati: il breakpoint copre tutto il prefisso precedente
+    breakpoints = 0
+    for m in messages or []:
+        mm = {k: v for k, v in m.items() if k != PREFIX_KEY}
+        n = m.get(PREFIX_KEY)
+        content = mm.get("content")
+        if (anthropic and isinstance(n, int) and isinstance(content, str) and 0 < n <= len(content)
+                and seen + n >= PROMPT_CACHE_MIN_CHARS and breakpoints < 3):
+            blocks = [{"type": "text", "text": content[:n], "cache_control": dict(EPHEMERAL)}]
+            if content[n:].strip():
+                blocks.append({"type": "text", "text": content[n:]})
+            mm["content"] = blocks
+            breakpoints += 1
+        seen += _text_len(content)
+        out.append(mm)
+    return out
+
+
+def openai_cache_key(project_id: Optional[str], phase: Optional[str], prompt_sha: Optional[str] = None) -> Optional[str]:
+    # prompt_sha (prompt_registry): un system prompt modificato non riusa la cache del precedente
+    if not PROMPT_CACHE:
+        return None
+    key = f"harper:{project_id or 'default'}:{(phase or '').lower()}"
+    return f"{key}:{prompt_sha[:12]}" if prompt_sha else key
+
+
+def cache_usage(usage: Dict[str, Any]) -> Dict[str, int]:
+    """Token letti/scritti dalla cache del provider (Anthropic o OpenAI chat/responses)."""
+    u = usage or {}
+    details = u.get("prompt_tokens_details") or u.get("input_tokens_details") or {}
+    read = u.get("cache_read_input_tokens") or details.get("cached_tokens") or 0
+    created = u.get("cache_creation_input_tokens") or 0
+    try:
+        return {"read_tokens": int(read), "creation_tokens": int(created)}
+    except (TypeError, ValueError):
+        return {"read_tokens": 0, "creation_tokens": 0}
@@ -2,11 +2,14 @@
 # Riusa models.yaml per scegliere il modello embeddings preferito
 
 from __future__ import annotations
-import os, re, json, time, hashlib, logging
+import os, re, json, uuid, hashlib, logging
 from typing import List, Dict, Any, Optional, Tuple
 import httpx
 
 from utils.utils import _rag_base_url
+from utils.embedding_cache import get_cache, text_key
+from utils.chunker import chunk_text
+from utils import tracing
 
 log = logging.getLogger("rag.store")
 
@@ -18,6 +21,53 @@ CHUNK_TOKENS   = int(os.getenv("RAG_CHUNK_TOKENS", "800"))
 CHUNK_OVERLAP  = int(os.getenv("RAG_CHUNK_OVERLAP", "80"))
 TOP_K          = int(os.getenv("RAG_TOP_K", "6"))
 MAX_CTX_TOKENS = int(os.getenv("RAG_MAX_CTX_TOKENS", "1800"))
+EMB_BATCH      = int(os.getenv("RAG_EMBED_BATCH", "256"))      # input per richiesta /v1/embeddings
+EMB_TIMEOUT    = float(os.getenv("RAG_EMBED_TIMEOUT", "120"))
+
+MANIFEST_DIR   = os.getenv("RAG_MANIFEST_DIR", "/workspace/.cache/rag_manifests")
+UPSERT_BATCH   = int(os.getenv("RAG_UPSERT_BATCH", "256"))
+
+# (qdrant url, collection) di cui è già nota l'esistenza (evita il GET di ensure() a ogni search);
+# una 404 da Qdrant scarta la voce
+_KNOWN_COLLECTIONS: set = set()
+
+# ID deterministici dei punti: stesso path + stesso chunk → stesso punto (upsert idempotente)
+_POINT_NS = uuid.UUID("5b0d7c36-2f4e-4c51-9a55-6f1c3c7e2a10")
+
+def _point_id(path: str, chunk_sha: str, occurrence: int = 0) -> str:
+    return str(uuid.uuid5(_POINT_NS, f"{path}\x00{chunk_sha}\x00{occurrence}"))
+
+# Manifest per store: {path: {"sha": sha file, "points": {point_id: chunk_idx}}}
+# chiave = backend + destinazione (qdrant url + collection / dir locale): backend diversi
+# sullo stesso progetto non condividono il manifest
+def _manifest_key(backend: str, location: str, collection: str) -> str:
+    loc = hashlib.sha1(location.encode("utf-8")).hexdigest()[:8]
+    return f"{backend}_{loc}__{collection}"
+
+def _manifest_path(key: str) -> str:
+    return os.path.join(MANIFEST_DIR, f"{key}.json")
+
+def _load_manifest(key: str) -> Dict[str, Any]:
+    try:
+        with open(_manifest_path(key), "r", encoding="utf-8") as f:
+            data = json.load(f)
+            return data if isinstance(data, dict) else {}
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        log.warning("RAG manifest unreadable (%s): %s", key, e)
+        return {}
+
+def _save_manifest(key: str, manifest: Dict[str, Any]) -> None:
+    try:
+        os.makedirs(MANIFEST_DIR, exist_ok=True)
+        path = _manifest_path(key)
+        tmp = f"{path}.tmp.{os.getpid()}"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False)
+        os.replace(tmp, path)
+    except Exception as e:
+        log.warning("RAG manifest save failed (%s): %s", namespace, e)
 
 # Alcune estensioni testuali
 TEXT_EXTS = {".md",".txt",".rst",".adoc",".py",".js",".ts",".tsx",".jsx",".java",".go",".rs",".cpp",".c",".h",".sql",".yml",".yaml",".json",".toml",".ini",".proto",".sh",".ps1",".rb",".php",".cs",".kt"}
@@ -28,20 +78,9 @@ def _norm_path(p: str) -> str:
 def _sha1(s: str) -> str:
     return hashlib.sha1(s.encode("utf-8", "ignore")).hexdigest()
 
-def _split_chunks(text: str, tokens:int=CHUNK_TOKENS, overlap:int=CHUNK_OVERLAP) -> List[str]:
-    # Grezzo: spezza per paragrafi/righe con overlap su caratteri
-    if not text: return []
-    unit = max(500, tokens*4)  # approx char per token
-    step = max(256, overlap*4)
-    out = []
-    i = 0
-    n = len(text)
-    while i < n:
-        j = min(n, i+unit)
-        out.append(text[i:j])
-        if j == n: break
-        i = max(i + unit - step, i+1)
-    return out
+def _split_chunks(text: str, tokens:int=CHUNK_TOKENS, overlap:int=CHUNK_OVERLAP, path: str = "") -> List[str]:
+    # Chunk structure-aware (simboli / heading / paragrafi) dimensionati in token: vedi chunker.py
+    return chunk_text(text, path=path, tokens=tokens, overlap=overlap)
 
 class EmbeddingClient:
     """
@@ -52,34 +91,91 @@ class EmbeddingClient:
     def __init__(self, gateway_base: str = "http://gateway:8000/v1"):
         self.base = gateway_base.rstrip("/")
         self.openai_key = os.getenv("OPENAI_API_KEY")
-    
+        # modello esplicito (stessa catena di default del gateway) → chiave di cache stabile
+        self.model = os.getenv("RAG_EMBED_MODEL") or os.getenv("OLLAMA_EMBED_MODEL") or "ollama:nomic-embed-text"
+        self.cache = get_cache()
+        self.degraded = False
+
+    async def _cached(self, model_key: str, texts: List[str], fetch) -> Optional[List[List[float]]]:
+        """
+        Serve dalla cache i testi già visti (model_key + sha del testo normalizzato)
+        e chiama 'fetch' solo per i mancanti (deduplicati). None se fetch fallisce.
+        """
+        if self.cache is None:
+            return await fetch(texts)
+        keys = [text_key(t) for t in texts]
+        try:
+            found = await self.cache.get_many(model_key, keys)
+        except Exception as e:
+            log.warning("embed cache read failed: %s", e)
+            return await fetch(texts)
+        todo: Dict[str, str] = {}
+        for k, t in zip(keys, texts):
+            if k not in found:
+                todo.setdefault(k, t)
+        if todo:
+            vecs = await fetch(list(todo.values()))
+            if not vecs:
+                return None
+            fresh = dict(zip(todo.keys(), vecs))
+            try:
+                await self.cache.put_many(model_key, fresh)
+            except Exception as e:
+                log.warning("embed cache write failed: %s", e)
+            found.update(fresh)
+        return [found[k] for k in keys]
+
+    async def _embed_via_gateway(self, texts: List[str]) -> Optional[List[List[float]]]:
+        # Il gateway accetta batch reali (un vettore per input, in ordine) e li ri-spezza
+        # per provider; qui limitiamo solo la dimensione del body per richiesta.
+        out: List[List[float]] = []
+        async with httpx.AsyncClient(timeout=EMB_TIMEOUT) as client:
+            for i in range(0, len(texts), EMB_BATCH):
+                part = texts[i:i + EMB_BATCH]
+                r = await client.post(f"{self.base}/embeddings", json={"model": self.model, "input": part},
+                                      headers=tracing.inject())
+                if not r.is_success:
+                    log.warning("gateway embeddings HTTP %s: %s", r.status_code, r.text[:300])
+                    return None
+                data = sorted(r.json().get("data") or [], key=lambda d: d.get("index", 0))
+                vecs = [d["embedding"] for d in data if "embedding" in d]
+                if len(vecs) != len(part):
+                    log.warning("gateway embeddings: expected %d vectors, got %d", len(part), len(vecs))
+                    return None
+                out.extend(vecs)
+        return out
+
+    async def _embed_via_openai(self, texts: List[str]) -> Optional[List[List[float]]]:
+        headers = {"Authorization": f"Bearer {self.openai_key}"}
+        out: List[List[float]] = []
+        async with httpx.AsyncClient(timeout=EMB_TIMEOUT) as client:
+            for i in range(0, len(texts), EMB_BATCH):
+                r = await client.post("https://api.openai.com/v1/embeddings",
+                    headers=headers,
+                    json={"model":"text-embedding-3-small","input":texts[i:i + EMB_BATCH]})
+                r.raise_for_status()
+                data = sorted(r.json().get("data") or [], key=lambda d: d.get("index", 0))
+                out.extend(d["embedding"] for d in data)
+        return out if len(out) == len(texts) else None
 
     async def embed(self, texts: List[str]) -> List[List[float]]:
+        self.degraded = False  # True se l'ultima chiamata è finita sui vettori hash
         # 1) prova via gateway /v1/embeddings (se presente)
         try:
-            async with httpx.AsyncClient(timeout=20) as client:
-                r = await client.post(f"{self.base}/embeddings", json={"input": texts})
-                if r.is_success:
-                    data = r.json()
-                    vecs = [d["embedding"] for d in (data.get("data") or []) if "embedding" in d]
-                    if vecs: return vecs
-        except Exception:
-            pass
+            vecs = await self._cached(f"gateway:{self.model}", texts, self._embed_via_gateway)
+            if vecs: return vecs
+        except Exception as e:
+            log.warning("gateway embeddings failed: %s", e)
         # 2) prova OpenAI diretto se key presente
         if self.openai_key:
             try:
-                headers = {"Authorization": f"Bearer {self.openai_key}"}
-                async with httpx.AsyncClient(timeout=20) as client:
-                    r = await client.post("https://api.openai.com/v1/embeddings",
-                        headers=headers,
-                        json={"model":"text-embedding-3-small","input":texts})
-                    r.raise_for_status()
-                    data = r.json()
-                    return [d["embedding"] for d in data.get("data") or []]
+                vecs = await self._cached("openai:text-embedding-3-small", texts, self._embed_via_openai)
+                if vecs: return vecs
             except Exception:
                 pass
-        # 3) fallback dummy (hash → sparse float) per non bloccare
+        # 3) fallback dummy (hash → sparse float) per non bloccare (mai in cache)
         log.warning("RAG embeddings fallback: using hash-based embeddings")
+        self.degraded = True
         out = []
         for t in texts:
             h = hashlib.sha256((t or "").encode("utf-8","ignore")).digest()
@@ -100,16 +196,24 @@ class RagStore:
         self.namespace = ("proj_" + re.sub(r"[^a-zA-Z0-9_]+", "_", self.project_id)).lower()
         self.q = QDRANT_URL
         self.c = f"{QCOLLECTION}__{self.namespace}"
+        self.manifest_key = _manifest_key("qdrant", self.q, self.c)
         self.emb = EmbeddingClient()
 
 
-    async def ensure(self) -> None:
-        # crea collection se non esiste
+    def _forget(self) -> None:
+        _KNOWN_COLLECTIONS.discard((self.q, self.c))  # collection rimossa esternamente
+
+    async def ensure(self, *, verify: bool = False) -> bool:
+        # crea collection se non esiste (True se appena creata: il manifest va ignorato).
+        # verify: GET reale anche se già nota (prima di fidarsi del manifest per saltare file)
+        if not verify and (self.q, self.c) in _KNOWN_COLLECTIONS:
+            return False  # già verificata in questo processo: niente GET per ogni search
         try:
             async with httpx.AsyncClient(timeout=15) as client:
                 r = await client.get(f"{self.q}/collections/{self.c}")
                 if r.is_success:
-                    return
+                    _KNOWN_COLLECTIONS.add((self.q, self.c))
+                    return False
                 # create
                 body = {
                     "vectors": {"size": EMB_DIM, "distance": "Cosine"},
@@ -118,6 +222,8 @@ class RagStore:
                 r = await client.put(f"{self.q}/collections/{self.c}", json=body)
                 r.raise_for_status()
                 log.info("RAG created collection %s", self.c)
+                _KNOWN_COLLECTIONS.add((self.q, self.c))
+                return True
         except Exception as e:
             log.error("RAG ensure failed: %s", e)
             raise
@@ -152,7 +258,7 @@ class RagStore:
 
         try:
             async with httpx.AsyncClient(timeout=timeout_sec) as client:
-                r = await client.post(url, json=payload)
+                r = await client.post(url, json=payload, headers=tracing.inject())
                 r.raise_for_status()
                 data = r.json() or {}
                 docs = data.get("docs") or []
@@ -192,7 +298,7 @@ class RagStore:
 
         try:
             async with httpx.AsyncClient(timeout=timeout_sec) as client:
-                r = await client.post(url, json=payload)
+                r = await client.post(url, json=payload, headers=tracing.inject())
                 r.raise_for_status()
                 data = r.json() or {}
                 return data.get("docs") or []
@@ -201,81 +307,166 @@ class RagStore:
             return []
 
         
-    async def index_texts(self, items: List[Dict[str,Any]]) -> Dict[str,Any]:
+    async def index_texts(
+        self,
+        items: List[Dict[str,Any]],
+        *,
+        incremental: bool = True,
+        prune: bool = False,
+    ) -> Dict[str,Any]:
         """
         items: [{path, text}]  (contenuti già estratti)
+
+        - ID punto deterministico (path + sha del chunk): re-index idempotente, niente duplicati.
+        - incremental: i file con lo stesso sha del manifest vengono saltati; per i file cambiati
+          si embeddano/upsertano solo i chunk nuovi o spostati e si cancellano quelli spariti.
+        - prune: 'items' è l'insieme completo del progetto → i path assenti vengono rimossi.
         """
-        await self.ensure()
-        points = []
-        id_auto = int(time.time()*1000)
-        texts = []
-        metas = []
-        # chunk → embed
+
+        # il manifest fa saltare i file "invariati": va creduto solo se la collection esiste davvero
+        created = await self.ensure(verify=True)
+        manifest = {} if created else _load_manifest(self.manifest_key)
+        INCLUDE_TEXT = os.getenv("RAG_PAYLOAD_TEXT", "1").strip() not in ("0","false","False","no")
+        TEXT_MAX = int(os.getenv("RAG_PAYLOAD_TEXT_CHARS", "1200"))
+
+        texts: List[str] = []
+        points: List[Dict[str,Any]] = []
+        stale_ids: List[str] = []
+        legacy_paths: List[str] = []  # path indicizzati prima del manifest (ID random)
+        seen_paths = set()
+        skipped = changed = 0
+
         for it in items:
             p = _norm_path(it.get("path") or "unknown")
             t = it.get("text") or ""
-            chunks = _split_chunks(t)
-            for idx, ch in enumerate(chunks):
-                meta = {"path": p, "sha": _sha1(t), "chunk": idx}
+            seen_paths.add(p)
+            file_sha = _sha1(t)
+            prev = manifest.get(p)
+            if incremental and prev and prev.get("sha") == file_sha:
+                skipped += 1
+                continue
+            changed += 1
+            old_points: Dict[str,int] = dict((prev or {}).get("points") or {})
+            if prev is None:
+                legacy_paths.append(p)
+            new_points: Dict[str,int] = {}
+            occ: Dict[str,int] = {}
+            for idx, ch in enumerate(_split_chunks(t, path=p)):
+                ch_sha = _sha1(ch)
+                n = occ.get(ch_sha, 0)
+                occ[ch_sha] = n + 1
+                pid = _point_id(p, ch_sha, n)
+                new_points[pid] = idx
+                # chunk identico e nella stessa posizione: già presente in Qdrant
+                if incremental and old_points.get(pid) == idx:
+                    continue
+                payload = {"path": p, "sha": file_sha, "chunk": idx}
+                if INCLUDE_TEXT:
+                    # attach truncated text chunk for server-side retrieval in prompts
+                    payload["text"] = (ch or "")[:max(200, TEXT_MAX)]
                 texts.append(ch)
-                metas.append(meta)
-        if not texts:
-            return {"ok": True, "upserts": 0}
+                points.append({"id": pid, "payload": payload})
+            stale_ids.extend(pid for pid in old_points if pid not in new_points)
+            manifest[p] = {"sha": file_sha, "points": new_points}
+
+        if prune:
+            for p in [p for p in manifest if p not in seen_paths]:
+                stale_ids.extend((manifest.pop(p).get("points") or {}).keys())
 
-        vecs = await self.emb.embed(texts)
-        # compose points (optionally include text in payload, capped)
-        INCLUDE_TEXT = os.getenv("RAG_PAYLOAD_TEXT", "1").strip() not in ("0","false","False","no")
-        TEXT_MAX = int(os.getenv("RAG_PAYLOAD_TEXT_CHARS", "1200"))
-        for i,(v,m) in enumerate(zip(vecs, metas)):
-            payload = dict(m)
-            if INCLUDE_TEXT:
-                # attach truncated text chunk for server-side retrieval in prompts
-                try:
-                    chunk_idx = m.get("chunk", 0)
-                    payload["text"] = (texts[i] or "")[:max(200, TEXT_MAX)]
-                except Exception:
-                    pass
-           
-            points.append({
-                "id": id_auto + i,
-                "vector": v,
-                "payload": payload
-            })
-        # upsert
         try:
-            async with httpx.AsyncClient(timeout=30) as client:
-                body = {"points": points}
-                r = await client.put(f"{self.q}/collections/{self.c}/points", json=body)
-                r.raise_for_status()
-            return {"ok": True, "upserts": len(points)}
+            if texts:
+                # embedding solo dei chunk da scrivere (la cache copre quelli già visti)
+                vecs = await self.emb.embed(texts)
+                for pt, v in zip(points, vecs):
+                    pt["vector"] = v
+            await self._write_points(points, delete_ids=stale_ids, delete_paths=legacy_paths)
         except Exception as e:
             log.error("RAG upsert failed: %s", e)
             return {"ok": False, "error": str(e)}
 
+        # vettori hash (embeddings non disponibili): fuori dal manifest → ri-embeddati al prossimo giro
+        degraded_paths = {(pt.get("payload") or {}).get("path") for pt in points} if points and self.emb.degraded else set()
+        for p in degraded_paths:
+            manifest.pop(p, None)
+        _save_manifest(self.manifest_key, manifest)
+        cache = self.emb.cache.stats() if self.emb.cache else None
+        out = {
+            "ok": True,
+            "upserts": len(points),
+            "deleted": len(stale_ids),
+            "files_changed": changed,
+            "files_skipped": skipped,
+            "embed_cache": cache,
+        }
+        if degraded_paths:
+            out["degraded_files"] = len(degraded_paths)
+        return out
+
+    async def _write_points(
+        self,
+        points: List[Dict[str,Any]],
+        *,
+        delete_ids: List[str],
+        delete_paths: List[str],
+    ) -> None:
+        # scrittura sul backend (Qdrant REST); LocalVectorStore la ridefinisce
+        def check(r: httpx.Response) -> None:
+            if r.status_code == 404:
+                self._forget()  # il manifest non viene salvato: il prossimo index ricrea e re-indicizza
+            r.raise_for_status()
+
+        async with httpx.AsyncClient(timeout=30) as client:
+            if delete_paths:
+                check(await client.post(
+                    f"{self.q}/collections/{self.c}/points/delete",
+                    json={"filter": {"must": [{"key": "path", "match": {"any": delete_paths}}]}},
+                ))
+            for i in range(0, len(points), UPSERT_BATCH):
+                check(await client.put(f"{self.q}/collections/{self.c}/points",
+                                       json={"points": points[i:i + UPSERT_BATCH]}))
+            for i in range(0, len(delete_ids), 1000):
+                check(await client.post(f"{self.q}/collections/{self.c}/points/delete",
+                                        json={"points": delete_ids[i:i + 1000]}))
+
     async def search(self, query: str, top_k:int=TOP_K) -> List[Dict[str,Any]]:
+        return (await self.search_many([query], top_k=top_k))[0]
+
+    async def search_many(self, queries: List[str], top_k:int=TOP_K) -> List[List[Dict[str,Any]]]:
+        """
+        Più query in un giro: una sola chiamata embeddings per tutte le query e una
+        /points/search/batch su Qdrant. Ritorna una lista di hit per query (stesso ordine).
+        """
+        if not queries:
+            return []
         await self.ensure()
-        # embed query
-        vec = (await self.emb.embed([query]))[0]
-        # search
+        with tracing.span("rag.embed", queries=len(queries)) as sp:
+            vecs = await self.emb.embed(list(queries))
+            sp.set(degraded=self.emb.degraded)
         try:
             async with httpx.AsyncClient(timeout=20) as client:
-                body = {"vector": vec, "limit": top_k, "with_payload": True}
-                r = await client.post(f"{self.q}/collections/{self.c}/points/search", json=body)
+                body = {"searches": [{"vector": v, "limit": top_k, "with_payload": True} for v in vecs]}
+                with tracing.span("qdrant.search", kind="client", collection=self.c, queries=len(queries), top_k=top_k):
+                    r = await client.post(f"{self.q}/collections/{self.c}/points/search/batch", json=body)
+                if r.status_code == 404:
+                    self._forget()
                 r.raise_for_status()
-                data = r.json()
-                out = []
-                for it in (data.get("result") or []):
-                    pl = it.get("payload") or {}
-                    out.append({
-                        "path": pl.get("path",""),
-                        "chunk": pl.get("chunk",0),
-                        "score": it.get("score",0.0),
-                        "text": pl.get("text","")
-                    })
-                return out
+                results = r.json().get("result") or []
         except Exception as e:
             log.error("RAG search failed: %s", e)
-            return []
+            return [[] for _ in queries]
+        out: List[List[Dict[str,Any]]] = []
+        for i in range(len(queries)):
+            hits = []
+            for it in (results[i] if i < len(results) else None) or []:
+                pl = it.get("payload") or {}
+                hits.append({
+                    "path": pl.get("path",""),
+                    "chunk": pl.get("chunk",0),
+                    "score": it.get("score",0.0),
+                    "text": pl.get("text","")
+                })
+            out.append(hits)
+        return out
 
     async def purge(self, path_prefix: Optional[str]=None) -> Dict[str,Any]:
         await self.ensure()
@@ -287,10 +478,27 @@ class RagStore:
             async with httpx.AsyncClient(timeout=20) as client:
                 body = {"filter": payload_filter} if payload_filter else {}
                 r = await client.post(f"{self.q}/collections/{self.c}/points/delete", json=body)
+                if r.status_code == 404:
+                    self._forget()
                 r.raise_for_status()
+            # allinea il manifest: i path rimossi vanno re-indicizzati al prossimo giro
+            manifest = _load_manifest(self.manifest_key)
+            if path_prefix:
+                manifest.pop(_norm_path(path_prefix), None)
+            else:
+                manifest = {}
+            _save_manifest(self.manifest_key, manifest)
             return {"ok": True}
         except Exception as e:
             log.error("RAG purge failed: %s", e)
             return {"ok": False, "error": str(e)}
-        
 
+
+RAG_BACKEND = os.getenv("RAG_BACKEND", "qdrant").strip().lower()
+
+def open_store(project_id: str) -> RagStore:
+    """Store RAG del progetto: Qdrant (default) o indice locale in-process (RAG_BACKEND=local)."""
+    if RAG_BACKEND == "local":
+        from utils.local_vector_store import LocalVectorStore
+        return LocalVectorStore(project_id)
+    return RagStore(project_id)
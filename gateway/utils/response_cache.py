@@ -0,0 +1,216 @@
+# Cache delle risposte LLM (exact-match): sha256 canonico di (provider, model, messages, parametri
+# di generazione incl. seed/tools/response_format) -> envelope JSON della risposta.
+# Persistente su SQLite (WAL), TTL per entry, eviction LRU per numero di entry e dimensione del file.
+#
+# Modalità per richiesta (ChatRequest.cache / HarperRunRequest.gen["cache"]):
+#   bypass  nessuna lettura né scrittura
+#   read    read-through: hit → risposta in cache; miss → chiamata + scrittura
+#   write   chiamata sempre, risultato scritto (refresh)
+#   auto    (default, LLM_CACHE_MODE) read se la richiesta è deterministica
+#           (temperature == 0 oppure seed esplicito su un provider che lo onora), altrimenti bypass
+
+from __future__ import annotations
+import os, json, time, sqlite3, hashlib, asyncio, logging, threading
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+log = logging.getLogger("gateway.response_cache")
+
+CACHE_PATH        = os.getenv("LLM_CACHE_PATH", "/workspace/.cache/llm_responses.sqlite")
+CACHE_ENABLED     = os.getenv("LLM_CACHE", "1").strip() not in ("0", "false", "False", "no")
+CACHE_MODE        = os.getenv("LLM_CACHE_MODE", "auto").strip().lower()
+CACHE_TTL_SEC     = float(os.getenv("LLM_CACHE_TTL_SEC", str(7 * 86400)))
+CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "20000"))
+CACHE_MAX_MB      = int(os.getenv("LLM_CACHE_MAX_MB", "1024"))
+
+MODES = ("bypass", "read", "write", "auto")
+# provider a cui il gateway inoltra davvero il seed (OpenAI Chat Completions, vLLM)
+SEED_PROVIDERS = {"openai", "vllm"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS resp (
+    k         TEXT PRIMARY KEY,
+    provider  TEXT NOT NULL,
+    model     TEXT NOT NULL,
+    body      TEXT NOT NULL,
+    created   REAL NOT NULL,
+    expires   REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits      INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS resp_last_used ON resp(last_used);
+CREATE INDEX IF NOT EXISTS resp_expires ON resp(expires);
+"""
+
+
+def cache_key(provider: str, model: str, messages: List[Dict[str, Any]], params: Dict[str, Any]) -> str:
+    """Hash canonico: chiavi ordinate, separatori compatti, None rimossi dai parametri."""
+    doc = {
+        "provider": (provider or "").lower().strip(),
+        "model": (model or "").strip(),
+        "messages": messages or [],
+        "params": {k: v for k, v in sorted((params or {}).items()) if v is not None},
+    }
+    raw = json.dumps(doc, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def effective_mode(mode: Optional[str], temperature: Optional[float], seed: Any,
+                   provider: Optional[str] = None) -> str:
+    # il seed rende la risposta riproducibile solo se arriva davvero al provider (SEED_PROVIDERS)
+    m = (mode or CACHE_MODE or "auto").strip().lower()
+    if m not in MODES:
+        m = "auto"
+    if m == "auto":
+        seeded = seed is not None and (provider or "").lower() in SEED_PROVIDERS
+        deterministic = seeded or (temperature is not None and float(temperature) == 0.0)
+        return "read" if deterministic else "bypass"
+    return m
+
+
+def _cacheable(resp: Any) -> bool:
+    # solo risposte riuscite: envelope {ok: True} o risposta OpenAI-like senza errori
+    if not isinstance(resp, dict):
+        return False
+    if resp.get("ok") is False or resp.get("errors") or resp.get("error"):
+        return False
+    return True
+
+
+class ResponseCache:
+    def __init__(self, path: str = CACHE_PATH, *, ttl_sec: float = CACHE_TTL_SEC,
+                 max_entries: int = CACHE_MAX_ENTRIES, max_mb: int = CACHE_MAX_MB):
+        self.path = path
+        self.ttl_sec = max(1.0, float(ttl_sec))
+        self.max_entries = max(1, int(max_entries))
+        self.max_bytes = max(1, int(max_mb)) * 1024 * 1024
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        d = os.path.dirname(path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+        self._db = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    # --- sync core (eseguito in thread dagli wrapper async) ---
+    def get_sync(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute("SELECT body, expires FROM resp WHERE k=?", (key,)).fetchone()
+            if row is None or row[1] < now:
+                if row is not None:
+                    self._db.execute("DELETE FROM resp WHERE k=?", (key,))
+                self.misses += 1
+                return None
+            self._db.execute("UPDATE resp SET last_used=?, hits=hits+1 WHERE k=?", (now, key))
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put_sync(self, key: str, provider: str, model: str, body: Dict[str, Any]) -> None:
+        now = time.time()
+        data = json.dumps(body, ensure_ascii=False, default=str)
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO resp(k, provider, model, body, created, expires, last_used, hits)"
+                " VALUES (?,?,?,?,?,?,?,0)",
+                (key, provider, model, data, now, now + self.ttl_sec, now),
+            )
+            self.puts += 1
+            self._evict_locked(now)
+
+    def _evict_locked(self, now: float) -> None:
+        expired = self._db.execute("DELETE FROM resp WHERE expires < ?", (now,)).rowcount
+        n = self._db.execute("SELECT COUNT(*) FROM resp").fetchone()[0]
+        page_size = self._db.execute("PRAGMA page_size").fetchone()[0]
+        # pagine in uso: page_count da solo non scende mai dopo i DELETE (restano nella freelist)
+        pages = (self._db.execute("PRAGMA page_count").fetchone()[0]
+                 - self._db.execute("PRAGMA freelist_count").fetchone()[0])
+        used = page_size * pages
+        over = n - self.max_entries
+        if used > self.max_bytes:
+            # sopra soglia dimensione: libera i meno usati, almeno il 10% e quanto basta a rientrare
+            over = max(over, n // 10, int(n * (1 - self.max_bytes / used)) + 1)
+        if over > 0:
+            self._db.execute(
+                "DELETE FROM resp WHERE k IN (SELECT k FROM resp ORDER BY last_used LIMIT ?)", (over,)
+            )
+        removed = max(0, over) + max(0, expired)
+        if removed:
+            self.evictions += removed
+            log.info("llm cache evicted %d entries (expired=%d)", removed, expired)
+
+    # --- async API ---
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.get_sync, key)
+
+    async def put(self, key: str, provider: str, model: str, body: Dict[str, Any]) -> None:
+        await asyncio.to_thread(self.put_sync, key, provider, model, body)
+
+    def stats(self) -> Dict[str, object]:
+        total = self.hits + self.misses
+        return {
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "puts": self.puts,
+            "evictions": self.evictions,
+        }
+
+
+_CACHE: Optional[ResponseCache] = None
+_CACHE_FAILED = False
+
+
+def get_cache() -> Optional[ResponseCache]:
+    """Singleton di processo; None se disabilitata o se il file non è apribile."""
+    global _CACHE, _CACHE_FAILED
+    if not CACHE_ENABLED or _CACHE_FAILED:
+        return None
+    if _CACHE is None:
+        try:
+            _CACHE = ResponseCache()
+        except Exception as e:
+            _CACHE_FAILED = True
+            log.warning("llm cache disabled (%s): %s", CACHE_PATH, e)
+            return None
+    return _CACHE
+
+
+async def cached_call(
+    mode: str,
+    provider: str,
+    model: str,
+    messages: List[Dict[str, Any]],
+    params: Dict[str, Any],
+    call: Callable[[], Awaitable[Any]],
+) -> Tuple[Any, str]:
+    """
+    Esegue 'call' attraverso la cache secondo 'mode' (già risolto con effective_mode).
+    Ritorna (risposta, stato) con stato in hit|miss|write|bypass.
+    Errori della cache non bloccano mai la chiamata al provider.
+    """
+    cache = get_cache()
+    if cache is None or mode == "bypass":
+        return await call(), "bypass"
+    key = cache_key(provider, model, messages, params)
+    if mode == "read":
+        try:
+            hit = await cache.get(key)
+        except Exception as e:
+            log.warning("llm cache read failed: %s", e)
+            hit = None
+        if hit is not None:
+            log.info("llm cache hit provider=%s model=%s key=%s", provider, model, key[:12])
+            return hit, "hit"
+    resp = await call()
+    if _cacheable(resp):
+        try:
+            await cache.put(key, provider, model, resp)
+        except Exception as e:
+            log.warning("llm cache write failed: %s", e)
+    return resp, ("miss" if mode == "read" else "write")
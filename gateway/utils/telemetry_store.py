@@ -0,0 +1,331 @@
+# Indice SQLite della telemetria Harper: i file JSONL di HARPER_TELEMETRY_DIR vengono "tailati"
+# per offset (solo le righe nuove) in una tabella indicizzata per progetto/fase/modello/timestamp,
+# così le API /v1/metrics/harper/* non ri-parsano i file a ogni richiesta.
+# I file JSON-array (non appendibili) vengono re-ingeriti solo quando cambiano.
+# Rollup minute/hour/day per (file, fase, provider, modello) aggiornati nella stessa transazione
+# dell'ingestione: le aggregate costano O(bucket), non O(righe).
+
+from __future__ import annotations
+import os, json, time, sqlite3, logging, threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+log = logging.getLogger("gateway.telemetry_store")
+
+TELEMETRY_DIR = Path(os.getenv("HARPER_TELEMETRY_DIR", "/workspace/telemetry")).resolve()
+DB_PATH = os.getenv("HARPER_TELEMETRY_DB", str(TELEMETRY_DIR / ".telemetry_index.sqlite"))
+SYNC_INTERVAL = float(os.getenv("HARPER_TELEMETRY_SYNC_SEC", "2"))
+
+EXTS = {".json", ".jsonl", ".ndjson", ".log", ".txt"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    relpath      TEXT PRIMARY KEY,
+    file_project TEXT NOT NULL,
+    inode        INTEGER NOT NULL,
+    size         INTEGER NOT NULL,
+    mtime        REAL NOT NULL,
+    offset       INTEGER NOT NULL,
+    is_array     INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS rows (
+    id           INTEGER PRIMARY KEY,
+    relpath      TEXT NOT NULL,
+    file_project TEXT NOT NULL,
+    project_id   TEXT NOT NULL,
+    phase        TEXT NOT NULL,
+    provider     TEXT NOT NULL,
+    model        TEXT NOT NULL,
+    run_id       TEXT NOT NULL,
+    ts           REAL NOT NULL,
+    tokens_in    INTEGER NOT NULL,
+    tokens_out   INTEGER NOT NULL,
+    cost         REAL NOT NULL,
+    raw          TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS rows_project_ts ON rows(file_project, ts);
+CREATE INDEX IF NOT EXISTS rows_file_ts    ON rows(relpath, ts);
+CREATE INDEX IF NOT EXISTS rows_phase      ON rows(file_project, phase, ts);
+CREATE INDEX IF NOT EXISTS rows_model      ON rows(file_project, model);
+CREATE INDEX IF NOT EXISTS rows_cost       ON rows(file_project, cost);
+CREATE TABLE IF NOT EXISTS rollup (
+    gran         TEXT NOT NULL,
+    bucket       INTEGER NOT NULL,
+    relpath      TEXT NOT NULL,
+    file_project TEXT NOT NULL,
+    phase        TEXT NOT NULL,
+    provider     TEXT NOT NULL,
+    model        TEXT NOT NULL,
+    runs         INTEGER NOT NULL,
+    cost         REAL NOT NULL,
+    tokens_in    INTEGER NOT NULL,
+    tokens_out   INTEGER NOT NULL,
+    PRIMARY KEY (gran, bucket, relpath, phase, provider, model)
+);
+CREATE INDEX IF NOT EXISTS rollup_project ON rollup(gran, file_project, bucket);
+"""
+
+# granularità dei rollup → ampiezza bucket in secondi
+BUCKETS = {"minute": 60, "hour": 3600, "day": 86400}
+_SCHEMA_VERSION = 1
+
+# === estrazione campi (stessa semantica storica delle API) ===
+
+def _num(x, default=0.0) -> float:
+    try:
+        return float(x)
+    except Exception:
+        return float(default)
+
+def _int(x, default=0) -> int:
+    try:
+        return int(x)
+    except Exception:
+        return int(default)
+
+def _cost_from_row(r: dict) -> float:
+    """
+    Normalizza il costo:
+      - preferisci pricing.total_cost se presente
+      - poi r['cost_usd_est']
+      - fallback 0.0
+    """
+    pricing = r.get("pricing") or {}
+    tc = pricing.get("total_cost")
+    if tc is not None:
+        return _num(tc, 0.0)
+    return _num(r.get("cost_usd_est"), 0.0)
+
+def _tokens_in_from_row(r: dict) -> int:
+    usage = r.get("usage") or {}
+    return _int(
+        usage.get("prompt_tokens")
+        or usage.get("input_tokens")
+        or usage.get("cache_creation_input_tokens")
+        or 0,
+        0,
+    )
+
+def _tokens_out_from_row(r: dict) -> int:
+    usage = r.get("usage") or {}
+    return _int(
+        usage.get("completion_tokens")
+        or usage.get("output_tokens")
+        or 0,
+        0,
+    )
+
+def _file_project(base: Path, p: Path) -> str:
+    # <dir>/<id>.json → id ; <dir>/<id>/**/x.json → id
+    rel = p.relative_to(base)
+    return rel.stem if len(rel.parts) == 1 else rel.parts[0]
+
+
+class TelemetryStore:
+    def __init__(self, base: Path = TELEMETRY_DIR, db_path: str = DB_PATH):
+        self.base = base
+        self.db_path = db_path
+        self._lock = threading.RLock()
+        self._last_sync = 0.0
+        self.base.mkdir(parents=True, exist_ok=True)
+        self._db = sqlite3.connect(db_path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        if self._db.execute("PRAGMA user_version").fetchone()[0] < _SCHEMA_VERSION:
+            self._rebuild_rollups()
+
+    def _rebuild_rollups(self) -> None:
+        # indice creato prima dei rollup: ricalcolo una tantum dalle righe
+        self._db.execute("BEGIN")
+        self._db.execute("DELETE FROM rollup")
+        for gran, width in BUCKETS.items():
+            self._db.execute(
+                "INSERT INTO rollup(gran, bucket, relpath, file_project, phase, provider, model,"
+                " runs, cost, tokens_in, tokens_out)"
+                " SELECT ?, CAST(ts / ? AS INTEGER) * ?, relpath, file_project, phase, provider, model,"
+                " COUNT(*), SUM(cost), SUM(tokens_in), SUM(tokens_out) FROM rows"
+                " GROUP BY 2, relpath, phase, provider, model",
+                (gran, width, width),
+            )
+        self._db.execute(f"PRAGMA user_version={_SCHEMA_VERSION}")
+        self._db.execute("COMMIT")
+
+    # ----------------------------- ingestione ----------------------------------
+
+    def _scan(self) -> List[Path]:
+        files: List[Path] = []
+        for root, dirs, names in os.walk(self.base):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            for n in names:
+                if os.path.splitext(n)[1].lower() in EXTS:
+                    files.append(Path(root) / n)
+        return files
+
+    @staticmethod
+    def _row_values(relpath: str, file_project: str, r: dict) -> Tuple:
+        return (
+            relpath,
+            file_project,
+            str(r.get("project_id") or r.get("project") or ""),
+            str(r.get("phase") or "").lower(),
+            str(r.get("provider") or "").lower(),
+            str(r.get("model") or ""),
+            str(r.get("run_id") or ""),
+            _num(r.get("timestamp"), 0.0),
+            _tokens_in_from_row(r),
+            _tokens_out_from_row(r),
+            _cost_from_row(r),
+            json.dumps(r, ensure_ascii=False),
+        )
+
+    def _insert(self, relpath: str, file_project: str, records: List[dict]) -> int:
+        vals = [self._row_values(relpath, file_project, r) for r in records if isinstance(r, dict)]
+        if vals:
+            self._db.executemany(
+                "INSERT INTO rows(relpath, file_project, project_id, phase, provider, model, run_id,"
+                " ts, tokens_in, tokens_out, cost, raw) VALUES (?,?,?,?,?,?,?,?,?,?,?,?)",
+                vals,
+            )
+            self._add_rollups(relpath, file_project, vals)
+        return len(vals)
+
+    def _add_rollups(self, relpath: str, file_project: str, vals: List[Tuple]) -> None:
+        acc: Dict[Tuple, List[float]] = {}
+        for v in vals:
+            _rel, _fp, _pid, phase, provider, model, _run, ts, tin, tout, cost, _raw = v
+            for gran, width in BUCKETS.items():
+                a = acc.setdefault((gran, int(ts // width) * width, phase, provider, model), [0, 0.0, 0, 0])
+                a[0] += 1; a[1] += cost; a[2] += tin; a[3] += tout
+        self._db.executemany(
+            "INSERT INTO rollup(gran, bucket, relpath, file_project, phase, provider, model,"
+            " runs, cost, tokens_in, tokens_out) VALUES (?,?,?,?,?,?,?,?,?,?,?)"
+            " ON CONFLICT(gran, bucket, relpath, phase, provider, model) DO UPDATE SET"
+            " runs=runs+excluded.runs, cost=cost+excluded.cost,"
+            " tokens_in=tokens_in+excluded.tokens_in, tokens_out=tokens_out+excluded.tokens_out",
+            [(g, b, relpath, file_project, ph, pr, m, *a) for (g, b, ph, pr, m), a in acc.items()],
+        )
+
+    def _drop_file_rows(self, relpath: str) -> None:
+        self._db.execute("DELETE FROM rows WHERE relpath=?", (relpath,))
+        self._db.execute("DELETE FROM rollup WHERE relpath=?", (relpath,))
+
+    def _ingest_file(self, p: Path, st: os.stat_result, prev: Optional[sqlite3.Row]) -> int:
+        relpath = str(p.relative_to(self.base))
+        fproj = _file_project(self.base, p)
+        offset = 0
+        if prev is not None:
+            if prev["inode"] == st.st_ino and st.st_size == prev["size"] and st.st_mtime == prev["mtime"]:
+                return 0
+            rewritten = prev["inode"] != st.st_ino or st.st_size < prev["offset"] or prev["is_array"]
+            if rewritten:
+                self._drop_file_rows(relpath)
+            else:
+                offset = prev["offset"]
+
+        with p.open("rb") as f:
+            f.seek(offset)
+            data = f.read()
+        is_array = 0
+        records: List[dict] = []
+        if offset == 0 and data.lstrip()[:1] == b"[":
+            # JSON array completo: niente tail, re-ingestione quando cambia
+            try:
+                arr = json.loads(data.decode("utf-8", "ignore"))
+                if isinstance(arr, list):
+                    records, is_array = arr, 1
+                    consumed = len(data)
+            except Exception:
+                pass
+        if not is_array:
+            # solo righe complete: una riga a metà verrà letta al prossimo giro
+            end = data.rfind(b"\n") + 1
+            consumed = end
+            for line in data[:end].decode("utf-8", "ignore").splitlines():
+                s = line.strip()
+                if not s:
+                    continue
+                try:
+                    obj = json.loads(s)
+                except Exception:
+                    continue
+                if isinstance(obj, dict):
+                    records.append(obj)
+
+        n = self._insert(relpath, fproj, records)
+        self._db.execute(
+            "INSERT OR REPLACE INTO files(relpath, file_project, inode, size, mtime, offset, is_array)"
+            " VALUES (?,?,?,?,?,?,?)",
+            (relpath, fproj, st.st_ino, st.st_size, st.st_mtime, offset + consumed, is_array),
+        )
+        return n
+
+    def sync(self, force: bool = False) -> int:
+        """Allinea l'indice ai file (al più ogni SYNC_INTERVAL s). Ritorna le righe nuove."""
+        with self._lock:
+            now = time.monotonic()
+            if not force and now - self._last_sync < SYNC_INTERVAL:
+                return 0
+            self._last_sync = now
+            known = {r["relpath"]: r for r in self._db.execute("SELECT * FROM files")}
+            added = 0
+            seen = set()
+            self._db.execute("BEGIN")
+            try:
+                for p in self._scan():
+                    try:
+                        st = p.stat()
+                        rel = str(p.relative_to(self.base))
+                        seen.add(rel)
+                        added += self._ingest_file(p, st, known.get(rel))
+                    except Exception as e:
+                        log.warning("telemetry ingest failed for %s: %s", p, e)
+                for rel in set(known) - seen:
+                    self._drop_file_rows(rel)
+                    self._db.execute("DELETE FROM files WHERE relpath=?", (rel,))
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            if added:
+                log.info("telemetry index: +%d rows", added)
+            return added
+
+    def ingest(self, path: Path) -> int:
+        """Ingestione immediata di un singolo file (scrittura telemetria), senza scansione della directory."""
+        p = Path(path).resolve()
+        with self._lock:
+            rel = str(p.relative_to(self.base))
+            prev = self._db.execute("SELECT * FROM files WHERE relpath=?", (rel,)).fetchone()
+            self._db.execute("BEGIN")
+            try:
+                n = self._ingest_file(p, p.stat(), prev)
+                self._db.execute("COMMIT")
+            except Exception:
+                self._db.execute("ROLLBACK")
+                raise
+            return n
+
+    # ----------------------------- query ---------------------------------------
+
+    def query(self, sql: str, params: Tuple = ()) -> List[sqlite3.Row]:
+        with self._lock:
+            return self._db.execute(sql, params).fetchall()
+
+    def files(self, file_project: Optional[str] = None) -> List[sqlite3.Row]:
+        if file_project:
+            return self.query("SELECT * FROM files WHERE file_project=? ORDER BY relpath", (file_project,))
+        return self.query("SELECT * FROM files ORDER BY relpath")
+
+
+_STORE: Optional[TelemetryStore] = None
+_STORE_LOCK = threading.Lock()
+
+
+def get_store() -> TelemetryStore:
+    global _STORE
+    with _STORE_LOCK:
+        if _STORE is None:
+            _STORE = TelemetryStore()
+        return _STORE
@@ -0,0 +1,222 @@
+# Conteggio token per famiglia di modelli (sostituisce l'euristica chars/4 nel budgeting).
+#
+#   openai     BPE tiktoken: o200k_base (gpt-4o, gpt-4.1, gpt-5, o1/o3/o4) / cl100k_base (gpt-4, 3.5, embeddings)
+#   anthropic  approssimazione: cl100k × ANTHROPIC_TOKEN_RATIO (il tokenizer Claude non è pubblico)
+#   llama/...  approssimazione: cl100k × LLAMA_TOKEN_RATIO (deepseek, qwen, mistral, ollama/vllm)
+# tiktoken è opzionale e precaricato allo startup in un thread (startup()); se manca (o non riesce a scaricare i BPE)
+# si usa una pre-tokenizzazione regex (parole/punteggiatura) calibrata sul BPE, comunque più
+# precisa di chars/4 su codice e testo non inglese. Il fallimento è per encoding: dopo
+# TOKENIZER_RETRY_S il caricamento viene ritentato in un thread (mai sull'event loop).
+# I conteggi sono in una LRU per (encoding, sha1 del testo): prompt e core blobs ripetuti costano O(1);
+# i prefissi provati da clip() non passano dalla LRU (la riempirebbero di candidati usa-e-getta).
+
+from __future__ import annotations
+import asyncio, os, re, math, time, hashlib, logging, threading
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+log = logging.getLogger("gateway.tokenizer")
+
+CACHE_SIZE = int(os.getenv("TOKENIZER_CACHE_SIZE", "4096"))
+ANTHROPIC_TOKEN_RATIO = float(os.getenv("ANTHROPIC_TOKEN_RATIO", "1.10"))
+LLAMA_TOKEN_RATIO = float(os.getenv("LLAMA_TOKEN_RATIO", "1.05"))
+MESSAGE_OVERHEAD = 4  # role + separatori per messaggio (formato chat)
+RETRY_S = float(os.getenv("TOKENIZER_RETRY_S", "300"))
+
+PRELOAD_ENCODINGS = [e.strip() for e in os.getenv("TOKENIZER_PRELOAD", "o200k_base,cl100k_base").split(",") if e.strip()]
+
+_O200K_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-4.5", "gpt-5", "o1", "o3", "o4", "chatgpt-4o")
+
+# pre-tokenizzazione stile BPE: parole (con spazio iniziale), numeri a gruppi di 3, punteggiatura
+_PIECE_RE = re.compile(r"\s?[^\W\d_]+|\d{1,3}|\s?[^\s\w]+|\s+(?!\S)|\s+", re.UNICODE)
+
+
+def family_for(provider: Optional[str] = None, model: Optional[str] = None) -> str:
+    p = (provider or "").lower()
+    m = (model or "").lower()
+    if ":" in m and not p:
+        p, m = m.split(":", 1)
+    if p in ("openai", "azure") or m.startswith(("gpt-", "o1", "o3", "o4", "text-embedding", "chatgpt")):
+        return "openai"
+    if p == "anthropic" or m.startswith("claude"):
+        return "anthropic"
+    return "llama"
+
+
+def encoding_for(provider: Optional[str] = None, model: Optional[str] = None) -> Tuple[str, float]:
+    """(nome encoding tiktoken, fattore di scala) per provider/modello."""
+    fam = family_for(provider, model)
+    m = (model or "").lower().split(":", 1)[-1]
+    if fam == "openai":
+        return ("o200k_base" if m.startswith(_O200K_PREFIXES) else "cl100k_base"), 1.0
+    if fam == "anthropic":
+        return "cl100k_base", ANTHROPIC_TOKEN_RATIO
+    return "cl100k_base", LLAMA_TOKEN_RATIO
+
+
+class Tokenizer:
+    def __init__(self, cache_size: int = CACHE_SIZE):
+        self._encoders: Dict[str, Any] = {}
+        self._retry_at: Dict[str, float] = {}  # encoding fallito → monotonic del prossimo tentativo
+        self._loading: set = set()
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, str], int]" = OrderedDict()
+        self._cache_size = max(1, cache_size)
+        self.hits = 0
+        self.misses = 0
+
+    # --- encoder (precaricati allo startup; lazy come fallback) ---
+    def preload(self, names: List[str] = PRELOAD_ENCODINGS) -> None:
+        # lettura/download dei BPE: da chiamare fuori dall'event loop
+        for name in names:
+            self._encoder(name)
+
+    def _encoder(self, name: str):
+        enc = self._encoders.get(name)
+        if enc is not None:
+            return enc
+        retry_at = self._retry_at.get(name)
+        if retry_at is not None:
+            # già fallito: approssimazione regex; scaduto il backoff si ritenta in background
+            if time.monotonic() >= retry_at and name not in self._loading:
+                self._loading.add(name)
+                threading.Thread(target=self._load, args=(name,), name=f"tiktoken-{name}", daemon=True).start()
+            return None
+        return self._load(name)
+
+    def _load(self, name: str):
+        try:
+            with self._lock:
+                if name in self._encoders:
+                    return self._encoders[name]
+                try:
+                    import tiktoken  # opzionale
+                    enc = tiktoken.get_encoding(name)
+                except Exception as e:
+                    self._retry_at[name] = time.monotonic() + RETRY_S
+                    log.warning("tiktoken encoding=%s unavailable (%s): regex approximation, retry in %.0fs",
+                                name, e, RETRY_S)
+                    return None
+                self._encoders[name] = enc
+                self._retry_at.pop(name, None)
+                log.info("tokenizer loaded encoding=%s", name)
+                return enc
+        finally:
+            self._loading.discard(name)
+
+    @staticmethod
+    def _approx(text: str) -> int:
+        # ogni pezzo ≈ 1 token; parole lunghe/identificatori vengono spezzati dal BPE (~1 token / 6 char)
+        n = 0
+        for piece in _PIECE_RE.findall(text):
+            size = len(piece.strip())
+            n += 1 + (size - 1) // 6 if size > 6 else 1
+        return n
+
+    # --- API ---
+    def count(self, text: str, provider: Optional[str] = None, model: Optional[str] = None) -> int:
+        if not text:
+            return 0
+        name, ratio = encoding_for(provider, model)
+        # i conteggi approssimati hanno una chiave propria: non sopravvivono al recupero dell'encoding
+        tag = name if self._encoder(name) is not None else "regex-approx"
+        key = (f"{tag}:{ratio}", hashlib.sha1(text.encode("utf-8", "surrogatepass")).hexdigest())
+        with self._lock:
+            n = self._cache.get(key)
+            if n is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return n
+        n = self._count_uncached(text, name, ratio)
+        with self._lock:
+            self.misses += 1
+            self._cache[key] = n
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+        return n
+
+    def _count_uncached(self, text: str, name: str, ratio: float) -> int:
+        if not text:
+            return 0
+        enc = self._encoder(name)
+        base = len(enc.encode(text, disallowed_special=())) if enc is not None else self._approx(text)
+        return max(1, int(math.ceil(base * ratio)))
+
+    def count_messages(self, messages: List[Dict[str, Any]], provider: Optional[str] = None,
+                       model: Optional[str] = None) -> int:
+        total = 0
+        for m in messages or []:
+            content = m.get("content")
+            if isinstance(content, list):
+                content = "".join(b.get("text") or "" for b in content if isinstance(b, dict))
+            total += MESSAGE_OVERHEAD + self.count(content if isinstance(content, str) else "", provider, model)
+        return total + (3 if messages else 0)  # priming della risposta
+
+    def clip(self, text: str, max_tokens: int, provider: Optional[str] = None, model: Optional[str] = None,
+             *, keep: str = "tail") -> str:
+        """Taglia text a max_tokens tenendo la coda (default) o la testa."""
+        if not text or max_tokens <= 0:
+            return ""
+        if self.count(text, provider, model) <= max_tokens:
+            return text
+        # ricerca binaria sulla lunghezza in caratteri (funziona con BPE esatto e approssimato);
+        # i candidati si contano senza cache
+        name, ratio = encoding_for(provider, model)
+        lo, hi = 0, len(text)
+        while lo < hi:
+            mid = (lo + hi + 1) // 2
+            part = text[-mid:] if keep == "tail" else text[:mid]
+            if self._count_uncached(part, name, ratio) <= max_tokens:
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[-lo:] if keep == "tail" else text[:lo]
+
+    def encode(self, text: str, provider: Optional[str] = None, model: Optional[str] = None) -> Dict[str, Any]:
+        name, ratio = encoding_for(provider, model)
+        enc = self._encoder(name)
+        out: Dict[str, Any] = {
+            "family": family_for(provider, model),
+            "encoding": name if enc is not None else "regex-approx",
+            "exact": enc is not None and ratio == 1.0,
+            "tokens": self.count(text, provider, model),
+        }
+        if enc is not None and ratio == 1.0:
+            out["ids"] = enc.encode(text or "", disallowed_special=())
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "encoders": sorted(self._encoders),
+            "tiktoken": not self._retry_at,
+            "unavailable": sorted(self._retry_at),
+            "cache_entries": len(self._cache),
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+_TOKENIZER = Tokenizer()
+
+
+def get_tokenizer() -> Tokenizer:
+    return _TOKENIZER
+
+
+async def startup() -> None:
+    # BPE tiktoken caricati prima della prima richiesta, senza bloccare l'event loop
+    await asyncio.to_thread(_TOKENIZER.preload)
+
+
+def count_tokens(text: str, provider: Optional[str] = None, model: Optional[str] = None) -> int:
+    return _TOKENIZER.count(text, provider, model)
+
+
+def count_message_tokens(messages: List[Dict[str, Any]], provider: Optional[str] = None,
+                         model: Optional[str] = None) -> int:
+    return _TOKENIZER.count_messages(messages, provider, model)
+
+
+def clip_to_tokens(text: str, max_tokens: int, provider: Optional[str] = None, model: Optional[str] = None,
+                   *, keep: str = "tail") -> str:
+    return _TOKENIZER.clip(text, max_tokens, provider, model, keep=keep)
@@ -1,17 +1,23 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 import os, logging
 from routes.agent import router as agent_router
+from routes.blobs import router as blobs_router
 from routes.git import router as git_router
 from routes.health import router as health_router
-from starlette.middleware.base import BaseHTTPMiddleware
+from routes.metrics import router as metrics_router
+from utils.access_log import AccessLogMiddleware
+from utils.tracing import TracingMiddleware
 from routes.v1 import router as v1_router
 from config import settings
 from routes.harper import router as harper_router
 from routes import router as router_router
 from routes import rag as rag_routes
 from routes import routes_eval as eval_router
+from services import blob_store, extraction, gateway_poller
+from services import provider_health, routing_stats  # noqa: F401 (registrano i poller del gateway)
+from utils import metrics, tracing
 
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
@@ -26,18 +32,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-class LogRequestsMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        try:
-            raw = await request.body()
-            logging.info(f"[REQ] {request.method} {request.url} headers={{'content-type': '{request.headers.get('content-type')}'}} body={raw[:1000]!r}")
-        except Exception as e:
-            logging.exception(f"Failed to read request body: {e}")
-        response = await call_next(request)
-        logging.info(f"[RES] {request.method} {request.url} -> {response.status_code}")
-        return response
-
-app.add_middleware(LogRequestsMiddleware)
+# access log ASGI puro: misura size/durata senza leggere il body (niente doppio buffer dei payload)
+app.add_middleware(AccessLogMiddleware)
+# trace context W3C (traceparent / x-request-id) propagato al gateway da services.harper
+app.add_middleware(TracingMiddleware)
 # include routers
 app.include_router(health_router)
 app.include_router(agent_router)
@@ -47,6 +45,29 @@ app.include_router(v1_router)
 app.include_router(harper_router)
 app.include_router(router_router.router)
 app.include_router(eval_router.router)
+app.include_router(blobs_router)
+app.include_router(metrics_router)
+
+
+@app.on_event("startup")
+async def _startup_metrics():
+    # event-loop lag per /metrics
+    await metrics.startup()
+    # salute provider e stats di routing dal gateway, in background (il router legge solo la cache)
+    await gateway_poller.startup()
+    # retention del blob store allegati (sweep periodico in un thread)
+    await blob_store.startup()
+
+
+@app.on_event("shutdown")
+async def _shutdown_services():
+    await metrics.shutdown()
+    await gateway_poller.shutdown()
+    await blob_store.shutdown()
+    # termina il process pool degli estrattori (PDF/DOCX/XLSX...)
+    extraction.shutdown()
+    # ultimi span in coda verso il file
+    tracing.shutdown()
 
 
 
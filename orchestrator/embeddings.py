@@ -21,15 +21,24 @@ async def embed_text(text: str, model: Optional[str] = None) -> List[float]:
             raise RuntimeError(f"invalid embedding response for model={m}")
         return vec
 
-async def embed_texts(texts: List[str], model: Optional[str] = None) -> List[List[float]]:
+async def embed_texts(texts: List[str], model: Optional[str] = None, batch_size: int = 32) -> List[List[float]]:
     """
-    Calcola gli embedding per una lista di testi (loop singoli per massima compatibilità).
+    Calcola gli embedding per una lista di testi in batch via Ollama /api/embed ('input' lista).
+    Se il server non espone /api/embed (Ollama < 0.3) ricade su chiamate singole.
     """
     if not texts:
         return []
+    m = model or DEFAULT_EMBED_MODEL
     out: List[List[float]] = []
-    for t in texts:
-        out.append(await embed_text(t, model=model))
+    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT_S) as client:
+        for i in range(0, len(texts), max(1, batch_size)):
+            part = texts[i:i + max(1, batch_size)]
+            r = await client.post(f"{OLLAMA_URL}/api/embed", json={"model": m, "input": part})
+            if r.status_code == 404:
+                return [await embed_text(t, model=m) for t in texts]
+            r.raise_for_status()
+            vecs = r.json().get("embeddings") or []
+            if len(vecs) != len(part):
+                raise RuntimeError(f"invalid embedding batch for model={m}: {len(vecs)} != {len(part)}")
+            out.extend(vecs)
     return out
-
-
@@ -1,12 +1,23 @@
 # orchestrator/app/eval_runner.py
 from __future__ import annotations
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Any, Dict, List, Optional
-import logging, os, shlex, subprocess, sys
+from typing import Any, Callable, Dict, List, Optional
+import logging, os, shlex, signal, subprocess, sys, threading, time
 
 log = logging.getLogger("eval_runner")
 
+# Scheduler dei casi: DAG su 'depends_on', pool di thread che attendono i subprocess.
+# Parallelo solo se l'LTC lo chiede ("parallel": true) o dichiara dipendenze: gli LTC storici
+# hanno casi ordinati implicitamente (start_broker → ensure_topics → tests) e restano sequenziali.
+EVAL_WORKERS = int(os.getenv("EVAL_WORKERS", "4"))  # i thread attendono subprocess: non legati alle CPU
+EVAL_PARALLEL_DEFAULT = os.getenv("EVAL_PARALLEL_DEFAULT", "0").strip().lower() in ("1", "true", "yes")
+EVAL_KILL_GRACE_S = float(os.getenv("EVAL_KILL_GRACE_S", "5"))
+
+OnCase = Callable[["EvalCase"], None]
+
 @dataclass
 class EvalCase:
     name: str
@@ -17,6 +28,7 @@ class EvalCase:
     cmd: Optional[str] = None
     cwd: Optional[str] = None
     expect: Optional[int] = None
+    duration_ms: Optional[float] = None
 
 @dataclass
 class EvalReport:
@@ -29,9 +41,19 @@ class EvalReport:
     junit_path: Optional[str] = None
     json_path: Optional[str] = None
 
+def _as_list(v: Any) -> List[str]:
+    # depends_on: "nome" | ["nome", ...]
+    if not v:
+        return []
+    if isinstance(v, str):
+        return [v]
+    return [str(x) for x in v if x]
+
 class EvalRunner:
     def __init__(self, project_root: Path):
         self.project_root = project_root
+        # pip install concorrenti sullo stesso interprete si pestano i piedi: uno alla volta
+        self._pip_lock = threading.Lock()
 
     # ------------------------ helpers -------------------------
     def _merge_env(self, base: Optional[Dict[str, str]], extra: Optional[Dict[str, str]]) -> Dict[str, str]:
@@ -42,50 +64,167 @@ class EvalRunner:
             env.update({str(k): str(v) for k, v in extra.items()})
         return env
 
+    def _kill_group(self, p: subprocess.Popen) -> None:
+        """SIGTERM al process group del caso (shell + figli), SIGKILL dopo EVAL_KILL_GRACE_S."""
+        if not hasattr(os, "killpg"):
+            p.kill()
+            return
+        for sig, grace in ((signal.SIGTERM, EVAL_KILL_GRACE_S), (signal.SIGKILL, None)):
+            try:
+                os.killpg(p.pid, sig)
+            except ProcessLookupError:
+                return
+            if grace is None:
+                return
+            try:
+                p.wait(timeout=grace)
+                return
+            except subprocess.TimeoutExpired:
+                continue
+
     def _run(self, *, name: str, cmd: str, cwd: Path, expect: int = 0, env: Optional[Dict[str, str]] = None, timeout: Optional[int] = None) -> EvalCase:
+        t0 = time.monotonic()
         try:
-            p = subprocess.run(
+            # sessione propria: al timeout si uccide tutto il gruppo, non solo la shell
+            p = subprocess.Popen(
                 cmd,
                 shell=True,
                 cwd=str(cwd),
                 env=env,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
-                timeout=timeout
+                start_new_session=True,
             )
-            ok = (p.returncode == expect)
+        except Exception as e:
             return EvalCase(
                 name=name,
-                passed=ok,
-                code=p.returncode,
-                stdout=(p.stdout or "")[-4000:],
-                stderr=(p.stderr or "")[-4000:],
+                passed=False,
+                code=999,
+                stdout="",
+                stderr=str(e),
                 cmd=cmd,
                 cwd=str(cwd),
-                expect=expect
+                expect=expect,
+                duration_ms=round((time.monotonic() - t0) * 1000, 1)
             )
-        except subprocess.TimeoutExpired as e:
+        try:
+            out, err = p.communicate(timeout=float(timeout) if timeout else None)
+        except subprocess.TimeoutExpired:
+            self._kill_group(p)
+            try:
+                out, err = p.communicate(timeout=EVAL_KILL_GRACE_S)
+            except subprocess.TimeoutExpired:
+                # un nipote fuori dal gruppo tiene aperte le pipe: si rinuncia all'output
+                out, err = "", ""
+            log.warning("eval case %s timed out after %ss: process group killed", name, timeout)
             return EvalCase(
                 name=name,
                 passed=False,
                 code=998,
-                stdout=(e.stdout or ""),
-                stderr=f"timeout: {e}",
+                stdout=(out or "")[-4000:],
+                stderr=(f"timeout: command exceeded {timeout}s, process group killed\n" + (err or ""))[-4000:],
                 cmd=cmd,
                 cwd=str(cwd),
-                expect=expect
+                expect=expect,
+                duration_ms=round((time.monotonic() - t0) * 1000, 1)
             )
+        ok = (p.returncode == expect)
+        return EvalCase(
+            name=name,
+            passed=ok,
+            code=p.returncode,
+            stdout=(out or "")[-4000:],
+            stderr=(err or "")[-4000:],
+            cmd=cmd,
+            cwd=str(cwd),
+            expect=expect,
+            duration_ms=round((time.monotonic() - t0) * 1000, 1)
+        )
+
+    # ---- scheduler (DAG) ----
+    def _emit(self, on_case: Optional[OnCase], case: EvalCase) -> None:
+        if on_case is None:
+            return
+        try:
+            on_case(case)
         except Exception as e:
-            return EvalCase(
-                name=name,
-                passed=False,
-                code=999,
-                stdout="",
-                stderr=str(e),
-                cmd=cmd,
-                cwd=str(cwd),
-                expect=expect
-            )
+            log.warning("eval on_case callback failed: %s", e)
+
+    def _run_dag(self, cases: List[Dict[str, Any]], run_one: Callable[[Dict[str, Any]], List[EvalCase]],
+                 workers: int, on_case: Optional[OnCase] = None) -> List[List[EvalCase]]:
+        """
+        Esegue i casi rispettando 'depends_on' (nomi di altri casi) con al più 'workers' in parallelo.
+        Un caso parte quando tutte le sue dipendenze sono finite; se una è fallita viene saltato
+        (code 996). Dipendenze sconosciute o cicliche → code 995. Risultati nell'ordine dichiarato.
+        """
+        n = len(cases)
+        by_name: Dict[str, List[int]] = {}
+        for i, c in enumerate(cases):
+            by_name.setdefault(c["name"], []).append(i)
+        deps: List[set] = []
+        invalid: Dict[int, str] = {}
+        dependents: List[List[int]] = [[] for _ in range(n)]
+        for i, c in enumerate(cases):
+            d = set()
+            for dn in c.get("depends_on") or []:
+                idx = by_name.get(dn)
+                if not idx:
+                    invalid[i] = f"unknown dependency '{dn}'"
+                    continue
+                d.update(j for j in idx if j != i)
+            deps.append(d)
+            for j in d:
+                dependents[j].append(i)
+
+        results: List[Optional[List[EvalCase]]] = [None] * n
+        remaining = [set(d) for d in deps]
+        ready = deque(i for i in range(n) if not remaining[i])
+
+        def _not_run(i: int, code: int, reason: str) -> List[EvalCase]:
+            c = cases[i]
+            return [EvalCase(name=c["name"], passed=False, code=code, stdout="", stderr=reason,
+                             cmd=c.get("run"), cwd=c.get("cwd"), expect=c.get("expect"))]
+
+        def _finish(i: int, res: List[EvalCase]) -> None:
+            results[i] = res
+            for r in res:
+                self._emit(on_case, r)
+            for j in dependents[i]:
+                remaining[j].discard(i)
+                if not remaining[j]:
+                    ready.append(j)
+
+        with ThreadPoolExecutor(max_workers=max(1, workers), thread_name_prefix="eval-case") as pool:
+            pending: Dict[Any, int] = {}
+            while True:
+                while ready:
+                    i = ready.popleft()
+                    if i in invalid:
+                        _finish(i, _not_run(i, 995, f"invalid depends_on: {invalid[i]}"))
+                        continue
+                    failed = sorted({cases[j]["name"] for j in deps[i] if not all(r.passed for r in results[j] or [])})
+                    if failed:
+                        _finish(i, _not_run(i, 996, f"skipped: dependency failed: {', '.join(failed)}"))
+                        continue
+                    pending[pool.submit(run_one, cases[i])] = i
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    i = pending.pop(f)
+                    try:
+                        res = f.result()
+                    except Exception as e:
+                        res = _not_run(i, 999, f"runner error: {e}")
+                    _finish(i, res)
+
+        # casi mai sbloccati: ciclo nelle dipendenze (o a valle di un ciclo)
+        for i in range(n):
+            if results[i] is None:
+                results[i] = _not_run(i, 995, "invalid depends_on: blocked by a dependency cycle")
+                self._emit(on_case, results[i][0])
+        return [r or [] for r in results]
 
     # ---- PIP install helpers (sicuri) ----
     def _pip_install_packages(self, pkgs: List[str], env: Dict[str, str], workdir: Path) -> EvalCase:
@@ -113,7 +252,8 @@ class EvalRunner:
 
         quoted = " ".join(shlex.quote(x) for x in clean)
         cmd = f"{shlex.quote(sys.executable)} -m pip install --disable-pip-version-check --no-input {quoted}"
-        res = self._run(name=f"pip install ({len(clean)} pkgs)", cmd=cmd, cwd=workdir, expect=0, env=env)
+        with self._pip_lock:
+            res = self._run(name=f"pip install ({len(clean)} pkgs)", cmd=cmd, cwd=workdir, expect=0, env=env)
         if msg:
             # Aggiungi nota sugli scarti
             res.stderr = (res.stderr + ("\n" if res.stderr else "") + msg)[-4000:]
@@ -134,7 +274,8 @@ class EvalRunner:
                 stderr=f"requirements file not found: {abs_path}"
             )
         cmd = f"{shlex.quote(sys.executable)} -m pip install --disable-pip-version-check --no-input -r {shlex.quote(str(abs_path))}"
-        return self._run(name=f"pip install (-r {abs_path.name})", cmd=cmd, cwd=workdir, expect=0, env=env)
+        with self._pip_lock:
+            return self._run(name=f"pip install (-r {abs_path.name})", cmd=cmd, cwd=workdir, expect=0, env=env)
 
 
 
@@ -151,10 +292,12 @@ class EvalRunner:
         # return self._run(name=f"pip install (-r {abs_path.name})", cmd=cmd, cwd=workdir, expect=0, env=env)
 
     # ------------------------ PUBLIC: run profile -------------------------
-    def run_profile(self, profile: str, ltc: Dict[str, Any], mode: str = "auto", verdict: Optional[str] = None, req_id: Optional[str] = None ) -> EvalReport:
+    def run_profile(self, profile: str, ltc: Dict[str, Any], mode: str = "auto", verdict: Optional[str] = None, req_id: Optional[str] = None, on_case: Optional[OnCase] = None) -> EvalReport:
         """
         Esegue l'LTC in modalità 'auto' (default) oppure produce un esito manuale
         ('manual' + verdict in {'pass','fail'}). Nessun side-effect sui file di progetto.
+        on_case(EvalCase) viene chiamato a ogni caso concluso (ordine di completamento):
+        risultati parziali per lo streaming.
         """
         # normalizza il path dell’LTC
         profile_path = Path(profile)
@@ -201,9 +344,11 @@ class EvalRunner:
         if top_pip_file:
             env = self._merge_env(top_env, None)
             out_cases.append(self._pip_install_file(top_pip_file, env, default_cwd))
+            self._emit(on_case, out_cases[-1])
         elif top_pip:
             env = self._merge_env(top_env, None)
             out_cases.append(self._pip_install_packages(top_pip, env, default_cwd))
+            self._emit(on_case, out_cases[-1])
 
         # Optional: top-level pre-commands
         pre_cmds = ltc.get("pre") or []
@@ -217,6 +362,7 @@ class EvalRunner:
                 env=env,
                 timeout=None
             ))
+            self._emit(on_case, out_cases[-1])
 
         # Normalizza casi (supporta 'cases[]', 'steps[]', o singolo 'run')
         norm_cases: List[Dict[str, Any]] = []
@@ -230,7 +376,8 @@ class EvalRunner:
                     "timeout": c.get("timeout"),
                     "pip": c.get("pip") or [],
                     "pip_file": c.get("pip_file"),
-                    "env": c.get("env") or {}
+                    "env": c.get("env") or {},
+                    "depends_on": _as_list(c.get("depends_on"))
                 })
         elif isinstance(ltc.get("steps"), list) and ltc["steps"]:
             for s in ltc["steps"]:
@@ -242,7 +389,8 @@ class EvalRunner:
                     "timeout": s.get("timeout"),
                     "pip": s.get("pip") or [],
                     "pip_file": s.get("pip_file"),
-                    "env": s.get("env") or {}
+                    "env": s.get("env") or {},
+                    "depends_on": _as_list(s.get("depends_on"))
                 })
         elif ltc.get("run"):
             norm_cases.append({
@@ -253,33 +401,34 @@ class EvalRunner:
                 "timeout": ltc.get("timeout"),
                 "pip": ltc.get("pip_case") or [],
                 "pip_file": ltc.get("pip_file_case"),
-                "env": ltc.get("env_case") or {}
+                "env": ltc.get("env_case") or {},
+                "depends_on": []
             })
 
         # Esecuzione casi (con eventuali pip/env per-caso)
-        for c in norm_cases:
+        def _run_case(c: Dict[str, Any]) -> List[EvalCase]:
             cmd = c.get("run")
             workdir = self.project_root / c.get("cwd") if c.get("cwd") else self.project_root
             case_env = self._merge_env(top_env, c.get("env") or {})
             timeout = c.get("timeout")
 
             if not cmd:
-                out_cases.append(EvalCase(
+                return [EvalCase(
                     name=c.get("name") or "case",
                     passed=False, code=997,
                     stdout="", stderr="missing 'run'",
                     cmd=None, cwd=str(workdir),
-                    expect=c.get("expect")))
-                continue
+                    expect=c.get("expect"))]
 
+            res: List[EvalCase] = []
             # per-case optional pip
             if c.get("pip_file"):
-                out_cases.append(self._pip_install_file(c["pip_file"], case_env, workdir))
+                res.append(self._pip_install_file(c["pip_file"], case_env, workdir))
             elif c.get("pip"):
-                out_cases.append(self._pip_install_packages(c["pip"], case_env, workdir))
+                res.append(self._pip_install_packages(c["pip"], case_env, workdir))
 
             # run real case
-            out_cases.append(self._run(
+            res.append(self._run(
                 name=c.get("name") or "case",
                 cmd=cmd,
                 cwd=workdir,
@@ -287,6 +436,16 @@ class EvalRunner:
                 env=case_env,
                 timeout=timeout
             ))
+            return res
+
+        parallel = ltc.get("parallel")
+        if parallel is None:
+            parallel = EVAL_PARALLEL_DEFAULT or any(c["depends_on"] for c in norm_cases)
+        workers = max(1, min(int(ltc.get("workers") or EVAL_WORKERS), 32)) if parallel else 1
+        t0 = time.monotonic()
+        for res in self._run_dag(norm_cases, _run_case, workers, on_case):
+            out_cases.extend(res)
+        log.info("eval %s: %d cases in %.1fs (workers=%d)", eff_req, len(norm_cases), time.monotonic() - t0, workers)
 
         # Report
         passed = sum(1 for c in out_cases if c.passed)
@@ -1,6 +1,12 @@
 from fastapi import APIRouter
+from utils.access_log import histograms as http_histograms
 router = APIRouter()
 
 @router.get("/health")
 async def health():
-    return {"clike orchestrator status": "ok"}
\ No newline at end of file
+    return {"clike orchestrator status": "ok"}
+
+@router.get("/health/http")
+async def health_http():
+    # istogrammi di latenza per route (access log middleware)
+    return http_histograms().snapshot()
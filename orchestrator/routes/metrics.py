@@ -0,0 +1,41 @@
+# orchestrator/routes/metrics.py
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from services.extraction import service as extraction_service
+from utils.access_log import LATENCY_BUCKETS, histograms as http_histograms, in_flight as http_in_flight
+from utils.metrics import Family, histogram_samples, registry
+
+router = APIRouter()
+
+
+@registry().collector
+def _http_server():
+    # richieste servite dall'orchestrator (access log middleware)
+    dur = Family("clike_http_request_duration_seconds", "histogram", "Durata delle richieste HTTP per route")
+    req = Family("clike_http_requests_total", "counter", "Richieste HTTP per route e classe di status")
+    for method, route, counts, total, count, status in http_histograms().items():
+        labels = {"method": method, "route": route}
+        for s in histogram_samples(LATENCY_BUCKETS, counts, total, count, labels):
+            dur.add(s[1], s[2], suffix=s[0])
+        for cls, n in status.items():
+            req.add({**labels, "status": cls}, n)
+    return [
+        dur,
+        req,
+        Family("clike_http_requests_in_flight", "gauge", "Richieste HTTP in corso").add({}, http_in_flight()),
+    ]
+
+
+@registry().collector
+def _queues():
+    ex = extraction_service()
+    return [
+        Family("clike_extraction_waiting", "gauge", "Estrazioni in attesa di uno slot").add({}, ex.waiting),
+        Family("clike_extraction_in_flight", "gauge", "Estrazioni in corso nel process pool").add({}, ex.in_flight),
+    ]
+
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(registry().render(), media_type="text/plain; version=0.0.4; charset=utf-8")
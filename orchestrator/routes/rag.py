@@ -6,15 +6,9 @@ from pydantic import BaseModel
 
 from typing import List, Dict, Any, Optional
 import logging
-import io, os, base64
-from pdfminer.high_level import extract_text  # import INSIDE to avoid import warning at module load
+import os, base64
 
-import docx
 import pydantic
-import openpyxl  # .xlsx
-import xlrd  # .xls (legacy)
-from pyxlsb import open_workbook as open_xlsb  # .xlsb (optional)
-from pptx import Presentation  # .pptx
 # Detect Pydantic major version once
 try:
     _PYD_VER = int((getattr(pydantic, "__version__", "1.0.0").split(".")[0]) or "1")
@@ -35,7 +29,8 @@ else:
             extra = "ignore"
 
 
-from services.rag_store import RagStore
+from services.blob_store import attachment_text
+from services.rag_store import open_store
 
 log = logging.getLogger("router.rag")
 
@@ -45,10 +40,15 @@ class RagIndexItem(RagBase):
     path: str
     text: Optional[str] = None
     bytes_b64: Optional[str] = None
+    blob: Optional[str] = None  # handle "sha256:<hex>" da POST /v1/blobs (al posto di bytes_b64)
 
 class RagIndexRequest(RagBase):
     project_id: str
     items: List[RagIndexItem]
+    # salta i file invariati (sha nel manifest) e aggiorna solo i chunk cambiati
+    incremental: bool = True
+    # 'items' è l'intero progetto: rimuove dall'indice i path non presenti
+    prune: bool = False
 
 class RagSearchRequest(RagBase):
     project_id: str
@@ -153,46 +153,13 @@ def _ext_from_path(p: str) -> str:
         return os.path.splitext((p or "").strip())[1].lower()
     except Exception:
         return ""
-# --- ADD: extraction helpers ---
-def _extract_text_from_pdf_bytes(raw: bytes) -> str:
-    # pdfminer.six
-    try:
-        return extract_text(io.BytesIO(raw)) or ""
-    except Exception as e:
-        log.warning("PDF extract failed: %s", e)
-        return ""
-    
-
-
-def _extract_text_from_docx_bytes(raw: bytes) -> str:
-    # python-docx
-    try:
-        doc = docx.Document(io.BytesIO(raw))
-        parts = []
-        # paragraphs
-        for p in doc.paragraphs:
-            t = (p.text or "").strip()
-            if t:
-                parts.append(t)
-        # tables (cells)
-        for tbl in getattr(doc, "tables", []):
-            for row in tbl.rows:
-                for cell in row.cells:
-                    t = (cell.text or "").strip()
-                    if t:
-                        parts.append(t)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("DOCX extract failed: %s", e)
-        return ""
-    
 @router.post("/v1/rag/fetch")
 async def rag_fetch(req: RagFetchRequest):
     """
     Ritorna il contenuto aggregato per documento (path) senza dover specificare una query utente.
     Usa internamente RagStore.search("", top_k=...) e filtra/accorpa lato router.
     """
-    store = RagStore(project_id=req.project_id)
+    store = open_store(req.project_id)
 
     # 1) Peschiamo tanti chunk neutrali (query vuota / "context")
     #    Nota: se il tuo RagStore non gestisce bene query vuota, prova con "context" o "*"
@@ -210,93 +177,9 @@ async def rag_fetch(req: RagFetchRequest):
 
     return {"docs": docs, "count": len(docs)}
 
-def _extract_text_from_xlsx_bytes(raw: bytes) -> str:
-    if not openpyxl:
-        log.warning("openpyxl non disponibile: skip xlsx")
-        return ""
-    try:
-        wb = openpyxl.load_workbook(io.BytesIO(raw), data_only=True, read_only=True)
-        parts = []
-        for ws in wb.worksheets:
-            parts.append(f"# Sheet: {ws.title}")
-            for row in ws.iter_rows(values_only=True):
-                cells = [str(c) if c is not None else "" for c in row]
-                line = "\t".join(cells).strip()
-                if line:
-                    parts.append(line)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("XLSX extract failed: %s", e)
-        return ""
-
-def _extract_text_from_xls_bytes(raw: bytes) -> str:
-    # Richiede xlrd>=2.0 (legge solo .xls)
-    if not xlrd:
-        log.warning("xlrd non disponibile: skip xls")
-        return ""
-    try:
-        book = xlrd.open_workbook(file_contents=raw)
-        parts = []
-        for si in range(book.nsheets):
-            sh = book.sheet_by_index(si)
-            parts.append(f"# Sheet: {sh.name}")
-            for r in range(sh.nrows):
-                row = [str(sh.cell_value(r, c)) for c in range(sh.ncols)]
-                line = "\t".join(row).strip()
-                if line:
-                    parts.append(line)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("XLS extract failed: %s", e)
-        return ""
-
-def _extract_text_from_xlsb_bytes(raw: bytes) -> str:
-    if not open_xlsb:
-        log.warning("pyxlsb non disponibile: skip xlsb")
-        return ""
-    try:
-        parts = []
-        with open_xlsb(io.BytesIO(raw)) as wb:
-            for sheet_name in wb.sheets:
-                parts.append(f"# Sheet: {sheet_name}")
-                with wb.get_sheet(sheet_name) as sh:
-                    for row in sh.rows():
-                        vals = [str(c.v) if c.v is not None else "" for c in row]
-                        line = "\t".join(vals).strip()
-                        if line:
-                            parts.append(line)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("XLSB extract failed: %s", e)
-        return ""
-
-def _extract_text_from_pptx_bytes(raw: bytes) -> str:
-    if not Presentation:
-        log.warning("python-pptx non disponibile: skip pptx")
-        return ""
-    try:
-        prs = Presentation(io.BytesIO(raw))
-        parts = []
-        for i, slide in enumerate(prs.slides, start=1):
-            parts.append(f"# Slide {i}")
-            for shape in slide.shapes:
-                if hasattr(shape, "text_frame") and shape.text_frame:
-                    for para in shape.text_frame.paragraphs:
-                        text = "".join(run.text or "" for run in para.runs).strip()
-                        if text:
-                            parts.append(text)
-                elif hasattr(shape, "text") and shape.text:
-                    t = (shape.text or "").strip()
-                    if t:
-                        parts.append(t)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("PPTX extract failed: %s", e)
-        return ""
-
 @router.post("/v1/rag/fetch_by_paths")
 async def rag_fetch_by_paths(req: RagFetchByPathsRequest):
-    store = RagStore(project_id=req.project_id)
+    store = open_store(req.project_id)
     log.info("RAG Store %s", store)
     # query neutra + filtro per path(s) lato router
     raw_hits = await store.search("", top_k=max(10, req.search_top_k))
@@ -311,8 +194,10 @@ async def rag_fetch_by_paths(req: RagFetchByPathsRequest):
     return {"docs": docs, "count": len(docs)}
 
 @router.post("/v1/rag/reindex")
-async def rag_index(req: RagIndexRequest):
-    return rag_index(req)
+async def rag_reindex(req: RagIndexRequest):
+    # re-index completo del progetto: incrementale + rimozione dei path non più presenti
+    req.prune = True
+    return await rag_index(req)
 
 @router.post("/v1/rag/index")
 async def rag_index(req: RagIndexRequest):
@@ -325,7 +210,7 @@ async def rag_index(req: RagIndexRequest):
     #     raise HTTPException(500, detail=out.get("error","index failed"))
     # return out
    
-    store = RagStore(project_id=req.project_id)
+    store = open_store(req.project_id)
     log.info("RAG Store %s", store)
     log.info("RAG index %d items", len(req.items))
 
@@ -339,33 +224,13 @@ async def rag_index(req: RagIndexRequest):
         if not txt and b64:
             raw = _b64_to_bytes(b64)
             if raw:
-                ext = _ext_from_path(p)
-                if ext == ".pdf":
-                    log.info("RAG index: PDF")
-                    txt = _extract_text_from_pdf_bytes(raw)
-                elif ext == ".docx":
-                    log.info("RAG index: DOCX")
-                    txt = _extract_text_from_docx_bytes(raw)
-                elif ext == ".xlsx":
-                    log.info("inline: XLSX")
-                    txt = _extract_text_from_xlsx_bytes(raw)
-                elif ext == ".xls":
-                    log.info("inline: XLS (legacy)")
-                    txt = _extract_text_from_xls_bytes(raw)
-                elif ext == ".xlsb":
-                    log.info("inline: XLSB")
-                    txt = _extract_text_from_xlsb_bytes(raw)
-                elif ext == ".pptx":
-                    log.info("inline: PPTX")
-                    txt = _extract_text_from_pptx_bytes(raw)
-                else:
-                    # fallback: se è testo “grezzo” o sconosciuto, prova a decodare come utf-8
-                    try:
-                        txt = raw.decode("utf-8", errors="ignore")
-                    except Exception:
-                        txt = ""
-                
+                # testo in cache per sha256 del contenuto: estrazione (process pool) una volta sola
+                txt = await attachment_text(p, raw=raw) or ""
                 log.info("RAG file %s -> %d chars", p, len(txt))
+        elif not txt and it.blob:
+            # caricato una volta su /v1/blobs: riferimento per handle, niente base64
+            txt = await attachment_text(p, handle=it.blob) or ""
+            log.info("RAG blob %s -> %d chars", p, len(txt))
 
         if isinstance(txt, str) and txt.strip():
             docs.append({"path": p or "doc", "text": txt.strip()})
@@ -375,7 +240,7 @@ async def rag_index(req: RagIndexRequest):
         log.info("RAG index: no indexable docs")
         return {"ok": True, "count": 0}
 
-    out = await store.index_texts(docs)
+    out = await store.index_texts(docs, incremental=req.incremental, prune=req.prune)
     log.info("RAG out %s", out)
     if not out.get("ok"):
         raise HTTPException(500, detail=out.get("error", "index failed"))
@@ -384,13 +249,13 @@ async def rag_index(req: RagIndexRequest):
 
 @router.post("/v1/rag/search")
 async def rag_search(req: RagSearchRequest):
-    store = RagStore(project_id=req.project_id)
+    store = open_store(req.project_id)
     hits = await store.search(req.query, top_k=req.top_k)
     return {"hits": hits}
 
 @router.post("/v1/rag/purge")
 async def rag_purge(req: RagPurgeRequest):
-    store = RagStore(project_id=req.project_id)
+    store = open_store(req.project_id)
     out = await store.purge(req.path_prefix)
     if not out.get("ok"):
         raise HTTPException(500, detail=out.get("error","purge failed"))
@@ -1,13 +1,17 @@
 # orchestrator/app/routes_eval.py
 import os
 import re
+import json
+import queue
+import threading
 from fastapi import APIRouter, Body, Query, HTTPException
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from pathlib import Path
-from typing import Any, Dict, Optional, List
+from typing import Any, Callable, Dict, Optional, List
 import logging
 
-from eval_runner import EvalRunner, EvalReport  # vedi PATCH 2
+from eval_runner import EvalCase, EvalRunner, EvalReport  # vedi PATCH 2
 
 router = APIRouter()
 log = logging.getLogger("routes_eval")
@@ -102,6 +106,39 @@ def _merge_args_check(profile_q: Optional[str], project_root_q: Optional[str], p
     log.info("*** _merge_args runRequest=%s", runRequest)
 
     return runRequest
+def _case_dict(c: EvalCase) -> Dict[str, Any]:
+    return {"name": c.name, "passed": c.passed, "code": c.code, "stdout": c.stdout, "stderr": c.stderr,
+            "duration_ms": c.duration_ms}
+
+
+def _stream_run(runner: EvalRunner, run_kwargs: Dict[str, Any], summarize: Callable[[EvalReport], Dict[str, Any]]) -> StreamingResponse:
+    """
+    NDJSON: una riga {"type":"case",...} per caso appena concluso (ordine di completamento),
+    poi {"type":"report",...} con lo stesso payload della risposta non-stream (o {"type":"error"}).
+    """
+    q: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+
+    def _work():
+        try:
+            rep = runner.run_profile(**run_kwargs, on_case=lambda c: q.put({"type": "case", **_case_dict(c)}))
+            q.put({"type": "report", **summarize(rep)})
+        except Exception as e:
+            log.exception("eval stream unexpected")
+            q.put({"type": "error", "error": f"{type(e).__name__}: {e}"})
+        finally:
+            q.put(None)
+
+    threading.Thread(target=_work, name="eval-stream", daemon=True).start()
+
+    def _lines():
+        while True:
+            item = q.get()
+            if item is None:
+                return
+            yield json.dumps(item, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(_lines(), media_type="application/x-ndjson")
+
 # ------------------------------- /v1/eval/run -------------------------------
 @router.post("/v1/eval/run")
 def eval_run(
@@ -111,6 +148,7 @@ def eval_run(
     verdict: Optional[str] = Query(default=None),
     req_id: Optional[str] = Query(default=None),
     project_name: Optional[str] = Query(default=None),
+    stream: bool = Query(default=False, description="NDJSON: risultati parziali caso per caso"),
     payload: EvalRunRequest = Body(default=None)
 ):
     log.info("eval_run profile=%s project_root=%s mode=%s verdict=%s", profile, project_root, mode, verdict)
@@ -141,33 +179,33 @@ def eval_run(
     prj = prj if prj.is_absolute() else (Path.cwd() / prj).resolve()
    
     runner = EvalRunner(prj)
+    run_kwargs = dict(profile=args.profile, ltc=args.ltc, mode=args.mode, verdict=args.verdict, req_id=args.req_id)
+
+    def _summary(rep: EvalReport) -> Dict[str, Any]:
+        return {
+            "profile": rep.profile,
+            "req_id": rep.req_id,
+            "mode": rep.mode,
+            "passed": rep.failed == 0,
+            "failed": rep.failed,
+            "passed_count": rep.passed,
+            "junit": rep.junit_path,
+            "json": 'runs/eval/' + args.req_id,
+            "cases": [_case_dict(c) for c in rep.cases],
+        }
+
+    if stream:
+        return _stream_run(runner, run_kwargs, _summary)
 
     try:
-        rep: EvalReport =  runner.run_profile(
-            profile=args.profile,
-            ltc=args.ltc,
-            mode=args.mode,
-            verdict=args.verdict,
-            req_id=args.req_id,
-        )
+        rep: EvalReport =  runner.run_profile(**run_kwargs)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         log.exception("eval_run unexpected")
         raise HTTPException(status_code=500, detail=f"eval_run error: {e}")
 
-
-    return {
-        "profile": rep.profile,
-        "req_id": rep.req_id,
-        "mode": rep.mode,
-        "passed": rep.failed == 0,
-        "failed": rep.failed,
-        "passed_count": rep.passed,
-        "junit": rep.junit_path,
-        "json": 'runs/eval/' + args.req_id,
-        "cases": [{"name": c.name, "passed": c.passed, "code": c.code, "stdout": c.stdout, "stderr": c.stderr} for c in rep.cases],
-    }
+    return _summary(rep)
 
 # ------------------------------ /v1/gate/check ------------------------------
 @router.post("/v1/gate/check")
@@ -179,6 +217,7 @@ def gate_check(
     req_id: Optional[str] = Query(default=None),
     promote: Optional[bool] = Query(default=False),
     project_name: Optional[str] = Query(default=None),
+    stream: bool = Query(default=False, description="NDJSON: risultati parziali caso per caso"),
 
     payload: GateCheckRequest = Body(default=None),
 ):
@@ -195,36 +234,37 @@ def gate_check(
     
     prj = Path(args.project_root)
     runner = EvalRunner(prj)
+    run_kwargs = dict(ltc=args.ltc, profile=args.profile, mode=args.mode, verdict=args.verdict, req_id=args.req_id)
 
-    try:
-        rep: EvalReport = runner.run_profile(
-            ltc=args.ltc,
-            profile=args.profile,
-            mode=args.mode,
-            verdict=args.verdict,
-            req_id=args.req_id,
-        )
+    def _summary(rep: EvalReport) -> Dict[str, Any]:
         log.info("gate_check rep=%s", rep)
+        gate_result = "PASS" if rep.failed == 0 else "FAIL"
+
+        promote_info = None
+        log.info("gate_check rep mode=%s", rep.mode)
+
+        return {
+            "gate": gate_result,
+            "profile": rep.profile,
+            "req_id": rep.req_id,
+            "mode": rep.mode,
+            "passed": rep.passed,
+            "failed": rep.failed,
+            "passed_count": rep.passed,
+            "json": 'runs/gate/' + args.req_id,
+            "promote": bool(promote) if args.promote else None,
+            "promote_info": promote_info if args.promote else None,
+        }
+
+    if stream:
+        return _stream_run(runner, run_kwargs, _summary)
+
+    try:
+        rep: EvalReport = runner.run_profile(**run_kwargs)
     except FileNotFoundError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         log.exception("gate_check unexpected")
         raise HTTPException(status_code=500, detail=f"gate_check error: {e}")
-    log.info("gate_check rep=%s", rep)
-    gate_result = "PASS" if rep.failed == 0 else "FAIL"
-
-    promote_info = None
-    log.info("gate_check rep mode=%s", rep.mode)
-
-    return {
-        "gate": gate_result,
-        "profile": rep.profile,
-        "req_id": rep.req_id,
-        "mode": rep.mode,
-        "passed": rep.passed,
-        "failed": rep.failed,
-        "passed_count": rep.passed,
-        "json": 'runs/gate/' + args.req_id,
-        "promote": bool(promote) if args.promote else None,
-        "promote_info": promote_info if args.promote else None,
-    }
\ No newline at end of file
+
+    return _summary(rep)
\ No newline at end of file
@@ -12,12 +12,7 @@ from services.llm_client import call_gateway_chat, call_gateway_generate
 import time as _time
 from copy import deepcopy as _deepcopy
 from services.rag_store import RagStore
-import docx
-from pdfminer.high_level import extract_text
-import openpyxl  # .xlsx
-import xlrd  # .xls (legacy)
-from pyxlsb import open_workbook as open_xlsb  # .xlsb (optional)
-from pptx import Presentation  # .pptx
+from services.blob_store import attachment_text
 # --- Generated root selection -------------------------------------------------
 import uuid
 # compat: alcuni repo usano services.router, altri services.model_router
@@ -609,126 +604,10 @@ def _ext_from_path(p: str) -> str:
         return os.path.splitext((p or "").strip())[1].lower()
     except Exception:
         return ""
-# --- ADD: extraction helpers ---
-def _extract_text_from_pdf_bytes(raw: bytes) -> str:
-    # pdfminer.six
-    try:
-        return extract_text(io.BytesIO(raw)) or ""
-    except Exception as e:
-        log.warning("PDF extract failed: %s", e)
-        return ""
-    
-
-
-def _extract_text_from_docx_bytes(raw: bytes) -> str:
-    # python-docx
-    try:
-        doc = docx.Document(io.BytesIO(raw))
-        parts = []
-        # paragraphs
-        for p in doc.paragraphs:
-            t = (p.text or "").strip()
-            if t:
-                parts.append(t)
-        # tables (cells)
-        for tbl in getattr(doc, "tables", []):
-            for row in tbl.rows:
-                for cell in row.cells:
-                    t = (cell.text or "").strip()
-                    if t:
-                        parts.append(t)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("DOCX extract failed: %s", e)
-        return ""
-def _extract_text_from_xlsx_bytes(raw: bytes) -> str:
-    if not openpyxl:
-        log.warning("openpyxl non disponibile: skip xlsx")
-        return ""
-    try:
-        wb = openpyxl.load_workbook(io.BytesIO(raw), data_only=True, read_only=True)
-        parts = []
-        for ws in wb.worksheets:
-            parts.append(f"# Sheet: {ws.title}")
-            for row in ws.iter_rows(values_only=True):
-                cells = [str(c) if c is not None else "" for c in row]
-                line = "\t".join(cells).strip()
-                if line:
-                    parts.append(line)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("XLSX extract failed: %s", e)
-        return ""
-
-def _extract_text_from_xls_bytes(raw: bytes) -> str:
-    # Richiede xlrd>=2.0 (legge solo .xls)
-    if not xlrd:
-        log.warning("xlrd non disponibile: skip xls")
-        return ""
-    try:
-        book = xlrd.open_workbook(file_contents=raw)
-        parts = []
-        for si in range(book.nsheets):
-            sh = book.sheet_by_index(si)
-            parts.append(f"# Sheet: {sh.name}")
-            for r in range(sh.nrows):
-                row = [str(sh.cell_value(r, c)) for c in range(sh.ncols)]
-                line = "\t".join(row).strip()
-                if line:
-                    parts.append(line)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("XLS extract failed: %s", e)
-        return ""
-
-def _extract_text_from_xlsb_bytes(raw: bytes) -> str:
-    if not open_xlsb:
-        log.warning("pyxlsb non disponibile: skip xlsb")
-        return ""
-    try:
-        parts = []
-        with open_xlsb(io.BytesIO(raw)) as wb:
-            for sheet_name in wb.sheets:
-                parts.append(f"# Sheet: {sheet_name}")
-                with wb.get_sheet(sheet_name) as sh:
-                    for row in sh.rows():
-                        vals = [str(c.v) if c.v is not None else "" for c in row]
-                        line = "\t".join(vals).strip()
-                        if line:
-                            parts.append(line)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("XLSB extract failed: %s", e)
-        return ""
-
-def _extract_text_from_pptx_bytes(raw: bytes) -> str:
-    if not Presentation:
-        log.warning("python-pptx non disponibile: skip pptx")
-        return ""
-    try:
-        prs = Presentation(io.BytesIO(raw))
-        parts = []
-        for i, slide in enumerate(prs.slides, start=1):
-            parts.append(f"# Slide {i}")
-            for shape in slide.shapes:
-                if hasattr(shape, "text_frame") and shape.text_frame:
-                    for para in shape.text_frame.paragraphs:
-                        text = "".join(run.text or "" for run in para.runs).strip()
-                        if text:
-                            parts.append(text)
-                elif hasattr(shape, "text") and shape.text:
-                    t = (shape.text or "").strip()
-                    if t:
-                        parts.append(t)
-        return "\n".join(parts)
-    except Exception as e:
-        log.warning("PPTX extract failed: %s", e)
-        return ""
-
 async def decide_inline_or_rag(attachments: list[dict]) -> tuple[list[dict], list[dict]]:
     """
     Allineato all'estensione (partitionAttachments):
-      - inline se a.content o a.bytes_b64 presenti
+      - inline se a.content, a.bytes_b64 o a.blob (handle del blob store) presenti
       - altrimenti, se a.path presente => RAG by path
       - altrimenti ignora (log warning)
     Niente soglie di size, niente budget qui (per coerenza end-to-end).
@@ -746,6 +625,7 @@ async def decide_inline_or_rag(attachments: list[dict]) -> tuple[list[dict], lis
         origin = a.get("origin") or a.get("source")  # normalizza
         content    = a.get("content")
         bytes_b64  = a.get("bytes_b64")
+        blob       = a.get("blob")
 
         # Nota: evitiamo di loggare la base64 (solo boolean), per non intasare i log
         log.info("decide inline or rag: %s",
@@ -753,49 +633,32 @@ async def decide_inline_or_rag(attachments: list[dict]) -> tuple[list[dict], lis
                      "name": name,
                      "has_content": bool(content),
                      "has_bytes_b64": bool(bytes_b64),
+                     "blob": blob,
                      "path": path,
                      "origin": origin
                  }, ensure_ascii=False))
 
-        if content or bytes_b64:
+        if content or bytes_b64 or blob:
             # Inline esattamente come fa l’estensione
+            txt = None
             if bytes_b64:
                 raw = _b64_to_bytes(bytes_b64)
                 if raw:
-                    ext = _ext_from_path(path)
-                    if ext == ".pdf":
-                        log.info("inline: PDF")
-                        txt = _extract_text_from_pdf_bytes(raw)
-                    elif ext == ".docx":
-                        log.info("inline DOCX")
-                        txt = _extract_text_from_docx_bytes(raw)
-                    elif ext == ".xlsx":
-                        log.info("inline: XLSX")
-                        txt = _extract_text_from_xlsx_bytes(raw)
-                    elif ext == ".xls":
-                        log.info("inline: XLS (legacy)")
-                        txt = _extract_text_from_xls_bytes(raw)
-                    elif ext == ".xlsb":
-                        log.info("inline: XLSB")
-                        txt = _extract_text_from_xlsb_bytes(raw)
-                    elif ext == ".pptx":
-                        log.info("inline: PPTX")
-                        txt = _extract_text_from_pptx_bytes(raw)
-                    else:
-                        # fallback: se è testo “grezzo” o sconosciuto, prova a decodare come utf-8
-                        try:
-                            txt = raw.decode("utf-8", errors="ignore")
-                        except Exception:
-                            txt = ""
-                  
-                    log.info("inline file %s -> %d chars", path, len(txt))
-                    content = txt
+                    # testo in cache per sha256 del contenuto: estrazione (process pool) una volta sola
+                    txt = await attachment_text(path, raw=raw)
+            elif blob and not content:
+                # caricato una volta su /v1/blobs: riferimento per handle, niente base64
+                txt = await attachment_text(path, handle=blob)
+            if txt is not None:
+                log.info("inline file %s -> %d chars", path, len(txt))
+                content = txt
 
             inline.append({
                 "name": name,
                 "path": path,          # opzionale (può servire per tracciabilità)
                 "content": content,    # può essere None
                 "bytes_b64": bytes_b64,# può essere None
+                "blob": blob,          # può essere None
                 "origin": origin
             })
         elif path:
@@ -24,6 +24,7 @@ class Attachment(BaseModel):
     size: Optional[int] = None
     content: Optional[str] = None
     bytes_b64: Optional[str] = None
+    blob: Optional[str] = None  # "sha256:<hex>" handle from POST /v1/blobs (instead of bytes_b64)
                
 
 # --- NEW/UPDATED: options in input for /kit ---
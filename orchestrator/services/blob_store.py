@@ -0,0 +1,301 @@
+# orchestrator/services/blob_store.py
+"""
+Blob store content-addressed per gli allegati: upload una volta, poi riferimento per handle.
+
+- Layout su disco (BLOB_STORE_DIR, sul volume /workspace condiviso da gateway e orchestrator):
+    <root>/sha256/ab/<sha256>           byte originali
+    <root>/text/ab/<sha256><ext>.txt    testo estratto (per estensione: l'estrattore dipende dal tipo)
+- put_stream(): upload binario in streaming su file temporaneo con hash incrementale, poi rename
+  atomico sul path del contenuto; se il blob esiste già il temporaneo viene scartato (dedup).
+- Handle "sha256:<hex>" (accettato anche l'hex nudo): attachments/rag_files/RagIndexItem possono
+  passare {"blob": handle} al posto di bytes_b64 → niente base64 (+33%) a ogni fase Harper.
+- attachment_text(): testo estratto in cache per hash. Anche gli allegati legacy in bytes_b64
+  passano da qui (sha256 dei byte decodificati): l'estrazione avviene una volta per contenuto.
+- Retention: l'mtime di blob e testi è l'ultimo uso (upload anche deduplicato, HEAD/GET, lettura
+  del testo). Un task in background (BLOB_SWEEP_INTERVAL_S, 0 = spento) rimuove quelli non usati
+  da BLOB_RETENTION_DAYS e i temporanei di upload interrotti; gira in entrambi i servizi, è
+  idempotente sul volume condiviso.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import tempfile
+import time
+from typing import Any, AsyncIterator, Dict, Optional
+
+from services.extraction import EXTRACTORS, _ext_from_path, extract_text
+
+log = logging.getLogger("rag.blob_store")
+
+BLOB_STORE_DIR = os.getenv("BLOB_STORE_DIR", "/workspace/.cache/blobs")
+BLOB_MAX_MB = int(os.getenv("BLOB_MAX_MB", "200"))
+BLOB_RETENTION_DAYS = float(os.getenv("BLOB_RETENTION_DAYS", "30"))
+BLOB_SWEEP_INTERVAL_S = float(os.getenv("BLOB_SWEEP_INTERVAL_S", "3600"))
+TMP_MAX_AGE_S = 24 * 3600      # upload interrotti (processo morto a metà)
+TOUCH_MIN_S = 3600             # al più un utime all'ora per file: niente scrittura di metadati a ogni uso
+WRITE_BUFFER = 1024 * 1024     # put_stream: scritture su disco a blocchi, in thread
+
+_HEX = re.compile(r"^[0-9a-f]{64}$")
+
+
+class BlobTooLarge(Exception):
+    pass
+
+
+def parse_handle(handle: Any) -> Optional[str]:
+    """'sha256:<hex>' | '<hex>' → hex minuscolo; None se non è un handle valido."""
+    if not isinstance(handle, str):
+        return None
+    h = handle.strip().lower()
+    if h.startswith("sha256:"):
+        h = h[len("sha256:"):]
+    return h if _HEX.match(h) else None
+
+
+def handle_of(sha: str) -> str:
+    return f"sha256:{sha}"
+
+
+class BlobStore:
+    def __init__(self, root: str = BLOB_STORE_DIR, *, max_mb: int = BLOB_MAX_MB):
+        self.root = root
+        self.max_bytes = max(1, int(max_mb)) * 1024 * 1024
+        self.puts = 0
+        self.dedup = 0
+        self.text_hits = 0
+        self.text_misses = 0
+        self.swept = 0
+        self.swept_bytes = 0
+        self.last_sweep: Optional[float] = None
+
+    def blob_path(self, sha: str) -> str:
+        return os.path.join(self.root, "sha256", sha[:2], sha)
+
+    def text_path(self, sha: str, ext: str) -> str:
+        return os.path.join(self.root, "text", sha[:2], f"{sha}{ext}.txt")
+
+    def exists(self, sha: str) -> bool:
+        return os.path.isfile(self.blob_path(sha))
+
+    def size(self, sha: str) -> Optional[int]:
+        try:
+            return os.path.getsize(self.blob_path(sha))
+        except OSError:
+            return None
+
+    def read(self, sha: str) -> Optional[bytes]:
+        try:
+            with open(self.blob_path(sha), "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        self.touch(sha)
+        return data
+
+    @staticmethod
+    def _touch_path(path: str) -> None:
+        try:
+            if time.time() - os.path.getmtime(path) > TOUCH_MIN_S:
+                os.utime(path)
+        except OSError:
+            pass
+
+    def touch(self, sha: str) -> None:
+        """Segna il blob come usato ora (la retention conta dall'mtime)."""
+        self._touch_path(self.blob_path(sha))
+
+    def _tmp(self) -> tuple:
+        d = os.path.join(self.root, "tmp")
+        os.makedirs(d, exist_ok=True)
+        return tempfile.mkstemp(dir=d, prefix="up-")
+
+    def _commit(self, tmp: str, sha: str, size: int) -> Dict[str, Any]:
+        dst = self.blob_path(sha)
+        if os.path.exists(dst):
+            os.unlink(tmp)
+            self.touch(sha)
+            self.dedup += 1
+            created = False
+        else:
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            os.replace(tmp, dst)
+            self.puts += 1
+            created = True
+        return {"handle": handle_of(sha), "sha256": sha, "size": size, "created": created}
+
+    async def put_stream(self, chunks: AsyncIterator[bytes]) -> Dict[str, Any]:
+        """
+        Scrive il body a chunk hashando in linea; BlobTooLarge oltre BLOB_MAX_MB.
+        Hash e I/O su disco a blocchi di WRITE_BUFFER in un thread: l'event loop fa solo da buffer.
+        """
+        fd, tmp = await asyncio.to_thread(self._tmp)
+        h = hashlib.sha256()
+        n = 0
+
+        def flush(f, data: bytes) -> None:
+            h.update(data)
+            f.write(data)
+
+        try:
+            with os.fdopen(fd, "wb") as f:
+                buf = bytearray()
+                async for chunk in chunks:
+                    if not chunk:
+                        continue
+                    n += len(chunk)
+                    if n > self.max_bytes:
+                        raise BlobTooLarge(f"blob larger than {self.max_bytes} bytes")
+                    buf += chunk
+                    if len(buf) >= WRITE_BUFFER:
+                        await asyncio.to_thread(flush, f, bytes(buf))
+                        buf.clear()
+                if buf:
+                    await asyncio.to_thread(flush, f, bytes(buf))
+            return await asyncio.to_thread(self._commit, tmp, h.hexdigest(), n)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def put_bytes(self, raw: bytes) -> Dict[str, Any]:
+        if len(raw) > self.max_bytes:
+            raise BlobTooLarge(f"blob larger than {self.max_bytes} bytes")
+        fd, tmp = self._tmp()
+        with os.fdopen(fd, "wb") as f:
+            f.write(raw)
+        return self._commit(tmp, hashlib.sha256(raw).hexdigest(), len(raw))
+
+    async def text_for(self, sha: str, path: Optional[str], raw: Optional[bytes] = None) -> Optional[str]:
+        """Testo estratto per (sha, estensione di path); None se il blob non esiste."""
+        ext = _ext_from_path(path)
+        cacheable = ext in EXTRACTORS  # testo semplice: decodifica immediata, niente cache
+        tp = self.text_path(sha, ext)
+        if cacheable:
+            try:
+                with open(tp, "r", encoding="utf-8") as f:
+                    txt = f.read()
+                self.text_hits += 1
+                self._touch_path(tp)
+                self.touch(sha)
+                return txt
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                log.warning("blob text cache read failed %s: %s", tp, e)
+            self.text_misses += 1
+        if raw is None:
+            raw = await asyncio.to_thread(self.read, sha)
+            if raw is None:
+                return None
+        txt = await extract_text(path, raw)
+        if cacheable and txt:  # "" = estrazione fallita/scaduta: si riprova alla prossima richiesta
+            try:
+                os.makedirs(os.path.dirname(tp), exist_ok=True)
+                tmp = f"{tp}.{os.getpid()}.tmp"
+                with open(tmp, "w", encoding="utf-8") as f:
+                    f.write(txt)
+                os.replace(tmp, tp)
+            except Exception as e:
+                log.warning("blob text cache write failed %s: %s", tp, e)
+        return txt
+
+    def sweep(self, max_age_s: float) -> Dict[str, int]:
+        """Rimuove blob/testi non usati da max_age_s e i temporanei di upload più vecchi di un giorno."""
+        now = time.time()
+        out = {"blobs": 0, "texts": 0, "tmp": 0, "bytes": 0}
+        for kind, sub, age in (("blobs", "sha256", max_age_s), ("texts", "text", max_age_s),
+                               ("tmp", "tmp", TMP_MAX_AGE_S)):
+            cutoff = now - age
+            for dirpath, _dirs, files in os.walk(os.path.join(self.root, sub)):
+                for fn in files:
+                    p = os.path.join(dirpath, fn)
+                    try:
+                        st = os.stat(p)
+                        if st.st_mtime >= cutoff:
+                            continue
+                        os.unlink(p)
+                    except OSError:
+                        continue  # rimosso dall'altro servizio o in uso
+                    out[kind] += 1
+                    out["bytes"] += st.st_size
+        self.swept += out["blobs"] + out["texts"]
+        self.swept_bytes += out["bytes"]
+        self.last_sweep = now
+        if any(out[k] for k in ("blobs", "texts", "tmp")):
+            log.info("blob sweep removed blobs=%d texts=%d tmp=%d (%d bytes)",
+                     out["blobs"], out["texts"], out["tmp"], out["bytes"])
+        return out
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "root": self.root,
+            "puts": self.puts,
+            "dedup": self.dedup,
+            "text_hits": self.text_hits,
+            "text_misses": self.text_misses,
+            "retention_days": BLOB_RETENTION_DAYS,
+            "swept": self.swept,
+            "swept_bytes": self.swept_bytes,
+            "last_sweep": self.last_sweep,
+        }
+
+
+_STORE: Optional[BlobStore] = None
+
+
+def store() -> BlobStore:
+    global _STORE
+    if _STORE is None:
+        _STORE = BlobStore()
+    return _STORE
+
+
+_SWEEP_TASK: Optional[asyncio.Task] = None
+
+
+async def _sweep_loop() -> None:
+    while True:
+        try:
+            await asyncio.to_thread(store().sweep, BLOB_RETENTION_DAYS * 86400)
+        except Exception as e:
+            log.warning("blob sweep failed: %s", e)
+        await asyncio.sleep(BLOB_SWEEP_INTERVAL_S)
+
+
+async def startup() -> None:
+    global _SWEEP_TASK
+    if BLOB_SWEEP_INTERVAL_S > 0 and BLOB_RETENTION_DAYS > 0 and _SWEEP_TASK is None:
+        _SWEEP_TASK = asyncio.create_task(_sweep_loop(), name="blob-sweep")
+
+
+async def shutdown() -> None:
+    global _SWEEP_TASK
+    if _SWEEP_TASK is not None:
+        _SWEEP_TASK.cancel()
+        await asyncio.gather(_SWEEP_TASK, return_exceptions=True)
+        _SWEEP_TASK = None
+
+
+async def attachment_text(path: Optional[str], *, raw: Optional[bytes] = None,
+                          handle: Optional[str] = None) -> Optional[str]:
+    """
+    Testo di un allegato dato per byte (legacy bytes_b64) o per handle del blob store.
+    None se l'handle non è valido o il blob non è presente.
+    """
+    s = store()
+    if raw is not None:
+        return await s.text_for(hashlib.sha256(raw).hexdigest(), path, raw=raw)
+    sha = parse_handle(handle)
+    if not sha:
+        log.warning("attachment %s: invalid blob handle %r", path, handle)
+        return None
+    txt = await s.text_for(sha, path)
+    if txt is None:
+        log.warning("attachment %s: blob %s not found", path, sha[:12])
+    return txt
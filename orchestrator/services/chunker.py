@@ -0,0 +1,230 @@
+# orchestrator/services/chunker.py
+# Chunking RAG structure-aware: spezza sui confini naturali del contenuto
+# (simboli Python via AST, nodi top-level TS via tree-sitter, heading markdown,
+# dichiarazioni a colonna 0 per gli altri linguaggi, paragrafi per il testo)
+# e impacchetta i pezzi fino al budget in token. Solo i pezzi più grandi del budget
+# vengono ri-spezzati (sotto-simboli → paragrafi → righe con overlap).
+
+from __future__ import annotations
+import os, re, logging
+from functools import lru_cache
+from typing import Callable, List, Optional
+
+from services.splitter import python_symbol_spans, ts_top_level_spans
+
+log = logging.getLogger("rag_chunker")
+
+# ----------------------------- token sizing -----------------------------------
+
+@lru_cache(maxsize=1)
+def _encoder():
+    # tiktoken opzionale: se assente si usa la stima ~4 char/token
+    try:
+        import tiktoken  # type: ignore
+        return tiktoken.get_encoding(os.getenv("RAG_TOKENIZER", "cl100k_base"))
+    except Exception:
+        return None
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoder()
+    if enc is not None:
+        try:
+            return len(enc.encode(text, disallowed_special=()))
+        except Exception:
+            pass
+    return (len(text) + 3) // 4
+
+# ----------------------------- segmentazione ----------------------------------
+
+def _cut_at_lines(text: str, starts: List[int]) -> List[str]:
+    """Taglia 'text' all'inizio delle righe indicate (0-based); la concatenazione resta uguale a 'text'."""
+    lines = text.splitlines(keepends=True)
+    cuts = sorted({s for s in starts if 0 < s < len(lines)})
+    out, prev = [], 0
+    for c in cuts + [len(lines)]:
+        seg = "".join(lines[prev:c])
+        if seg:
+            out.append(seg)
+        prev = c
+    return out
+
+def _attach_comments(lines: List[str], start: int, prefix: str = "#") -> int:
+    # commenti immediatamente sopra un simbolo restano con il simbolo
+    while start > 0 and lines[start - 1].lstrip().startswith(prefix):
+        start -= 1
+    return start
+
+def _paragraphs(text: str) -> List[str]:
+    parts = re.split(r"(\n[ \t]*\n)", text)
+    out: List[str] = []
+    for i in range(0, len(parts), 2):
+        seg = parts[i] + (parts[i + 1] if i + 1 < len(parts) else "")
+        if seg:
+            out.append(seg)
+    return out
+
+def _python_pieces(text: str) -> Optional[List[str]]:
+    spans = python_symbol_spans(text)
+    if spans is None:
+        return None
+    lines = text.splitlines(keepends=True)
+    starts: List[int] = []
+    for _name, kind, start, end in spans:
+        if kind == "method":
+            continue
+        starts.append(_attach_comments(lines, start - 1))
+        starts.append(end)  # codice di modulo dopo il simbolo = pezzo a parte
+    return _cut_at_lines(text, starts)
+
+_PY_MEMBER_RE = re.compile(r"^([ \t]+)(?:@|def\s|async\s+def\s|class\s)")
+
+def _python_refine(piece: str) -> List[str]:
+    # classe troppo grande: taglia sui membri al primo livello di indentazione
+    lines = piece.splitlines(keepends=True)
+    hits = [(i, len(m.group(1))) for i, l in enumerate(lines) if (m := _PY_MEMBER_RE.match(l))]
+    if not hits:
+        return _paragraphs(piece)
+    indent = min(ind for _, ind in hits)
+    starts, prev_deco = [], False
+    for i, ind in hits:
+        if ind != indent:
+            continue
+        is_deco = lines[i].lstrip().startswith("@")
+        if not prev_deco:
+            starts.append(_attach_comments(lines, i))
+        prev_deco = is_deco
+    return _cut_at_lines(piece, starts)
+
+_MD_HEADING_RE = re.compile(r"^#{1,6}\s")
+_MD_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+
+def _markdown_pieces(text: str) -> List[str]:
+    starts, in_fence = [], False
+    for i, line in enumerate(text.splitlines()):
+        if _MD_FENCE_RE.match(line):
+            in_fence = not in_fence
+        elif not in_fence and _MD_HEADING_RE.match(line):
+            starts.append(i)
+    return _cut_at_lines(text, starts)
+
+def _ts_pieces(text: str) -> Optional[List[str]]:
+    spans = ts_top_level_spans(text)
+    if not spans:
+        return None
+    raw = text.encode("utf-8")
+    cuts = sorted({s for _t, s, _e in spans if 0 < s < len(raw)})
+    out, prev = [], 0
+    for c in cuts + [len(raw)]:
+        seg = raw[prev:c].decode("utf-8", "ignore")
+        if seg:
+            out.append(seg)
+        prev = c
+    return out
+
+_DECL_RE = re.compile(
+    r"^(?:export\s+)?(?:default\s+)?(?:public\s+|private\s+|protected\s+|abstract\s+|final\s+|static\s+|async\s+)*"
+    r"(?:function|class|interface|type|enum|const|let|var|func|fn|impl|struct|trait|mod|def|package|namespace|record)\b"
+)
+
+def _decl_pieces(text: str) -> List[str]:
+    # linguaggi senza parser: confini sulle dichiarazioni a colonna 0
+    lines = text.splitlines(keepends=True)
+    starts = [_attach_comments(lines, i, "//") for i, l in enumerate(lines) if _DECL_RE.match(l)]
+    return _cut_at_lines(text, starts)
+
+_CODE_EXTS = {".js",".jsx",".ts",".tsx",".java",".go",".rs",".cpp",".c",".h",".cs",".kt",".php",".rb",".proto",".sql"}
+_TS_EXTS = {".ts",".tsx",".js",".jsx"}
+_MD_EXTS = {".md",".markdown",".mdx"}
+
+# ----------------------------- packing ----------------------------------------
+
+def _split_lines(text: str, budget: int, overlap: int) -> List[str]:
+    """Ultima risorsa: righe fino al budget, con 'overlap' token di righe ripetute nel chunk successivo."""
+    out: List[str] = []
+    cur: List[str] = []
+    cur_tok = 0
+    for line in text.splitlines(keepends=True):
+        n = count_tokens(line)
+        if n > budget:
+            # riga enorme (minified/json): taglio per caratteri
+            if cur:
+                out.append("".join(cur)); cur, cur_tok = [], 0
+            step = max(1, int(len(line) * budget / n))
+            out.extend(line[i:i + step] for i in range(0, len(line), step))
+            continue
+        if cur and cur_tok + n > budget:
+            out.append("".join(cur))
+            tail: List[str] = []
+            tail_tok = 0
+            for prev in reversed(cur):
+                t = count_tokens(prev)
+                if tail_tok + t > overlap:
+                    break
+                tail.insert(0, prev); tail_tok += t
+            cur, cur_tok = tail, tail_tok
+        cur.append(line); cur_tok += n
+    if cur:
+        out.append("".join(cur))
+    return out
+
+def _pack(pieces: List[str], budget: int, overlap: int, refine: Callable[[str], List[str]]) -> List[str]:
+    out: List[str] = []
+    cur: List[str] = []
+    cur_tok = 0
+
+    def _flush():
+        nonlocal cur, cur_tok
+        if cur:
+            out.append("".join(cur))
+        cur, cur_tok = [], 0
+
+    for p in pieces:
+        n = count_tokens(p)
+        if n > budget:
+            _flush()
+            sub = refine(p)
+            if len(sub) > 1:
+                out.extend(_pack(sub, budget, overlap, _paragraphs))
+            else:
+                out.extend(_split_lines(p, budget, overlap))
+            continue
+        if cur and cur_tok + n > budget:
+            _flush()
+        cur.append(p); cur_tok += n
+    _flush()
+    return out
+
+# ----------------------------- API --------------------------------------------
+
+def chunk_text(text: str, path: str = "", tokens: int = 800, overlap: int = 80) -> List[str]:
+    """
+    Chunk strutturali per 'path' (estensione → strategia), ciascuno ≤ 'tokens' token
+    (salvo righe singole più grandi, tagliate per caratteri). Chunk vuoti scartati.
+    """
+    if not text or not text.strip():
+        return []
+    budget = max(32, int(tokens))
+    overlap = max(0, min(int(overlap), budget // 2))
+    ext = os.path.splitext((path or "").lower())[1]
+
+    pieces: Optional[List[str]] = None
+    refine: Callable[[str], List[str]] = _paragraphs
+    try:
+        if ext == ".py":
+            pieces = _python_pieces(text)
+            refine = _python_refine
+        elif ext in _MD_EXTS:
+            pieces = _markdown_pieces(text)
+        elif ext in _TS_EXTS:
+            pieces = _ts_pieces(text)
+        if pieces is None and ext in _CODE_EXTS | {".py"}:
+            pieces = _decl_pieces(text)
+    except Exception as e:
+        log.warning("structural split failed for %s: %s", path, e)
+        pieces = None
+    if pieces is None:
+        pieces = _paragraphs(text)
+
+    return [c for c in _pack(pieces, budget, overlap, refine) if c.strip()]
@@ -0,0 +1,91 @@
+# orchestrator/services/gateway_poller.py
+"""
+Stato del gateway letto in background per il router (salute provider, stats di routing).
+
+- Un solo httpx.AsyncClient condiviso verso GATEWAY_URL, aperto allo startup FastAPI.
+- Ogni GatewayPoller rilegge un endpoint JSON ogni interval_s in un task asyncio e passa
+  il payload a on_data; in caso di errore on_data riceve None (il chiamante decide il fallback).
+- Chi legge (router.resolve, sincrono) usa solo il valore in cache: nessuna I/O sul percorso
+  di routing, quindi run_phase non blocca l'event loop anche con il gateway lento o giù.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from config import settings
+
+log = logging.getLogger("router.gateway_poller")
+
+_client: Optional[httpx.AsyncClient] = None
+
+
+def client() -> httpx.AsyncClient:
+    global _client
+    if _client is None:
+        _client = httpx.AsyncClient(base_url=str(settings.GATEWAY_URL).rstrip("/"))
+    return _client
+
+
+class GatewayPoller:
+    def __init__(self, name: str, path: str, interval_s: float, timeout_s: float,
+                 on_data: Callable[[Optional[Dict[str, Any]]], None]):
+        self.name = name
+        self.path = path
+        self.interval_s = max(0.5, float(interval_s))
+        self.timeout_s = float(timeout_s)
+        self.on_data = on_data
+        self._task: Optional[asyncio.Task] = None
+
+    async def refresh(self) -> None:
+        try:
+            r = await client().get(self.path, timeout=self.timeout_s)
+            r.raise_for_status()
+            data = r.json() or {}
+        except Exception as e:
+            log.debug("%s unavailable: %s", self.name, e)
+            data = None
+        self.on_data(data)
+
+    async def _run(self) -> None:
+        while True:
+            await self.refresh()
+            await asyncio.sleep(self.interval_s)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run(), name=f"gateway-poll-{self.name}")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+_POLLERS: List[GatewayPoller] = []
+
+
+def register(poller: GatewayPoller) -> GatewayPoller:
+    _POLLERS.append(poller)
+    return poller
+
+
+async def startup() -> None:
+    for p in _POLLERS:
+        p.start()
+
+
+async def shutdown() -> None:
+    global _client
+    for p in _POLLERS:
+        await p.stop()
+    if _client is not None:
+        await _client.aclose()
+        _client = None
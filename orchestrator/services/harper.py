@@ -10,6 +10,7 @@ from datetime import datetime
 
 import httpx  # ensure available in requirements
 from services.router import select_model_for_phase, Task
+from utils import tracing
 
 GATEWAY_URL = os.environ.get("CL_GATEWAY_URL", "http://gateway:8000")
 log = logging.getLogger("orcehstrator:service:harper")
@@ -27,15 +28,19 @@ async def _post_json(path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
              bool(payload.get("idea_md")),
              len(payload.get("core") or []),
              len(payload.get("attachments") or []), start_time)
-    async with httpx.AsyncClient(timeout=TIMEOUT) as client:
-        r = await client.post(url, json=payload)
-        end_time = time.time()
-        elapsed_time = end_time - start_time
-        log.info(f"POST (elapsed): {elapsed_time:.4f} secondi.")
-
-
-        r.raise_for_status()
-        return r.json()
+    # span client: il gateway continua lo stesso trace (traceparent) e ci annida i suoi stage
+    with tracing.span("gateway.post", kind="client", path=path, phase=payload.get("phase"),
+                      model=payload.get("model"), run_id=payload.get("runId")) as sp:
+        async with httpx.AsyncClient(timeout=TIMEOUT) as client:
+            r = await client.post(url, json=payload, headers=tracing.inject())
+            end_time = time.time()
+            elapsed_time = end_time - start_time
+            sp.set(status_code=r.status_code)
+            log.info("POST (elapsed): %.4f secondi. trace_id=%s", elapsed_time, sp.trace_id)
+
+
+            r.raise_for_status()
+            return r.json()
     
 async def _normalize_message(msg: Dict[str, Any]) -> Dict[str, Any]:
     # --- Normalizzazione messages ---
@@ -102,7 +107,8 @@ async def run_phase(phase: str, req_payload: Dict[str, Any]) -> Dict[str, Any]:
     profile_hint = merged.get("profileHint")
 
     try:
-        model_id, profile_used = select_model_for_phase(task=phase, profile_hint=profile_hint, model_override=model_override)
+        with tracing.span("harper.routing", phase=phase, override=model_override):
+            model_id, profile_used = select_model_for_phase(task=phase, profile_hint=profile_hint, model_override=model_override)
         if model_id:
             merged["model"] = model_id
         # opzionale ma utile per telemetry
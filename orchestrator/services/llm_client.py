@@ -5,6 +5,7 @@ import httpx
 import logging
 from config import settings
 import time as _time
+from utils import tracing
 
 import  json, logging
 
@@ -63,7 +64,7 @@ async def call_gateway_chat_json(
 
     url = base_url.rstrip("/") + "/v1/chat/completions"
     async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(url, json=payload)
+        r = await client.post(url, json=payload, headers=tracing.inject())
         # Se il provider risponde 400/500, riporto il body per diagnosi chiare
         try:
             r.raise_for_status()
@@ -127,7 +128,7 @@ async def call_gateway_chat(
         headers["X-CLike-Provider"] = provider
         
     async with httpx.AsyncClient(timeout=to) as client:
-        r = await client.post(f"{base}/v1/chat/completions", json=body, headers=headers)
+        r = await client.post(f"{base}/v1/chat/completions", json=body, headers=tracing.inject(headers))
         r.raise_for_status()
         txt = r.text
             # Parse robusto
@@ -193,7 +194,7 @@ async def call_gateway_generate(payload: dict, _headers: dict) -> str:
     _t0 = _time.time()
     timeout = payload.get("timeout", float(getattr(settings, "REQUEST_TIMEOUT_S", 240)))
     async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post(f"{payload.get('base_url') or payload.get('base_url')}/v1/chat/completions", json=payload, headers=_headers)
+        r = await client.post(f"{payload.get('base_url') or payload.get('base_url')}/v1/chat/completions", json=payload, headers=tracing.inject(_headers))
         txt = r.text
         _ms = int((_time.time() - _t0) * 1000)
         data = {}
@@ -0,0 +1,77 @@
+# orchestrator/services/provider_health.py
+"""
+Vista (read-only) della salute dei provider per il router.
+
+Lo stato dei breaker vive nel gateway (l'unico che parla con i provider): un task di
+background (services.gateway_poller) rilegge GET {GATEWAY_URL}/health/providers ogni
+PROVIDER_HEALTH_TTL_S secondi con timeout corto; snapshot() restituisce solo la cache.
+Se il gateway non risponde (o prima del primo giro) tutti i modelli sono sani (fail-open).
+"""
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from services.gateway_poller import GatewayPoller, register
+
+log = logging.getLogger("router.provider_health")
+
+TTL_S = float(os.getenv("PROVIDER_HEALTH_TTL_S", "5"))
+TIMEOUT_S = float(os.getenv("PROVIDER_HEALTH_TIMEOUT_S", "1"))
+
+# stessi default del gateway (provider_health.DEFAULT_BASES)
+DEFAULT_BASES = {
+    "openai": os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1"),
+    "anthropic": os.getenv("ANTHROPIC_BASE_URL", "https://api.anthropic.com/v1"),
+    "deepseek": os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1"),
+    "vllm": os.getenv("VLLM_BASE_URL", "http://vllm:8000/v1"),
+    "ollama": os.getenv("OLLAMA_BASE_URL", "http://ollama:11434"),
+}
+
+_cache: Dict[str, Any] = {"origins": {}}
+
+
+def _origin(url: str) -> str:
+    # stessa normalizzazione di gateway/http_pool._origin
+    parts = urlsplit(url or "")
+    scheme = (parts.scheme or "http").lower()
+    host = (parts.hostname or "").lower()
+    port = parts.port or (443 if scheme == "https" else 80)
+    return f"{scheme}://{host}:{port}"
+
+
+def _on_data(data: Optional[Dict[str, Any]]) -> None:
+    origins: Dict[str, Dict[str, Any]] = {}
+    for p in (data or {}).get("providers") or []:
+        if p.get("origin"):
+            origins[p["origin"]] = p
+    _cache["origins"] = origins  # swap atomico: i lettori vedono il vecchio o il nuovo dict
+
+
+POLLER = register(GatewayPoller("provider_health", "/health/providers", TTL_S, TIMEOUT_S, _on_data))
+
+
+def snapshot() -> Dict[str, Dict[str, Any]]:
+    """origin -> stato breaker/EWMA (vuoto se il gateway non è raggiungibile). Mai bloccante."""
+    return _cache["origins"]
+
+
+def _state(m: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    base = m.get("base_url") or DEFAULT_BASES.get((m.get("provider") or "").lower()) or ""
+    return snapshot().get(_origin(base)) if base else None
+
+
+def model_available(m: Dict[str, Any]) -> bool:
+    st = _state(m)
+    return True if st is None else bool(st.get("available", True))
+
+
+def model_penalty(m: Dict[str, Any]) -> float:
+    """0 = sano; stessa formula del gateway (2*error_rate + latenza EWMA/60s, saturata)."""
+    st = _state(m)
+    if st is None:
+        return 0.0
+    lat = min(1.0, float(st.get("latency_ewma_s") or 0.0) / 60.0)
+    return 2.0 * float(st.get("error_rate") or 0.0) + lat
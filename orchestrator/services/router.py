@@ -1,5 +1,8 @@
 # Model routing logic for schemaVersion:2.1 as per your models.yaml.
 # Priority: pinned profile -> fallback list -> selector criteria -> global default
+# (pinned/fallback/candidates with an open provider breaker on the gateway are skipped)
+# scoring.mode: measured (or ROUTING_SCORE_MODE) ranks selector candidates by latency/tok-s/
+# failure/cost measured per phase from Harper telemetry instead of the static YAML labels
 # Robust to:
 #  - model/fallback nested under 'select' (we normalize)
 #  - 'embedding' vs 'embeddings' modality
@@ -8,11 +11,13 @@
 # Global policy overrides (soft): NEVER_SEND_SOURCE_TO_CLOUD / prefer_local_for_codegen / prefer_frontier_for_reasoning
 from __future__ import annotations
 from typing import Dict, Any, List, Optional, Literal, Tuple
-import yaml
 import os
 import logging
 
 from config import settings
+from services.provider_health import model_available, model_penalty
+from services import routing_stats
+from services.model_catalog import get_catalog
 
 Task = Literal["spec","plan","kit","build","chat"]
 
@@ -112,12 +117,8 @@ def _resolve_models_path() -> str:
 
 def _load_cfg() -> dict:
     #p = _resolve_models_path()
-    p = os.getenv("MODELS_CONFIG_", "/workspace/configs/models.yaml")
-
-    with open(p, "r", encoding="utf-8") as f:
-          data = yaml.safe_load(f) or {}
-    #logging.getLogger("router").info("Loaded models.yaml: %s", data)
-    return data
+    # catalogo in memoria con hot reload su mtime (niente parse YAML per resolve): sola lettura
+    return get_catalog(os.getenv("MODELS_CONFIG_", "/workspace/configs/models.yaml")).cfg
 
 
 def _apply_policy(task: str, chosen: dict, m_all: dict) -> dict:
@@ -193,13 +194,32 @@ def _quality_signal(tags: List[str]) -> int:
         score -= 1
     return score
 
-def _score(m: Dict[str, Any], w: Dict[str, float]) -> float:
+def _score(m: Dict[str, Any], w: Dict[str, float], measured: Optional[Dict[str, Any]] = None) -> float:
     cap = _CAP_ORD.get(m.get("capability","small"), 1)
     lat = _LAT_ORD.get(m.get("latency","medium"), 1)
     cost = _COST_ORD.get(m.get("cost","medium"), 1)
     qual = _quality_signal(m.get("tags", []))
+    fail = 0.0
+    # measured mode: latency/cost/failure from gateway telemetry (norm 0 = best, 0.5 = phase median)
+    if measured:
+        norm = measured.get("norm") or {}
+        if norm.get("latency") is not None:
+            lat = 3.0 * (1.0 - norm["latency"])
+        if norm.get("cost") is not None:
+            cost = 3.0 * (1.0 - norm["cost"])
+        fail = norm.get("failure") or 0.0
     return (cap*w.get("capability",0.5) + lat*w.get("latency",0.2)
-            + cost*w.get("cost",0.2) + qual*w.get("quality",0.1))
+            + cost*w.get("cost",0.2) + qual*w.get("quality",0.1)
+            - 3.0*fail*w.get("reliability",0.3))
+
+_INDEX_MEMO: List[Any] = [None, {}]  # [cfg, index]: il riferimento a cfg evita riusi di id()
+
+def _catalog_index(cfg: Dict[str,Any]) -> Dict[str, Dict[str,Any]]:
+    # indice normalizzato precalcolato per versione del catalogo (cfg è condiviso e immutabile)
+    if _INDEX_MEMO[0] is not cfg:
+        _INDEX_MEMO[1] = _index_models(cfg.get("models") or [])
+        _INDEX_MEMO[0] = cfg
+    return _INDEX_MEMO[1]
 
 def _index_models(models: List[Dict[str,Any]]) -> Dict[str, Dict[str,Any]]:
     idx = {}
@@ -259,7 +279,6 @@ def _normalize_profile(profile: Dict[str,Any]) -> Dict[str,Any]:
 def resolve(task: Task, hint: Optional[str] = None) -> Tuple[Dict[str,Any], List[str]]:
     cfg = _load_cfg()
     logging.info(f"Resolving task={task} with hint={hint}")
-    models = cfg.get("models") or []
     profiles = cfg.get("profiles") or {}
     routing = cfg.get("routing") or {}
     weights = (cfg.get("scoring") or {}).get("weights", {})
@@ -268,7 +287,7 @@ def resolve(task: Task, hint: Optional[str] = None) -> Tuple[Dict[str,Any], List
     
     log.info(f"Resolving profiles={profiles} ")
     log.info(f"Resolving routing={routing} with weights={weights}")
-    m_index = _index_models(models)
+    m_index = _catalog_index(cfg)
     m_all = list(m_index.values())
 
     warnings: List[str] = []
@@ -280,13 +299,17 @@ def resolve(task: Task, hint: Optional[str] = None) -> Tuple[Dict[str,Any], List
 
     chosen: Dict[str,Any] = {}
 
-    # 1) Pinned model
+    # 1) Pinned model (saltato se il breaker del provider è aperto)
+    unhealthy: List[Dict[str,Any]] = []
     pinned = profile.get("model")
     pinned_list = pinned if isinstance(pinned, list) else [pinned] if pinned else []
     for mid in pinned_list:
         if mid in m_index:
-            chosen = m_index[mid]
-            break
+            if model_available(m_index[mid]):
+                chosen = m_index[mid]
+                break
+            unhealthy.append(m_index[mid])
+            warnings.append(f"pinned model '{mid}' unhealthy (breaker open)")
         else:
             warnings.append(f"pinned model '{mid}' not found")
 
@@ -294,29 +317,40 @@ def resolve(task: Task, hint: Optional[str] = None) -> Tuple[Dict[str,Any], List
     if not chosen:
         for mid in (profile.get("fallback") or []):
             if mid in m_index:
-                chosen = m_index[mid]; break
+                if model_available(m_index[mid]):
+                    chosen = m_index[mid]; break
+                unhealthy.append(m_index[mid])
+                warnings.append(f"fallback model '{mid}' unhealthy (breaker open)")
             else:
                 warnings.append(f"fallback model '{mid}' not found")
 
-    # 3) Selector criteria
+    # 3) Selector criteria (solo modelli sani; penalità da latenza/error-rate EWMA)
     if not chosen:
-        cands = _filter_by_selector(m_all, profile.get("select") or {})
+        cands = [m for m in _filter_by_selector(m_all, profile.get("select") or {}) if model_available(m)]
         if cands:
-            chosen = max(cands, key=lambda m: _score(m, weights))
+            hw = weights.get("health", 0.5)
+            measured = routing_stats.score_mode(cfg) == "measured"
+            chosen = max(cands, key=lambda m: _score(m, weights, routing_stats.lookup(m, task) if measured else None)
+                                              - hw * model_penalty(m))
+
+    # 4) Nessun modello sano: meglio il primo pin/fallback che il default globale
+    if not chosen and unhealthy:
+        chosen = unhealthy[0]
+        warnings.append(f"no healthy candidate: using '{_model_id(chosen)}' anyway")
 
-    # 4) Global default
+    # 5) Global default
     if not chosen and m_all:
         chosen = m_all[0]
         warnings.append("no match: using first enabled model as default")
 
-    # 5) Policy overrides (soft)
-    chosen = _apply_policy(task, chosen, m_all)
+    # 6) Policy overrides (soft)
+    chosen = dict(_apply_policy(task, chosen, m_all))  # copia: l'indice è condiviso tra le resolve
     chosen["profile"] = profile_name  # es. "plan.fast" / "code.strict" / ...
     # policy semplice: se il modello è cloud (privacy low) attiva redaction
     if chosen.get("privacy") == "low":
         chosen["redact_source"] = True
 
-    # 6) Redaction/flags
+    # 7) Redaction/flags
     is_cloud = chosen.get("provider") in {"openai","anthropic","azure","google","deepseek"}
     payload = {
         "id": _model_id(chosen),
@@ -0,0 +1,56 @@
+# orchestrator/services/routing_stats.py
+"""
+Statistiche misurate per lo scoring adattivo del router (scoring.mode: measured).
+
+Calcolate dal gateway sulla telemetria Harper (p50/p95 latenza, tokens/sec, failure rate,
+costo per fase) ed esposte su GET {GATEWAY_URL}/v1/metrics/routing; qui vengono lette
+da un task di background (services.gateway_poller) ogni ROUTING_STATS_TTL_S secondi; il
+router legge solo la cache. Gateway non raggiungibile → etichette statiche.
+"""
+from __future__ import annotations
+
+import logging
+import os
+from typing import Any, Dict, Optional
+
+from services.gateway_poller import GatewayPoller, register
+
+log = logging.getLogger("router.routing_stats")
+
+TTL_S = float(os.getenv("ROUTING_STATS_TTL_S", "60"))
+TIMEOUT_S = float(os.getenv("ROUTING_STATS_TIMEOUT_S", "2"))
+SCORE_MODE = os.getenv("ROUTING_SCORE_MODE", "static").strip().lower()  # static | measured
+
+ALL_PHASES = "*"
+
+_cache: Dict[str, Any] = {"phases": {}}
+
+
+def score_mode(cfg: Optional[Dict[str, Any]]) -> str:
+    # models.yaml scoring.mode ha la precedenza sull'env
+    return str(((cfg or {}).get("scoring") or {}).get("mode") or SCORE_MODE).strip().lower()
+
+
+def _on_data(data: Optional[Dict[str, Any]]) -> None:
+    _cache["phases"] = (data or {}).get("phases") or {}
+
+
+POLLER = register(GatewayPoller("routing_stats", "/v1/metrics/routing", TTL_S, TIMEOUT_S, _on_data))
+
+
+def _phases() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    return _cache["phases"]
+
+
+def lookup(m: Dict[str, Any], phase: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Stats misurate del modello per la fase (fallback: tutte le fasi) o None se insufficienti."""
+    phases = _phases()
+    provider = (m.get("provider") or "").lower()
+    keys = [f"{provider}:{m.get(k)}" for k in ("id", "name", "remote_name") if m.get(k)]
+    for ph in ([(phase or "").lower()] if phase else []) + [ALL_PHASES]:
+        by_model = phases.get(ph) or {}
+        for k in keys:
+            s = by_model.get(k)
+            if s and s.get("measured"):
+                return s
+    return None
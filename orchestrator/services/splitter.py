@@ -3,7 +3,7 @@ from __future__ import annotations
 import ast
 import re
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Any
+from typing import List, Optional, Dict, Any, Tuple
 
 # TS parsing via tree-sitter
 try:
@@ -60,6 +60,45 @@ def split_python_per_symbol(code: str) -> List[Symbol]:
         return [Symbol(name="generated", kind="unknown", content=code)]
     return out
 
+def python_symbol_spans(code: str) -> Optional[List[Tuple[str, str, int, int]]]:
+    """
+    Confini dei simboli Python per il chunking RAG: [(name, kind, start_line, end_line)]
+    (1-based, inclusivi, decoratori compresi) per classi/funzioni top-level e metodi di classe.
+    None se il codice non è parsabile.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    defs = (ast.ClassDef, ast.FunctionDef, ast.AsyncFunctionDef)
+
+    def _span(node: ast.AST, kind: str) -> Tuple[str, str, int, int]:
+        start = min([node.lineno] + [d.lineno for d in getattr(node, "decorator_list", [])])
+        return (node.name, kind, start, getattr(node, "end_lineno", node.lineno))
+
+    out: List[Tuple[str, str, int, int]] = []
+    for node in tree.body:
+        if not isinstance(node, defs):
+            continue
+        if isinstance(node, ast.ClassDef):
+            out.append(_span(node, "class"))
+            out.extend(_span(ch, "method") for ch in node.body if isinstance(ch, defs))
+        else:
+            out.append(_span(node, "function"))
+    return out
+
+def ts_top_level_spans(code: str) -> Optional[List[Tuple[str, int, int]]]:
+    """
+    Nodi top-level TypeScript via tree-sitter: [(node_type, start_byte, end_byte)] sui byte UTF-8.
+    None se tree-sitter non è disponibile.
+    """
+    if _TS_LANG is None or Parser is None:
+        return None
+    parser = Parser()
+    parser.set_language(_TS_LANG)
+    tree = parser.parse(bytes(code, "utf8"))
+    return [(n.type, n.start_byte, n.end_byte) for n in tree.root_node.children]
+
 # -------- TypeScript: tree-sitter (class/function top-level) ----------
 def split_ts_per_symbol(code: str) -> List[Symbol]:
     if _TS_LANG is None or Parser is None:
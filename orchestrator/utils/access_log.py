@@ -0,0 +1,192 @@
+# orchestrator/utils/access_log.py
+"""
+Access log ASGI "puro" + istogrammi di latenza per route.
+
+- Nessun buffering: la dimensione di request/response si conta sui messaggi ASGI mentre passano
+  (http.request / http.response.body), il body non viene mai letto dal middleware → un payload
+  Harper da decine di MB resta in memoria una volta sola (nel handler), non due.
+- Log JSON su una riga (logger "orchestrator.access"): method, route (template FastAPI, es.
+  /v1/blobs/{handle}), path, status, dur_ms, ttfb_ms, req_bytes, resp_bytes, request_id, trace_id.
+- Campionamento: ACCESS_LOG_SAMPLE (0..1) sulle richieste normali; errori (5xx) e richieste lente
+  (≥ ACCESS_LOG_SLOW_MS) sono sempre loggati. ACCESS_LOG_SKIP: prefissi esclusi dal log
+  (restano negli istogrammi).
+- Istogrammi per (method, route) a bucket fissi: snapshot() con conteggi e p50/p95/p99 stimati.
+"""
+from __future__ import annotations
+
+import bisect
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from utils import tracing
+
+log = logging.getLogger("orchestrator.access")
+
+ACCESS_LOG_SAMPLE = float(os.getenv("ACCESS_LOG_SAMPLE", "1.0"))
+ACCESS_LOG_SLOW_MS = float(os.getenv("ACCESS_LOG_SLOW_MS", "5000"))
+ACCESS_LOG_SKIP = tuple(p for p in os.getenv("ACCESS_LOG_SKIP", "/health,/static").split(",") if p)
+
+# limiti superiori dei bucket in secondi (l'ultimo bucket implicito è +Inf)
+LATENCY_BUCKETS: Tuple[float, ...] = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0,
+)
+
+
+class _Histogram:
+    __slots__ = ("counts", "sum", "count", "status")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self.status: Dict[str, int] = {}
+
+    def observe(self, seconds: float, status: int) -> None:
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        self.sum += seconds
+        self.count += 1
+        cls = f"{status // 100}xx"
+        self.status[cls] = self.status.get(cls, 0) + 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        # limite superiore del bucket che contiene il quantile (stima conservativa)
+        if not self.count:
+            return None
+        rank = q * self.count
+        acc = 0
+        for i, c in enumerate(self.counts):
+            acc += c
+            if acc >= rank:
+                return LATENCY_BUCKETS[i] if i < len(LATENCY_BUCKETS) else float("inf")
+        return float("inf")
+
+
+class LatencyHistograms:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._h: Dict[Tuple[str, str], _Histogram] = {}
+
+    def observe(self, method: str, route: str, seconds: float, status: int) -> None:
+        with self._lock:
+            h = self._h.get((method, route))
+            if h is None:
+                h = self._h[(method, route)] = _Histogram()
+            h.observe(seconds, status)
+
+    def items(self) -> List[Tuple[str, str, List[int], float, int, Dict[str, int]]]:
+        """Copia consistente: (method, route, counts per bucket, sum, count, status)."""
+        with self._lock:
+            return [(m, r, list(h.counts), h.sum, h.count, dict(h.status)) for (m, r), h in self._h.items()]
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            routes = []
+            for (m, r), h in sorted(self._h.items()):
+                routes.append({
+                    "method": m,
+                    "route": r,
+                    "count": h.count,
+                    "mean_ms": round(1000 * h.sum / h.count, 1) if h.count else None,
+                    "p50_le_s": h.quantile(0.50),
+                    "p95_le_s": h.quantile(0.95),
+                    "p99_le_s": h.quantile(0.99),
+                    "status": dict(h.status),
+                })
+        return {"buckets_s": list(LATENCY_BUCKETS), "routes": routes}
+
+
+_HISTOGRAMS = LatencyHistograms()
+_IN_FLIGHT = [0]  # richieste HTTP in corso (solo event loop: niente lock)
+
+
+def histograms() -> LatencyHistograms:
+    return _HISTOGRAMS
+
+
+def in_flight() -> int:
+    return _IN_FLIGHT[0]
+
+
+def _route_of(scope: Dict[str, Any]) -> str:
+    # template della route (cardinalità bassa); le richieste senza match finiscono in "unmatched"
+    route = scope.get("route")
+    path = getattr(route, "path", None) or getattr(route, "path_format", None)
+    return path or "unmatched"
+
+
+class AccessLogMiddleware:
+    def __init__(self, app, *, sample_rate: float = ACCESS_LOG_SAMPLE, slow_ms: float = ACCESS_LOG_SLOW_MS,
+                 skip_prefixes: Tuple[str, ...] = ACCESS_LOG_SKIP):
+        self.app = app
+        self.sample_rate = max(0.0, min(1.0, float(sample_rate)))
+        self.slow_ms = float(slow_ms)
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        t0 = time.perf_counter()
+        st = {"status": 500, "req": 0, "resp": 0, "ttfb": None}
+
+        async def _receive():
+            msg = await receive()
+            if msg["type"] == "http.request":
+                st["req"] += len(msg.get("body") or b"")
+            return msg
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                st["status"] = msg["status"]
+                st["ttfb"] = time.perf_counter() - t0
+            elif msg["type"] == "http.response.body":
+                st["resp"] += len(msg.get("body") or b"")
+            await send(msg)
+
+        _IN_FLIGHT[0] += 1
+        try:
+            await self.app(scope, _receive, _send)
+        finally:
+            _IN_FLIGHT[0] -= 1
+            dur = time.perf_counter() - t0
+            route = _route_of(scope)
+            _HISTOGRAMS.observe(scope.get("method", ""), route, dur, st["status"])
+            self._log(scope, route, dur, st)
+
+    def _log(self, scope, route: str, dur: float, st: Dict[str, Any]) -> None:
+        path = scope.get("path", "")
+        dur_ms = dur * 1000
+        status = st["status"]
+        important = status >= 500 or dur_ms >= self.slow_ms
+        if not important:
+            if path.startswith(self.skip_prefixes):
+                return
+            if self.sample_rate < 1.0 and random.random() >= self.sample_rate:
+                return
+        headers = dict(scope.get("headers") or [])
+        client = scope.get("client")
+        rec = {
+            "method": scope.get("method"),
+            "route": route,
+            "path": path,
+            "status": status,
+            "dur_ms": round(dur_ms, 1),
+            "ttfb_ms": round(st["ttfb"] * 1000, 1) if st["ttfb"] is not None else None,
+            "req_bytes": st["req"],
+            "resp_bytes": st["resp"],
+            "ct": headers.get(b"content-type", b"").decode("latin-1") or None,
+            "request_id": headers.get(b"x-request-id", b"").decode("latin-1") or None,
+            "trace_id": tracing.current_trace_id(),
+            "client": client[0] if client else None,
+        }
+        line = json.dumps(rec, ensure_ascii=False, separators=(",", ":"))
+        if status >= 500:
+            log.warning(line)
+        else:
+            log.info(line)
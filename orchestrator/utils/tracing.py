@@ -0,0 +1,411 @@
+# orchestrator/utils/tracing.py
+"""
+Tracing distribuito minimale (W3C Trace Context) senza dipendenze esterne.
+
+- Propagazione: header `traceparent` (00-<trace_id 32 hex>-<span_id 16 hex>-<flags>); in
+  alternativa lo stesso valore in `x-request-id`. Un x-request-id "libero" (non traceparent)
+  viene mappato su un trace_id stabile (sha256) così le richieste con lo stesso id si ritrovano.
+- TracingMiddleware (ASGI puro): span server "http <METHOD> <route>" per ogni richiesta, risposta
+  con `traceparent` e `x-trace-id` per risalire al trace dal client.
+- span(name, **attrs): context manager (sync, usabile anche in codice async) che annida lo span
+  sotto quello corrente (ContextVar → segue i task asyncio), registra errori ed esporta all'uscita.
+- inject(headers): aggiunge traceparent/x-request-id alle chiamate verso servizi interni
+  (orchestrator → gateway, gateway → /v1/embeddings e /v1/rag).
+- Exporter locale: thread daemon che appende gli span in JSONL su
+  TRACE_DIR (default <HARPER_TELEMETRY_DIR>/.traces/spans-YYYYMMDD.jsonl). La directory è "nascosta"
+  perché l'indice di utils/telemetry_store salta le dir con il punto: gli span non sono record Harper.
+- Rotazione/retention (nel thread dell'exporter): oltre TRACE_MAX_FILE_MB il file del giorno prosegue
+  in spans-YYYYMMDD.N.jsonl; ogni TRACE_SWEEP_S si cancellano i file più vecchi di TRACE_RETENTION_DAYS
+  e, dal più vecchio, quanto serve a stare sotto TRACE_MAX_TOTAL_MB (0 = nessun limite).
+"""
+from __future__ import annotations
+
+import contextvars
+import glob
+import hashlib
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+log = logging.getLogger("orchestrator.tracing")
+
+SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "orchestrator")
+TRACING = os.getenv("TRACING", "1").strip().lower() in ("1", "true", "yes", "on")
+TRACE_DIR = os.getenv("TRACE_DIR") or os.path.join(os.getenv("HARPER_TELEMETRY_DIR", "/workspace/telemetry"), ".traces")
+TRACE_QUEUE = int(os.getenv("TRACE_QUEUE", "10000"))
+TRACE_MAX_FILE_MB = float(os.getenv("TRACE_MAX_FILE_MB", "64"))
+TRACE_MAX_TOTAL_MB = float(os.getenv("TRACE_MAX_TOTAL_MB", "1024"))
+TRACE_RETENTION_DAYS = float(os.getenv("TRACE_RETENTION_DAYS", "7"))
+TRACE_SWEEP_S = float(os.getenv("TRACE_SWEEP_S", "600"))
+TRACE_SKIP = tuple(p for p in os.getenv("TRACE_SKIP", "/health,/static,/metrics").split(",") if p)
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+
+def parse_traceparent(value: Any) -> Optional[Tuple[str, str, bool]]:
+    """'00-<trace>-<parent>-<flags>' → (trace_id, parent_span_id, sampled); None se non valido."""
+    if not isinstance(value, str):
+        return None
+    m = _TRACEPARENT.match(value.strip().lower())
+    if not m or m.group(1) == "ff":
+        return None
+    trace_id, parent_id = m.group(2), m.group(3)
+    if trace_id == "0" * 32 or parent_id == "0" * 16:
+        return None
+    return trace_id, parent_id, bool(int(m.group(4), 16) & 0x01)
+
+
+def format_traceparent(trace_id: str, span_id: str, sampled: bool = True) -> str:
+    return f"00-{trace_id}-{span_id}-{'01' if sampled else '00'}"
+
+
+def new_trace_id() -> str:
+    return secrets.token_hex(16)
+
+
+def new_span_id() -> str:
+    return secrets.token_hex(8)
+
+
+def context_from_headers(traceparent: Optional[str], request_id: Optional[str]) -> Tuple[str, Optional[str]]:
+    """(trace_id, parent_span_id) dagli header in ingresso; nuovo trace se non c'è nulla di utile."""
+    ctx = parse_traceparent(traceparent) or parse_traceparent(request_id)
+    if ctx:
+        return ctx[0], ctx[1]
+    if request_id:
+        return hashlib.sha256(request_id.encode("utf-8", "ignore")).hexdigest()[:32], None
+    return new_trace_id(), None
+
+
+class Span:
+    __slots__ = ("name", "kind", "trace_id", "span_id", "parent_id", "attrs", "start", "_t0",
+                 "duration_ms", "status", "error", "_ended")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], kind: str = "internal",
+                 attrs: Optional[Dict[str, Any]] = None):
+        self.name = name
+        self.kind = kind
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.attrs: Dict[str, Any] = dict(attrs or {})
+        self.start = time.time()
+        self._t0 = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.status = "ok"
+        self.error: Optional[str] = None
+        self._ended = False
+
+    def set(self, **attrs) -> "Span":
+        self.attrs.update(attrs)
+        return self
+
+    def fail(self, exc: BaseException | str) -> "Span":
+        self.status = "error"
+        self.error = exc if isinstance(exc, str) else f"{type(exc).__name__}: {exc}"[:500]
+        return self
+
+    @property
+    def traceparent(self) -> str:
+        return format_traceparent(self.trace_id, self.span_id)
+
+    def end(self) -> None:
+        if self._ended:
+            return
+        self._ended = True
+        self.duration_ms = (time.perf_counter() - self._t0) * 1000
+        exporter().submit(self)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "service": SERVICE_NAME,
+            "name": self.name,
+            "kind": self.kind,
+            "ts": self.start,
+            "duration_ms": round(self.duration_ms or 0.0, 2),
+            "status": self.status,
+            "error": self.error,
+            "attrs": self.attrs,
+        }
+
+
+_CURRENT: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar("trace_span", default=None)
+
+
+def current() -> Optional[Span]:
+    return _CURRENT.get()
+
+
+def current_trace_id() -> Optional[str]:
+    sp = _CURRENT.get()
+    return sp.trace_id if sp else None
+
+
+def start_span(name: str, *, kind: str = "internal", parent: Optional[Span] = None,
+               trace_id: Optional[str] = None, parent_id: Optional[str] = None, **attrs) -> Span:
+    """Span non attivato (non diventa il corrente): va chiuso con span.end()."""
+    parent = parent or _CURRENT.get()
+    if trace_id is None:
+        trace_id = parent.trace_id if parent else new_trace_id()
+        parent_id = parent.span_id if parent else None
+    return Span(name, trace_id, parent_id, kind, attrs)
+
+
+@contextmanager
+def span(name: str, *, kind: str = "internal", **attrs) -> Iterator[Span]:
+    sp = start_span(name, kind=kind, **attrs)
+    token = _CURRENT.set(sp)
+    try:
+        yield sp
+    except BaseException as e:
+        sp.fail(e)
+        raise
+    finally:
+        _CURRENT.reset(token)
+        sp.end()
+
+
+def inject(headers: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """Header di propagazione per una chiamata verso un servizio interno (copia di headers)."""
+    out = dict(headers or {})
+    sp = _CURRENT.get()
+    if sp is not None:
+        out["traceparent"] = sp.traceparent
+        out.setdefault("x-request-id", sp.traceparent)
+    return out
+
+
+# --- exporter --------------------------------------------------------------------
+
+class _Exporter:
+    """Coda bounded + thread di scrittura: submit() non fa mai I/O sul chiamante."""
+
+    def __init__(self, directory: str = TRACE_DIR, maxsize: int = TRACE_QUEUE):
+        self.directory = directory
+        self.enabled = TRACING
+        self._q: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue(maxsize=max(1, maxsize))
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.exported = 0
+        self.dropped = 0
+        self.errors = 0
+        self.removed = 0
+        self._part: Tuple[str, int] = ("", 0)  # (giorno, indice del file corrente)
+        self._swept_at = 0.0
+
+    def _ensure_thread(self) -> None:
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def submit(self, sp: Span) -> None:
+        if not self.enabled:
+            return
+        self._ensure_thread()
+        try:
+            self._q.put_nowait(sp.to_dict())
+        except queue.Full:
+            self.dropped += 1
+
+    def _file(self, day: str, part: int) -> str:
+        return os.path.join(self.directory, f"spans-{day}.jsonl" if part == 0 else f"spans-{day}.{part}.jsonl")
+
+    def _path(self) -> str:
+        # primo file del giorno sotto TRACE_MAX_FILE_MB (i due servizi convergono sugli stessi nomi)
+        day = time.strftime("%Y%m%d", time.gmtime())
+        part = self._part[1] if self._part[0] == day else 0
+        cap = TRACE_MAX_FILE_MB * 1024 * 1024
+        while cap > 0:
+            try:
+                if os.path.getsize(self._file(day, part)) < cap:
+                    break
+            except OSError:
+                break
+            part += 1
+        self._part = (day, part)
+        return self._file(day, part)
+
+    def _sweep(self) -> None:
+        now = time.time()
+        if now - self._swept_at < TRACE_SWEEP_S:
+            return
+        self._swept_at = now
+        files = []
+        for path in glob.glob(os.path.join(self.directory, "spans-*.jsonl")):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+        files.sort()
+        total = sum(f[1] for f in files)
+        cutoff = now - TRACE_RETENTION_DAYS * 86400 if TRACE_RETENTION_DAYS > 0 else None
+        cap = TRACE_MAX_TOTAL_MB * 1024 * 1024
+        for mtime, size, path in files[:-1]:  # mai il file in scrittura (il più recente)
+            if not ((cutoff is not None and mtime < cutoff) or (cap > 0 and total > cap)):
+                break
+            try:
+                os.unlink(path)
+                self.removed += 1
+            except OSError:
+                pass  # già rimosso dall'altro servizio
+            total -= size
+
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        data = "".join(json.dumps(r, ensure_ascii=False, default=str) + "\n" for r in batch)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(), "a", encoding="utf-8") as f:
+                f.write(data)
+            self.exported += len(batch)
+        except Exception as e:
+            self.errors += 1
+            log.warning("trace export failed (%d spans): %s", len(batch), e)
+
+    def _run(self) -> None:
+        while True:
+            rec = self._q.get()
+            stop = rec is None
+            batch = [] if stop else [rec]
+            while len(batch) < 500:
+                try:
+                    rec = self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if rec is None:
+                    stop = True
+                    break
+                batch.append(rec)
+            if batch:
+                self._write(batch)
+            try:
+                self._sweep()
+            except Exception as e:
+                log.warning("trace retention sweep failed: %s", e)
+            if stop:
+                return
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Svuota la coda e ferma il thread (il prossimo submit lo riavvia)."""
+        th = self._thread
+        if th is None or not th.is_alive():
+            return
+        try:
+            self._q.put(None, timeout=timeout)
+        except queue.Full:
+            return
+        th.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "dir": self.directory,
+            "queued": self._q.qsize(),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "files_removed": self.removed,
+        }
+
+
+_EXPORTER: Optional[_Exporter] = None
+
+
+def exporter() -> _Exporter:
+    global _EXPORTER
+    if _EXPORTER is None:
+        _EXPORTER = _Exporter()
+    return _EXPORTER
+
+
+def shutdown() -> None:
+    if _EXPORTER is not None:
+        _EXPORTER.flush()
+
+
+def read_trace(trace_id: str, *, days: int = 2) -> List[Dict[str, Any]]:
+    """Span di un trace dai file degli ultimi `days` giorni (incluse le parti ruotate), ordinati per inizio."""
+    trace_id = (trace_id or "").strip().lower()
+    needle = f'"trace_id": "{trace_id}"'
+    out: List[Dict[str, Any]] = []
+    now = time.time()
+    for d in range(max(1, days)):
+        day = time.strftime("%Y%m%d", time.gmtime(now - d * 86400))
+        for path in glob.glob(os.path.join(exporter().directory, f"spans-{day}*.jsonl")):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if needle in line:
+                            try:
+                                out.append(json.loads(line))
+                            except ValueError:
+                                continue
+            except FileNotFoundError:
+                continue
+    out.sort(key=lambda r: r.get("ts") or 0)
+    return out
+
+
+# --- ASGI ------------------------------------------------------------------------
+
+def _route_of(scope: Dict[str, Any]) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or getattr(route, "path_format", None) or "unmatched"
+
+
+class TracingMiddleware:
+    def __init__(self, app, *, skip_prefixes: Tuple[str, ...] = TRACE_SKIP):
+        self.app = app
+        self.skip_prefixes = skip_prefixes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING or scope.get("path", "").startswith(self.skip_prefixes):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        tp = headers.get(b"traceparent", b"").decode("latin-1") or None
+        rid = headers.get(b"x-request-id", b"").decode("latin-1") or None
+        trace_id, parent_id = context_from_headers(tp, rid)
+        sp = Span(f"http {scope.get('method', '')}", trace_id, parent_id, "server",
+                  {"http.method": scope.get("method"), "http.path": scope.get("path")})
+        if rid:
+            sp.attrs["request_id"] = rid
+
+        async def _send(msg):
+            if msg["type"] == "http.response.start":
+                sp.attrs["http.status_code"] = msg["status"]
+                sp.attrs["ttfb_ms"] = round((time.perf_counter() - sp._t0) * 1000, 1)
+                msg["headers"] = list(msg.get("headers") or []) + [
+                    (b"traceparent", sp.traceparent.encode("latin-1")),
+                    (b"x-trace-id", trace_id.encode("latin-1")),
+                ]
+            await send(msg)
+
+        token = _CURRENT.set(sp)
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as e:
+            sp.fail(e)
+            raise
+        finally:
+            _CURRENT.reset(token)
+            route = _route_of(scope)
+            sp.name = f"http {scope.get('method', '')} {route}"
+            sp.attrs["http.route"] = route
+            if (sp.attrs.get("http.status_code") or 500) >= 500 and sp.status == "ok":
+                sp.status = "error"
+            sp.end()